@@ -0,0 +1,180 @@
+import numpy
+
+from KeyframeReducer import reduce_channels, get_channels_size
+
+
+# Interpolation modes which can be sampled without calling fcurve.evaluate
+LINEAR_INTERPOLATIONS = ("LINEAR", "CONSTANT")
+
+# Below this value, the euler conversion is in gimbal lock. Matches blender,
+# which uses 16 * FLT_EPSILON
+GIMBAL_LOCK_EPSILON = 16.0 * numpy.finfo(numpy.float32).eps
+
+
+def sample_fcurve(curve, num_frames, frame_step=1.0):
+    """ Samples a curve at num_frames frames, starting at frame 0 and
+    advancing by frame_step. The curve can also be a plain value, for
+    channels without animation """
+    if not hasattr(curve, "keyframe_points"):
+        return numpy.full(num_frames, curve, dtype=numpy.float64)
+
+    keyframes = curve.keyframe_points
+    num_keys = len(keyframes)
+
+    if num_keys > 0 and len(curve.modifiers) == 0:
+        coords = numpy.empty(num_keys * 2, dtype=numpy.float32)
+        keyframes.foreach_get("co", coords)
+        key_frames, key_values = coords[0::2].astype(numpy.float64), coords[1::2].astype(numpy.float64)
+
+        # Flat curves are constant, regardless of their interpolation
+        handles_left = numpy.empty(num_keys * 2, dtype=numpy.float32)
+        handles_right = numpy.empty(num_keys * 2, dtype=numpy.float32)
+        keyframes.foreach_get("handle_left", handles_left)
+        keyframes.foreach_get("handle_right", handles_right)
+        if (key_values == key_values[0]).all() and (handles_left[1::2] == coords[1]).all() and \
+           (handles_right[1::2] == coords[1]).all():
+            return numpy.full(num_frames, key_values[0], dtype=numpy.float64)
+
+        interpolations = [keyframe.interpolation for keyframe in keyframes]
+        if curve.extrapolation == "CONSTANT" and all(mode in LINEAR_INTERPOLATIONS for mode in interpolations[:-1]):
+            return _sample_linear(key_frames, key_values, interpolations, num_frames, frame_step)
+
+    # Fall back to blender for bezier curves and curves with modifiers
+    return numpy.fromiter((curve.evaluate(i * frame_step) for i in range(num_frames)),
+                          dtype=numpy.float64, count=num_frames)
+
+
+def _sample_linear(key_frames, key_values, interpolations, num_frames, frame_step):
+    """ Samples a curve with linear and constant keyframes """
+    frames = numpy.arange(num_frames, dtype=numpy.float64) * frame_step
+    values = numpy.interp(frames, key_frames, key_values)
+
+    # Constant keyframes hold their value until the next keyframe
+    is_constant = numpy.array([mode == "CONSTANT" for mode in interpolations])
+    if is_constant.any():
+        segment = numpy.searchsorted(key_frames, frames, side="right") - 1
+        in_range = (segment >= 0) & (segment < len(key_frames) - 1)
+        use_constant = in_range & is_constant[numpy.clip(segment, 0, len(key_frames) - 1)]
+        values[use_constant] = key_values[segment[use_constant]]
+
+    return values
+
+
+def quaternions_to_matrices(w, x, y, z):
+    """ Converts arrays of quaternion components to an array of 3x3 rotation
+    matrices. Like blender, the quaternions are not normalized first """
+    matrices = numpy.empty((len(w), 3, 3), dtype=numpy.float64)
+    matrices[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    matrices[:, 0, 1] = 2.0 * (x * y - w * z)
+    matrices[:, 0, 2] = 2.0 * (x * z + w * y)
+    matrices[:, 1, 0] = 2.0 * (x * y + w * z)
+    matrices[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    matrices[:, 1, 2] = 2.0 * (y * z - w * x)
+    matrices[:, 2, 0] = 2.0 * (x * z - w * y)
+    matrices[:, 2, 1] = 2.0 * (y * z + w * x)
+    matrices[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return matrices
+
+
+def decompose_matrices(rotations, translations):
+    """ Decomposes an array of 3x3 matrices into scales and normalized
+    rotations, the same way as Matrix.decompose() """
+    scales = numpy.sqrt((rotations * rotations).sum(axis=1))
+    normalized = rotations / scales[:, numpy.newaxis, :]
+
+    # Negative scales flip the rotation
+    negative = numpy.linalg.det(rotations) < 0.0
+    normalized[negative] *= -1.0
+    scales[negative] *= -1.0
+
+    return translations, normalized, scales
+
+
+def matrices_to_euler_yxz(matrices):
+    """ Converts an array of normalized rotation matrices to euler angles in
+    YXZ order, returned as (x, y, z) arrays. Like blender, out of the two
+    possible solutions the one with the smaller angles is used """
+    m = matrices
+    cy = numpy.hypot(m[:, 1, 1], m[:, 0, 1])
+
+    x1 = -numpy.arctan2(-m[:, 2, 1], cy)
+    y1 = -numpy.arctan2(m[:, 2, 0], m[:, 2, 2])
+    z1 = -numpy.arctan2(m[:, 0, 1], m[:, 1, 1])
+
+    x2 = -numpy.arctan2(-m[:, 2, 1], -cy)
+    y2 = -numpy.arctan2(-m[:, 2, 0], -m[:, 2, 2])
+    z2 = -numpy.arctan2(-m[:, 0, 1], -m[:, 1, 1])
+
+    use_second = numpy.abs(x1) + numpy.abs(y1) + numpy.abs(z1) > numpy.abs(x2) + numpy.abs(y2) + numpy.abs(z2)
+    x = numpy.where(use_second, x2, x1)
+    y = numpy.where(use_second, y2, y1)
+    z = numpy.where(use_second, z2, z1)
+
+    # In gimbal lock, the z rotation is merged into the y rotation
+    locked = cy <= GIMBAL_LOCK_EPSILON
+    if locked.any():
+        x[locked] = x1[locked]
+        y[locked] = -numpy.arctan2(-m[locked, 0, 2], m[locked, 0, 0])
+        z[locked] = 0.0
+
+    return x, y, z
+
+
+def sample_bone_curves(curves, num_frames, frame_step=1.0):
+    """ Samples the curves (or plain values) of location x/y/z, rotation
+    quaternion w/x/y/z and scale x/y/z of a bone into a (10, num_frames)
+    array. A frame_step above 1 resamples the animation to a lower frame rate """
+    return numpy.stack([sample_fcurve(curve, num_frames, frame_step) for curve in curves])
+
+
+def bake_sampled_channels(bone_matrix, samples):
+    """ Bakes the sampled curves of a bone, as returned by sample_bone_curves.
+    Returns the scale x/y/z, heading, pitch, roll and translation x/y/z
+    channels of the AnimChannelMatrixXfmTable as a (9, num_frames) array """
+    lx, ly, lz, qw, qx, qy, qz, sx, sy, sz = samples
+
+    bone_matrix = numpy.array(bone_matrix, dtype=numpy.float64)
+
+    # Compose bone_matrix * translation * rotation * scale for all frames
+    local = quaternions_to_matrices(qw, qx, qy, qz) * numpy.stack((sx, sy, sz), axis=1)[:, numpy.newaxis, :]
+    rotations = numpy.einsum("ij,njk->nik", bone_matrix[:3, :3], local)
+    translations = numpy.stack((lx, ly, lz), axis=1).dot(bone_matrix[:3, :3].T) + bone_matrix[:3, 3]
+
+    loc, rot, scale = decompose_matrices(rotations, translations)
+    pitch, roll, heading = matrices_to_euler_yxz(rot)
+
+    channels = numpy.stack((scale[:, 0], scale[:, 1], scale[:, 2],
+                            numpy.degrees(heading), numpy.degrees(pitch), numpy.degrees(roll),
+                            loc[:, 0], loc[:, 1], loc[:, 2]))
+
+    # Blender computes in single precision, so do the same with the results.
+    # This also makes channels which are constant up to rounding errors
+    # compare equal
+    return channels.astype(numpy.float32)
+
+
+def bake_bone_channels(bone_matrix, curves, num_frames, frame_step=1.0):
+    """ Samples and bakes the curves of a bone, see sample_bone_curves and
+    bake_sampled_channels """
+    return bake_sampled_channels(bone_matrix, sample_bone_curves(curves, num_frames, frame_step))
+
+
+def bake_action(bone_matrices, bone_samples, source_num_frames, tolerances, quantize):
+    """ Bakes and reduces the sampled curves of all bones of an action. This
+    only works on plain arrays, so it can run in the worker processes.
+    Returns the reduced channels of each bone, and the size of the tables with
+    and without the lossy reduction """
+    position_tolerance, angle_tolerance, scale_tolerance = tolerances
+    baked = {}
+    original_bytes, written_bytes = 0, 0
+
+    for bone_name, samples in bone_samples.items():
+        channels = bake_sampled_channels(bone_matrices[bone_name], samples)
+        reduced = reduce_channels(channels, position_tolerance, angle_tolerance, scale_tolerance, quantize)
+
+        # Compare with the lossless reduction at the original frame rate
+        original_bytes += get_channels_size(reduce_channels(channels), source_num_frames)
+        written_bytes += get_channels_size(reduced)
+        baked[bone_name] = reduced
+
+    return baked, original_bytes, written_bytes
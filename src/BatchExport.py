@@ -0,0 +1,184 @@
+""" Exports many .blend files without user interaction, by running one
+headless blender process per file. The files are described by a json manifest:
+
+    {
+        "jobs": [
+            {
+                "blend": "levels/level1.blend",
+                "output": "models/level1.bam",
+                "groups": ["Export"],
+                "objects": [],
+                "settings": {"tex_mode": "COPY", "geometry_engine": "NUMPY"}
+            }
+        ]
+    }
+
+Relative paths are relative to the manifest. Without groups and objects, all
+objects of the scene are exported. The settings override the export settings
+stored in the .blend file. Usage:
+
+    python BatchExport.py manifest.json --blender /path/to/blender
+
+This script does not require blender itself, it only starts the workers.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "BatchExportWorker.py")
+
+
+def load_manifest(manifest_path):
+    """ Loads the manifest and makes all paths absolute """
+    with open(manifest_path, "r") as handle:
+        manifest = json.load(handle)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = manifest["jobs"] if isinstance(manifest, dict) else manifest
+
+    for job in jobs:
+        job["blend"] = os.path.join(base_dir, job["blend"])
+        if "output" not in job:
+            job["output"] = os.path.splitext(job["blend"])[0] + ".bam"
+        job["output"] = os.path.join(base_dir, job["output"])
+
+    return jobs
+
+
+def run_job(job, blender, timeout, retries, log_dir, pack_processes=None):
+    """ Exports a single file, retrying it if blender fails or times out.
+    Returns the result of the last attempt """
+    attempts = 0
+    result = None
+
+    while attempts <= retries:
+        attempts += 1
+        result = run_attempt(job, blender, timeout, log_dir, attempts, pack_processes)
+        if result["success"]:
+            break
+
+    result["attempts"] = attempts
+    return result
+
+
+def run_attempt(job, blender, timeout, log_dir, attempt, pack_processes=None):
+    """ Starts blender once to export the given file. If pack_processes is
+    set, it overrides the amount of packing processes of the job """
+    temp_dir = tempfile.mkdtemp(prefix="pbe-batch-")
+    job_path = os.path.join(temp_dir, "job.json")
+    result_path = os.path.join(temp_dir, "result.json")
+
+    if pack_processes is not None:
+        job = dict(job, settings=dict(job.get("settings", {}), pack_processes=pack_processes))
+
+    with open(job_path, "w") as handle:
+        json.dump(job, handle)
+
+    command = [blender, "--background", job["blend"], "--python", WORKER_SCRIPT,
+               "--", job_path, result_path]
+
+    start_time = time.time()
+    result = {"blend": job["blend"], "output": job["output"], "success": False, "messages": []}
+
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 timeout=timeout)
+        output = process.stdout
+
+        if os.path.isfile(result_path):
+            with open(result_path, "r") as handle:
+                result = json.load(handle)
+        else:
+            result["messages"].append(("Error", "Blender exited with code {} without a result".format(
+                process.returncode)))
+
+    except subprocess.TimeoutExpired as err:
+        output = err.output or b""
+        result["messages"].append(("Error", "Timed out after {} seconds".format(timeout)))
+
+    result["seconds"] = time.time() - start_time
+
+    # Keep the blender output of each attempt for debugging
+    if log_dir:
+        log_name = os.path.splitext(os.path.basename(job["blend"]))[0]
+        log_path = os.path.join(log_dir, "{}.{}.log".format(log_name, attempt))
+        with open(log_path, "wb") as handle:
+            handle.write(output)
+
+    for filename in (job_path, result_path):
+        if os.path.isfile(filename):
+            os.remove(filename)
+    os.rmdir(temp_dir)
+
+    return result
+
+
+def print_summary(results, duration):
+    """ Prints a short report of all jobs """
+    succeeded = [result for result in results if result["success"]]
+    failed = [result for result in results if not result["success"]]
+
+    print("-" * 50)
+    for result in results:
+        status = "OK" if result["success"] else "FAILED"
+        print("{:<7} {:>8.2f} s  {} attempt(s)  {}".format(
+            status, result["seconds"], result["attempts"], result["blend"]))
+        if not result["success"]:
+            for severity, message in result["messages"]:
+                print("        " + severity + ": " + message)
+
+    print("-" * 50)
+    print("Exported", len(succeeded), "of", len(results), "files in", round(duration, 2), "seconds,",
+          len(failed), "failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports many .blend files to .bam files")
+    parser.add_argument("manifest", help="Json manifest describing the files to export")
+    parser.add_argument("--blender", default="blender", help="Path to the blender executable")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of blender processes to run at the same time. When running "
+                        "several jobs, each export packs its geometry in a single process")
+    parser.add_argument("--timeout", type=float, default=3600.0,
+                        help="Maximum time in seconds for the export of a single file")
+    parser.add_argument("--retries", type=int, default=1,
+                        help="How often to retry a failed export")
+    parser.add_argument("--log-dir", default=None, help="Directory to store the blender output in")
+    parser.add_argument("--summary", default=None, help="Path to write a json summary to")
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest)
+
+    if args.log_dir and not os.path.isdir(args.log_dir):
+        os.makedirs(args.log_dir)
+
+    start_time = time.time()
+
+    # Each job runs in its own blender process, so threads are enough to
+    # schedule them. Parallel jobs already use all cores, so they must not
+    # start packing processes of their own on top
+    pack_processes = 1 if args.jobs > 1 else None
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = [pool.submit(run_job, job, args.blender, args.timeout, args.retries, args.log_dir,
+                               pack_processes) for job in jobs]
+        results = [future.result() for future in futures]
+
+    duration = time.time() - start_time
+    print_summary(results, duration)
+
+    if args.summary:
+        with open(args.summary, "w") as handle:
+            json.dump({"seconds": duration, "results": results}, handle, indent=4)
+
+    sys.exit(0 if all(result["success"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
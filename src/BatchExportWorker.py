@@ -0,0 +1,141 @@
+""" Exports a single .blend file without user interaction. This script runs
+inside blender, and is started by BatchExport.py for each job of the manifest:
+
+    blender --background file.blend --python BatchExportWorker.py -- job.json result.json
+"""
+
+import os
+import sys
+import json
+import time
+
+import bpy
+
+source_dir = os.path.dirname(os.path.abspath(__file__))
+if source_dir not in sys.path:
+    sys.path.insert(0, source_dir)
+
+from SceneWriter import SceneWriter
+from ExportException import ExportException
+from ExportLog import ExportLog
+
+
+class ConsoleExportLog(ExportLog):
+
+    """ Export log which only prints the messages, since there is no user
+    interface to show the status dialog in background mode """
+
+    def report(self):
+        pass
+
+    @property
+    def messages(self):
+        """ Returns all logged warnings and errors """
+        return list(self._message_queue)
+
+
+def register_exporter():
+    """ Registers the exporter modules, unless the addon is already enabled in
+    the user preferences """
+    if hasattr(bpy.types.Scene, "pbe"):
+        return
+
+    for mod_name in ["Exporter", "PBS", "PBSEngine", "ExportLog"]:
+        __import__(mod_name).register()
+
+
+def collect_objects(job):
+    """ Returns the objects to export, either from the groups and object names
+    given in the job, or all objects of the scene """
+    objects = []
+
+    for group_name in job.get("groups", []):
+        if group_name not in bpy.data.groups:
+            raise ExportException("Group '" + group_name + "' not found")
+        objects.extend(bpy.data.groups[group_name].objects)
+
+    for object_name in job.get("objects", []):
+        if object_name not in bpy.data.objects:
+            raise ExportException("Object '" + object_name + "' not found")
+        objects.append(bpy.data.objects[object_name])
+
+    if not job.get("groups") and not job.get("objects"):
+        objects = list(bpy.context.scene.objects)
+
+    # Remove duplicates, but keep the order
+    unique_objects = []
+    for obj in objects:
+        if obj not in unique_objects:
+            unique_objects.append(obj)
+    return unique_objects
+
+
+def export(job, log_instance):
+    """ Exports the currently loaded .blend file as described by the job """
+    register_exporter()
+    scene = bpy.context.scene
+
+    # Apply the settings of the job on top of the ones stored in the scene
+    for key, value in job.get("settings", {}).items():
+        if not hasattr(scene.pbe, key):
+            raise ExportException("Unknown export setting '" + key + "'")
+        setattr(scene.pbe, key, value)
+
+    objects = collect_objects(job)
+    if not objects:
+        raise ExportException("No objects to export")
+
+    # Fix scene properties first, like the export operator does
+    bpy.ops.pbepbs.set_default_textures()
+    bpy.ops.pbepbs.fix_lamp_types()
+    bpy.ops.pbepbs.fix_negative_scale()
+
+    output_dir = os.path.dirname(job["output"])
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    writer = SceneWriter()
+    writer.set_log_instance(log_instance)
+    writer.set_context(bpy.context)
+    writer.set_settings(scene.pbe)
+    writer.set_filepath(job["output"])
+    writer.set_objects(objects)
+    writer.write_bam_file()
+
+    return writer
+
+
+def main():
+    args = sys.argv[sys.argv.index("--") + 1:]
+    job_path, result_path = args[0], args[1]
+
+    with open(job_path, "r") as handle:
+        job = json.load(handle)
+
+    log_instance = ConsoleExportLog()
+    start_time = time.time()
+    result = {"blend": job["blend"], "output": job["output"], "success": False}
+
+    try:
+        writer = export(job, log_instance)
+        result["success"] = True
+        stats = writer.stats
+        result["vertices"] = stats["exported_vertices"]
+        result["triangles"] = stats["exported_tris"]
+        result["objects"] = stats["exported_objs"]
+    except ExportException as err:
+        log_instance.error("Exception during export:", err)
+    except Exception as err:
+        log_instance.error("Unexpected exception during export:", repr(err))
+
+    result["seconds"] = time.time() - start_time
+    result["messages"] = log_instance.messages
+
+    with open(result_path, "w") as handle:
+        json.dump(result, handle)
+
+    sys.exit(0 if result["success"] else 1)
+
+
+if __name__ == "__main__":
+    main()
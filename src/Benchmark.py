@@ -0,0 +1,378 @@
+""" Benchmarks the exporter on synthetic scenes of controlled size. This script
+runs inside blender and stores the results as json, so they can be compared
+between commits:
+
+    blender --background --factory-startup --python Benchmark.py -- --output results.json
+
+Pass --baseline with the results of a previous run to print the change of
+each scenario, and --max-regression to fail when a scenario got slower by
+more than the given percentage.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import bpy
+import numpy
+
+source_dir = os.path.dirname(os.path.abspath(__file__))
+if source_dir not in sys.path:
+    sys.path.insert(0, source_dir)
+
+from SceneWriter import SceneWriter
+from BatchExportWorker import ConsoleExportLog, register_exporter
+
+
+# Increment this whenever the scenarios change in a way which makes results
+# incomparable to older ones
+BENCHMARK_VERSION = 1
+
+SCENARIOS = ["geometry", "skinning", "particles", "materials"]
+
+
+def clear_scene():
+    """ Removes all objects and datablocks, so each scenario starts from an
+    empty scene """
+    scene = bpy.context.scene
+    for obj in list(scene.objects):
+        scene.objects.unlink(obj)
+
+    for collection in (bpy.data.objects, bpy.data.meshes, bpy.data.armatures, bpy.data.actions,
+                       bpy.data.particles, bpy.data.materials, bpy.data.textures, bpy.data.images):
+        for datablock in list(collection):
+            datablock.user_clear()
+            collection.remove(datablock)
+
+
+def make_grid(name, num_triangles, num_seams=0, num_materials=1):
+    """ Creates a grid mesh object with roughly the given amount of triangles.
+    The uv map is split into num_seams + 1 strips, so vertices on the strip
+    borders have to be duplicated, and the faces are assigned to the material
+    slots in bands """
+    size = max(1, int((num_triangles / 2) ** 0.5))
+    num_quads = size * size
+
+    x, y = numpy.meshgrid(numpy.arange(size + 1), numpy.arange(size + 1))
+    coords = numpy.zeros((size + 1, size + 1, 3), dtype=numpy.float32)
+    coords[..., 0] = x / size
+    coords[..., 1] = y / size
+
+    # Each quad references its four corners, counter clockwise
+    quad_x, quad_y = numpy.meshgrid(numpy.arange(size), numpy.arange(size))
+    quad_x, quad_y = quad_x.ravel(), quad_y.ravel()
+    corner = quad_y * (size + 1) + quad_x
+    loop_vertices = numpy.stack((corner, corner + 1, corner + size + 2, corner + size + 1), axis=1)
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add((size + 1) * (size + 1))
+    mesh.vertices.foreach_set("co", coords.ravel())
+    mesh.loops.add(num_quads * 4)
+    mesh.loops.foreach_set("vertex_index", loop_vertices.ravel().astype(numpy.int32))
+    mesh.polygons.add(num_quads)
+    mesh.polygons.foreach_set("loop_start", numpy.arange(0, num_quads * 4, 4, dtype=numpy.int32))
+    mesh.polygons.foreach_set("loop_total", numpy.full(num_quads, 4, dtype=numpy.int32))
+    mesh.polygons.foreach_set("material_index", (quad_x * num_materials // size).astype(numpy.int32))
+
+    # Offset the uvs of each strip, so the borders become seams
+    strip = (quad_x * (num_seams + 1) // size).repeat(4)
+    corners_x = numpy.stack((quad_x, quad_x + 1, quad_x + 1, quad_x), axis=1).ravel()
+    corners_y = numpy.stack((quad_y, quad_y, quad_y + 1, quad_y + 1), axis=1).ravel()
+    uvs = numpy.stack((corners_x / size + strip * 0.01, corners_y / size), axis=1)
+
+    mesh.uv_textures.new("UVMap")
+    mesh.uv_layers[0].data.foreach_set("uv", uvs.astype(numpy.float32).ravel())
+    mesh.update(calc_edges=True)
+
+    for i in range(num_materials):
+        mesh.materials.append(bpy.data.materials.new(name + "-Material-" + str(i)))
+
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.objects.link(obj)
+    return obj
+
+
+def make_skinned_grid(name, num_triangles, num_bones, num_frames):
+    """ Creates a grid deformed by a chain of bones. Each bone gets a rotation
+    keyframe on every frame, and each vertex is weighted to two bones """
+    scene = bpy.context.scene
+    armature = bpy.data.armatures.new(name + "-Armature")
+    armature_obj = bpy.data.objects.new(name + "-Armature", armature)
+    scene.objects.link(armature_obj)
+    scene.objects.active = armature_obj
+
+    bpy.ops.object.mode_set(mode="EDIT")
+    parent = None
+    for i in range(num_bones):
+        bone = armature.edit_bones.new("Bone-" + str(i))
+        bone.head = (0.5, i / num_bones, 0)
+        bone.tail = (0.5, (i + 1) / num_bones, 0)
+        bone.parent = parent
+        bone.use_connect = parent is not None
+        parent = bone
+    bpy.ops.object.mode_set(mode="OBJECT")
+
+    # Keyframe a swinging rotation on all bones
+    armature_obj.animation_data_create()
+    action = bpy.data.actions.new(name + "-Action")
+    armature_obj.animation_data.action = action
+    frames = numpy.arange(1, num_frames + 2, dtype=numpy.float32)
+
+    for i in range(num_bones):
+        data_path = 'pose.bones["Bone-{}"].rotation_quaternion'.format(i)
+        angle = numpy.sin(frames * 0.1 + i) * 0.25
+        values = (numpy.cos(angle), numpy.sin(angle), numpy.zeros_like(angle), numpy.zeros_like(angle))
+        for index, component in enumerate(values):
+            fcurve = action.fcurves.new(data_path, index, "Bone-" + str(i))
+            fcurve.keyframe_points.add(len(frames))
+            fcurve.keyframe_points.foreach_set("co", numpy.stack((frames, component), axis=1).ravel())
+            fcurve.update()
+
+    # Blend each row of vertices between the two closest bones
+    obj = make_grid(name, num_triangles)
+    size = int(round(len(obj.data.vertices) ** 0.5))
+    groups = [obj.vertex_groups.new("Bone-" + str(i)) for i in range(num_bones)]
+    for row in range(size):
+        position = row / size * num_bones
+        bone_index = min(int(position), num_bones - 1)
+        weight = 1.0 - (position - bone_index)
+        vertices = list(range(row * size, (row + 1) * size))
+        groups[bone_index].add(vertices, weight, "REPLACE")
+        if bone_index + 1 < num_bones and weight < 1.0:
+            groups[bone_index + 1].add(vertices, 1.0 - weight, "REPLACE")
+
+    modifier = obj.modifiers.new("Armature", "ARMATURE")
+    modifier.object = armature_obj
+    return [armature_obj, obj]
+
+
+def make_particles(name, num_particles):
+    """ Creates an emitter with a particle system instancing a small mesh """
+    instance = make_grid(name + "-Instance", 12)
+    emitter = make_grid(name, 2)
+
+    modifier = emitter.modifiers.new("Particles", "PARTICLE_SYSTEM")
+    particle_system = modifier.particle_system
+    particle_system.seed = 0
+
+    settings = particle_system.settings
+    settings.count = num_particles
+    settings.frame_start = 1
+    settings.frame_end = 1
+    settings.lifetime = 1000
+    settings.physics_type = "NO"
+    settings.render_type = "OBJECT"
+    settings.dupli_object = instance
+
+    bpy.context.scene.frame_set(1)
+    return [emitter]
+
+
+def make_textured_materials(name, num_materials, texture_size, directory):
+    """ Creates a grid using several materials, each with its own image
+    texture stored on disk """
+    obj = make_grid(name, num_materials * 2, num_materials=num_materials)
+    pixels = numpy.random.RandomState(0).rand(texture_size * texture_size * 4).astype(numpy.float32)
+
+    for i, material in enumerate(obj.data.materials):
+        image = bpy.data.images.new(material.name, texture_size, texture_size, alpha=True)
+        image.pixels[:] = numpy.roll(pixels, i).tolist()
+        image.filepath_raw = os.path.join(directory, material.name + ".png")
+        image.file_format = "PNG"
+        image.save()
+
+        texture = bpy.data.textures.new(material.name, "IMAGE")
+        texture.image = image
+        slot = material.texture_slots.add()
+        slot.texture = texture
+        slot.texture_coords = "UV"
+
+    return [obj]
+
+
+def build_scenario(name, args, directory):
+    """ Creates the objects of a scenario and returns them, together with the
+    parameters describing the scenario """
+    num_triangles = int(args.triangles * 1000000)
+
+    if name == "geometry":
+        params = {"triangles": num_triangles, "seams": args.seams, "materials": args.materials}
+        return [make_grid("Grid", num_triangles, args.seams, args.materials)], params
+
+    elif name == "skinning":
+        # Skinned meshes are usually much smaller than static geometry
+        num_triangles = num_triangles // 10
+        params = {"triangles": num_triangles, "bones": args.bones, "frames": args.frames}
+        return make_skinned_grid("Skinned", num_triangles, args.bones, args.frames), params
+
+    elif name == "particles":
+        params = {"particles": args.particles}
+        return make_particles("Emitter", args.particles), params
+
+    elif name == "materials":
+        params = {"materials": args.materials, "texture_size": args.texture_size}
+        texture_dir = os.path.join(directory, "source-textures")
+        os.makedirs(texture_dir)
+        return make_textured_materials("Textured", args.materials, args.texture_size, texture_dir), params
+
+    raise ValueError("Unkown scenario: " + name)
+
+
+def run_export(objects, directory, args):
+    """ Exports the objects once and returns the writer """
+    settings = bpy.context.scene.pbe
+    settings.geometry_engine = args.engine
+    settings.pack_processes = 1
+    settings.use_geometry_cache = False
+    settings.incremental_export = False
+    settings.profile_export = False
+    settings.tex_mode = "COPY"
+
+    writer = SceneWriter()
+    writer.set_log_instance(ConsoleExportLog())
+    writer.set_context(bpy.context)
+    writer.set_settings(settings)
+    writer.set_filepath(os.path.join(directory, "benchmark.bam"))
+    writer.set_objects(objects)
+
+    # Start the profiler directly, since the profile_export setting would
+    # also trace the memory, which distorts the timings
+    writer.profiler.start(trace_memory=args.trace_memory)
+    writer.write_bam_file()
+    return writer
+
+
+def run_scenario(name, args):
+    """ Builds a scenario and exports it several times. The phase timings of
+    the fastest run are kept """
+    directory = tempfile.mkdtemp(prefix="pbe-benchmark-")
+    try:
+        clear_scene()
+        start_time = time.perf_counter()
+        objects, params = build_scenario(name, args, directory)
+        build_seconds = time.perf_counter() - start_time
+
+        runs = []
+        best_writer = None
+        for i in range(args.repeat):
+            writer = run_export(objects, directory, args)
+            duration = writer.profiler.end_time - writer.profiler.start_time
+            if not runs or duration < min(runs):
+                best_writer = writer
+            runs.append(duration)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    phases = {phase: {"calls": calls, "seconds": duration, "net_allocated_bytes": net_allocated,
+                      "peak_allocated_bytes": peak_allocated}
+              for phase, (calls, duration, net_allocated, peak_allocated)
+              in best_writer.profiler.get_phase_totals().items()}
+
+    return {
+        "parameters": params,
+        "build_seconds": build_seconds,
+        "vertices": best_writer._stats_exported_vertices,
+        "triangles": best_writer._stats_exported_tris,
+        "geoms": best_writer._stats_exported_geoms,
+        "runs": runs,
+        "best_seconds": min(runs),
+        "median_seconds": sorted(runs)[len(runs) // 2],
+        "phases": phases,
+    }
+
+
+def get_commit():
+    """ Returns the commit hash of the exporter, or None if it is not a git
+    checkout """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=source_dir,
+                                       stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(results, baseline, max_regression):
+    """ Prints the change of each scenario compared to the baseline. Returns
+    False if a scenario got slower than allowed """
+    passed = True
+    for name, scenario in sorted(results["scenarios"].items()):
+        old_scenario = baseline.get("scenarios", {}).get(name)
+        if not old_scenario or old_scenario["parameters"] != scenario["parameters"]:
+            print("{:<12} no comparable baseline".format(name))
+            continue
+
+        old_seconds, new_seconds = old_scenario["best_seconds"], scenario["best_seconds"]
+        change = (new_seconds - old_seconds) / max(old_seconds, 1e-9) * 100.0
+        print("{:<12} {:>10.4f} s -> {:>10.4f} s {:>+8.1f} %".format(name, old_seconds, new_seconds, change))
+
+        if max_regression is not None and change > max_regression:
+            print("{:<12} regressed by more than {} %".format(name, max_regression))
+            passed = False
+
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="Benchmark.py", description="Benchmarks the bam exporter")
+    parser.add_argument("--output", default="benchmark.json", help="Path to write the results to")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="Comma separated scenarios to run, out of " + ", ".join(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3, help="Exports per scenario")
+    parser.add_argument("--engine", default="NUMPY", choices=["NUMPY", "PYTHON"], help="Geometry engine")
+    parser.add_argument("--triangles", type=float, default=1.0, help="Million triangles of the grid")
+    parser.add_argument("--seams", type=int, default=16, help="UV seams of the grid")
+    parser.add_argument("--materials", type=int, default=8, help="Materials of the grid")
+    parser.add_argument("--bones", type=int, default=32, help="Bones of the skinned mesh")
+    parser.add_argument("--frames", type=int, default=250, help="Animation frames of the skinned mesh")
+    parser.add_argument("--particles", type=int, default=10000, help="Instances of the particle system")
+    parser.add_argument("--texture-size", type=int, default=512, help="Resolution of the textures")
+    parser.add_argument("--trace-memory", action="store_true", help="Also record the allocated memory")
+    parser.add_argument("--baseline", default=None, help="Results of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Fail if a scenario is slower than the baseline by this percentage")
+
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    args = parser.parse_args(argv)
+
+    register_exporter()
+
+    results = {
+        "benchmark_version": BENCHMARK_VERSION,
+        "commit": get_commit(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "blender": bpy.app.version_string,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "engine": args.engine,
+        "scenarios": {},
+    }
+
+    for name in [name.strip() for name in args.scenarios.split(",")]:
+        print("Running scenario", name)
+        results["scenarios"][name] = run_scenario(name, args)
+        print("  best of", args.repeat, "runs:", round(results["scenarios"][name]["best_seconds"], 4), "seconds")
+
+    with open(args.output, "w") as handle:
+        json.dump(results, handle, indent=4, sort_keys=True)
+    print("Wrote benchmark results to", args.output)
+
+    if args.baseline:
+        with open(args.baseline, "r") as handle:
+            baseline = json.load(handle)
+        if baseline.get("benchmark_version") != BENCHMARK_VERSION:
+            print("Baseline was created by a different benchmark version, not comparing")
+        elif not compare_results(results, baseline, args.max_regression):
+            sys.exit(1)
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
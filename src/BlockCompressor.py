@@ -0,0 +1,136 @@
+import numpy
+
+
+# Amount of iterations used to find the principal axis of the block colors
+POWER_ITERATIONS = 8
+
+
+def split_blocks(pixels):
+    """ Splits a (height, width, channels) image into 4x4 blocks, padding it
+    by repeating the last row and column. Returns a (num_blocks, 16,
+    channels) array, with the blocks in row order, starting at the first row
+    of the image """
+    height, width, channels = pixels.shape
+    padded_height, padded_width = (height + 3) // 4 * 4, (width + 3) // 4 * 4
+    pixels = numpy.pad(pixels, ((0, padded_height - height), (0, padded_width - width), (0, 0)), mode="edge")
+
+    blocks = pixels.reshape(padded_height // 4, 4, padded_width // 4, 4, channels).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(-1, 16, channels)
+
+
+def _pack_indices(indices, bits):
+    """ Packs the per-pixel palette indices of each block into an unsigned
+    integer, with the first pixel in the lowest bits """
+    shifts = numpy.arange(16, dtype=numpy.uint64) * bits
+    return (indices.astype(numpy.uint64) << shifts).sum(axis=1, dtype=numpy.uint64)
+
+
+def _to_rgb565(colors):
+    """ Quantizes float colors in the range 0 .. 1 to 5:6:5 bit integers """
+    red = numpy.clip(numpy.round(colors[..., 0] * 31.0), 0, 31).astype(numpy.uint32)
+    green = numpy.clip(numpy.round(colors[..., 1] * 63.0), 0, 63).astype(numpy.uint32)
+    blue = numpy.clip(numpy.round(colors[..., 2] * 31.0), 0, 31).astype(numpy.uint32)
+    return (red << 11) | (green << 5) | blue
+
+
+def _from_rgb565(values):
+    """ Expands 5:6:5 bit integers to float colors """
+    return numpy.stack(((values >> 11) / 31.0, ((values >> 5) & 63) / 63.0, (values & 31) / 31.0), axis=-1)
+
+
+def _encode_color_blocks(blocks):
+    """ Encodes (num_blocks, 16, 3) float colors as the 8 byte color blocks of
+    BC1 in four color mode. The end points are found by projecting the colors
+    onto their principal axis. Returns a (num_blocks, 8) uint8 array """
+    num_blocks = len(blocks)
+    blocks = blocks.astype(numpy.float64)
+
+    mean = blocks.mean(axis=1)
+    centered = blocks - mean[:, numpy.newaxis, :]
+    covariance = numpy.einsum("nki,nkj->nij", centered, centered)
+
+    # Power iteration, starting from the diagonal to avoid a zero vector for
+    # blocks with a single color channel
+    axis = numpy.ones((num_blocks, 3))
+    for iteration in range(POWER_ITERATIONS):
+        axis = numpy.einsum("nij,nj->ni", covariance, axis)
+        lengths = numpy.sqrt((axis * axis).sum(axis=1))
+        axis = numpy.where(lengths[:, numpy.newaxis] > 1e-12, axis / numpy.maximum(lengths, 1e-12)[:, numpy.newaxis], 0.0)
+
+    projection = numpy.einsum("nki,ni->nk", centered, axis)
+    start = mean + axis * projection.min(axis=1)[:, numpy.newaxis]
+    end = mean + axis * projection.max(axis=1)[:, numpy.newaxis]
+
+    color0, color1 = _to_rgb565(end), _to_rgb565(start)
+
+    # Four color mode requires color0 > color1
+    swap = color0 < color1
+    color0, color1 = numpy.where(swap, color1, color0), numpy.where(swap, color0, color1)
+
+    endpoint0, endpoint1 = _from_rgb565(color0), _from_rgb565(color1)
+    palette = numpy.stack((endpoint0, endpoint1, (2.0 * endpoint0 + endpoint1) / 3.0,
+                           (endpoint0 + 2.0 * endpoint1) / 3.0), axis=1)
+
+    distances = ((blocks[:, :, numpy.newaxis, :] - palette[:, numpy.newaxis, :, :]) ** 2).sum(axis=3)
+    indices = numpy.argmin(distances, axis=2)
+
+    # Blocks with equal end points would be decoded in three color mode, so
+    # they must only use the first index
+    indices[color0 == color1] = 0
+
+    encoded = numpy.empty((num_blocks, 8), dtype=numpy.uint8)
+    encoded[:, 0:2] = color0.astype("<u2").view(numpy.uint8).reshape(-1, 2)
+    encoded[:, 2:4] = color1.astype("<u2").view(numpy.uint8).reshape(-1, 2)
+    encoded[:, 4:8] = _pack_indices(indices, 2).astype("<u4").view(numpy.uint8).reshape(-1, 4)
+    return encoded
+
+
+def _encode_alpha_blocks(values):
+    """ Encodes (num_blocks, 16) float values as the 8 byte single channel
+    blocks used by BC3 alpha, BC4 and BC5, in eight value mode. Returns a
+    (num_blocks, 8) uint8 array """
+    num_blocks = len(values)
+    quantized = numpy.clip(numpy.round(values * 255.0), 0, 255)
+    value0, value1 = quantized.max(axis=1), quantized.min(axis=1)
+
+    weights = numpy.array([0.0, 7.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0]) / 7.0
+    palette = value0[:, numpy.newaxis] * (1.0 - weights) + value1[:, numpy.newaxis] * weights
+    palette = numpy.floor(palette + 0.5)
+
+    distances = numpy.abs(quantized[:, :, numpy.newaxis] - palette[:, numpy.newaxis, :])
+    indices = numpy.argmin(distances, axis=2)
+
+    # Equal end points would select the six value mode
+    indices[value0 == value1] = 0
+
+    encoded = numpy.empty((num_blocks, 8), dtype=numpy.uint8)
+    encoded[:, 0] = value0
+    encoded[:, 1] = value1
+    encoded[:, 2:8] = _pack_indices(indices, 3).astype("<u8").view(numpy.uint8).reshape(-1, 8)[:, :6]
+    return encoded
+
+
+def compress_bc1(pixels):
+    """ Compresses a (height, width, channels) float image to BC1 (DXT1),
+    ignoring the alpha channel. Returns the compressed bytes """
+    blocks = split_blocks(pixels)
+    return _encode_color_blocks(blocks[:, :, :3]).tobytes()
+
+
+def compress_bc3(pixels):
+    """ Compresses a (height, width, 4) float image to BC3 (DXT5), storing
+    the alpha channel in its own block. Returns the compressed bytes """
+    blocks = split_blocks(pixels)
+    encoded = numpy.concatenate((_encode_alpha_blocks(blocks[:, :, 3]), _encode_color_blocks(blocks[:, :, :3])),
+                                axis=1)
+    return encoded.tobytes()
+
+
+def compress_bc5(pixels):
+    """ Compresses the first two channels of a (height, width, channels)
+    float image to BC5 (RGTC2), which suits normal maps, whose third
+    component can be reconstructed. Returns the compressed bytes """
+    blocks = split_blocks(pixels)
+    encoded = numpy.concatenate((_encode_alpha_blocks(blocks[:, :, 0]), _encode_alpha_blocks(blocks[:, :, 1])),
+                                axis=1)
+    return encoded.tobytes()
@@ -0,0 +1,170 @@
+import json
+import time
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+
+class ExportProfiler(object):
+
+    """ Records the wall time and the memory of each export phase, per object.
+    The memory is recorded as the net change over the phase, and as the peak
+    above the memory at the start of the phase. Phases can be nested, their
+    timings and peaks are inclusive. When the profiler is disabled, phases
+    are not recorded """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = {}
+        self.current_object = None
+        self.start_time = 0.0
+        self.end_time = 0.0
+        self._started_tracing = False
+
+        # One [start memory, highest peak so far] entry per active phase.
+        # Each phase resets the peak of tracemalloc, so it passes the peak
+        # seen until then to the enclosing phase first
+        self._memory_stack = []
+
+    def start(self, trace_memory=True):
+        """ Enables the profiler and starts tracing the memory allocations.
+        Tracing slows down the export, so it can be disabled when only the
+        timings are of interest """
+        self.enabled = True
+        self.records = {}
+        self.start_time = time.perf_counter()
+        self.end_time = self.start_time
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        """ Disables the profiler, the records are kept """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        if self.enabled:
+            self.end_time = time.perf_counter()
+        self.enabled = False
+
+    @contextmanager
+    def object(self, name):
+        """ Attributes all phases within this context to the given object """
+        previous = self.current_object
+        self.current_object = name
+        try:
+            yield
+        finally:
+            self.current_object = previous
+
+    @contextmanager
+    def phase(self, name):
+        """ Measures the time and memory spent within this context """
+        if not self.enabled:
+            yield
+            return
+
+        object_name = self.current_object
+        current, peak = tracemalloc.get_traced_memory()
+        if self._memory_stack:
+            self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        memory = [current, current]
+        self._memory_stack.append(memory)
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_time
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(memory[1], peak)
+
+            self._memory_stack.pop()
+            if self._memory_stack:
+                self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+
+            self.add_record(name, duration, current - memory[0], peak - memory[0], object_name)
+
+    def add_record(self, name, duration, net_allocated=0, peak_allocated=0, object_name=None):
+        """ Records a phase which was measured elsewhere, e.g. in a worker
+        process. Without an object name, the phase is attributed to the
+        current object """
+        if not self.enabled:
+            return
+
+        object_name = object_name if object_name is not None else self.current_object
+        record = self.records.setdefault((name, object_name), [0, 0.0, 0, 0])
+        record[0] += 1
+        record[1] += duration
+        record[2] += net_allocated
+        record[3] = max(record[3], peak_allocated)
+
+    def get_phase_totals(self):
+        """ Returns the records of each phase over all objects. The calls,
+        durations and net allocations are summed up, the peak is the highest
+        peak of a single call """
+        totals = {}
+        for (name, object_name), (calls, duration, net_allocated, peak_allocated) in self.records.items():
+            total = totals.setdefault(name, [0, 0.0, 0, 0])
+            total[0] += calls
+            total[1] += duration
+            total[2] += net_allocated
+            total[3] = max(total[3], peak_allocated)
+        return totals
+
+    def write_json(self, filepath):
+        """ Writes all records to a json file """
+        phases = [{"phase": name, "calls": calls, "seconds": duration, "net_allocated_bytes": net_allocated,
+                   "peak_allocated_bytes": peak_allocated}
+                  for name, (calls, duration, net_allocated, peak_allocated)
+                  in sorted(self.get_phase_totals().items())]
+        entries = [{"phase": name, "object": object_name, "calls": calls, "seconds": duration,
+                    "net_allocated_bytes": net_allocated, "peak_allocated_bytes": peak_allocated}
+                   for (name, object_name), (calls, duration, net_allocated, peak_allocated)
+                   in self.records.items()]
+        entries.sort(key=lambda entry: -entry["seconds"])
+
+        with open(filepath, "w") as handle:
+            json.dump({
+                "total_seconds": self.end_time - self.start_time,
+                "phases": phases,
+                "entries": entries,
+            }, handle, indent=4)
+
+    def report(self, log_instance, count=10):
+        """ Logs the slowest phases and the slowest (phase, object) entries """
+        log_instance.info("Slowest export phases:")
+        totals = sorted(self.get_phase_totals().items(), key=lambda item: -item[1][1])
+        for name, (calls, duration, net_allocated, peak_allocated) in totals[:count]:
+            log_instance.info("  {:<20} {:>10.4f} s {:>8d} calls {:>12,d} bytes net {:>12,d} bytes peak".format(
+                name, duration, calls, net_allocated, peak_allocated))
+
+        log_instance.info("Slowest objects:")
+        entries = sorted(self.records.items(), key=lambda item: -item[1][1])
+        for (name, object_name), (calls, duration, net_allocated, peak_allocated) in entries[:count]:
+            log_instance.info("  {:<20} {:<30} {:>10.4f} s {:>12,d} bytes net {:>12,d} bytes peak".format(
+                name, str(object_name), duration, net_allocated, peak_allocated))
+
+
+def profile_phase(name):
+    """ Decorator which measures a method as export phase. The class has to
+    provide the profiler as attribute """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.phase(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profile_object(method):
+    """ Decorator which attributes all phases within a method to the blender
+    object passed as first argument """
+    @functools.wraps(method)
+    def wrapper(self, obj, *args, **kwargs):
+        with self.profiler.object(obj.name):
+            return method(self, obj, *args, **kwargs)
+    return wrapper
@@ -27,6 +27,65 @@ class ExportSettings(bpy.types.PropertyGroup):
         description="The relative path where to copy the textures to",
         default="./tex/")
 
+    tex_copy_hardlinks = bpy.props.BoolProperty(
+        name="Hardlink textures",
+        description="Create hardlinks instead of copies where the file system "
+        "allows it. This saves time and disk space, but editing a copied "
+        "texture in place also changes the source texture",
+        default=False)
+
+    tex_deduplicate = bpy.props.BoolProperty(
+        name="Deduplicate textures",
+        description="Share one texture between images with identical files, "
+        "even if they have different names or paths. The file hashes are "
+        "stored next to the bam file, so unchanged files are not hashed again. "
+        "Included textures are always deduplicated",
+        default=False)
+
+    tex_mipmaps = bpy.props.BoolProperty(
+        name="Precompute mipmaps",
+        description="Store the full mipmap chain of included textures, and of "
+        "copied textures as txo files, so they do not have to be generated at "
+        "load time. Srgb textures are filtered in linear space",
+        default=False)
+
+    tex_compression = bpy.props.EnumProperty(
+        name="Texture compression",
+        description="Block compression of included textures, and of copied "
+        "textures as txo files",
+        items=[
+            ("NONE", "None", "Store uncompressed pixels"),
+            ("BC", "BC1 / BC3 / BC5", "Use BC1 for rgb, BC3 for rgba and BC5 for normal "
+             "maps, which only keeps their x and y components"),
+        ],
+        default="NONE")
+
+    tex_atlas = bpy.props.BoolProperty(
+        name="Texture atlases",
+        description="Pack the small images of materials with equal texture "
+        "slots into atlases and move the texture coordinates into their "
+        "regions, so the materials share textures and often render states. "
+        "Geoms whose texture coordinates repeat the texture keep the original "
+        "images. Atlases are stored as txo files, or included in the bam file",
+        default=False)
+
+    tex_atlas_size = bpy.props.IntProperty(
+        name="Atlas size",
+        description="Maximum width and height of the texture atlases",
+        default=2048, min=256, max=16384)
+
+    tex_atlas_max_image_size = bpy.props.IntProperty(
+        name="Max image size",
+        description="Only images up to this width and height are packed into atlases",
+        default=256, min=16, max=4096)
+
+    tex_atlas_padding = bpy.props.IntProperty(
+        name="Atlas padding",
+        description="Pixels around each image in the atlas, filled with its "
+        "border, so filtering and the first mipmap levels do not bleed "
+        "between the images",
+        default=4, min=0, max=64)
+
     use_pbs = bpy.props.BoolProperty(
         name="Use PBS addon",
         description="Whether to use the Physically Based Shading addon. This "
@@ -36,6 +95,201 @@ class ExportSettings(bpy.types.PropertyGroup):
         default=True
     )
 
+    geometry_engine = bpy.props.EnumProperty(
+        name="Geometry engine",
+        description="How to extract and pack the mesh data. Both engines write "
+        "identical geometry",
+        items=[
+            ("PYTHON", "Python", "Walk every polygon and vertex in python"),
+            ("NUMPY", "NumPy (Fast)", "Read the mesh data in bulk and pack it using numpy"),
+        ],
+        default="NUMPY")
+
+    pack_processes = bpy.props.IntProperty(
+        name="Packing processes",
+        description="Number of worker processes used to pack the geometry and "
+        "bake the animations. Packing in the workers requires the numpy engine. "
+        "1 does everything in the blender process, 0 starts one process per core",
+        default=1, min=0, max=64)
+
+    use_geometry_cache = bpy.props.BoolProperty(
+        name="Cache geometry",
+        description="Store the packed geometry on disk, so unchanged meshes do "
+        "not have to be packed again on the next export. Requires the numpy engine",
+        default=False)
+
+    geometry_cache_path = bpy.props.StringProperty(
+        name="Geometry cache path",
+        description="The directory where the packed geometry is cached",
+        default="//pbe_cache/",
+        subtype="DIR_PATH")
+
+    geometry_cache_size = bpy.props.IntProperty(
+        name="Geometry cache size (MB)",
+        description="Maximum size of the geometry cache. The least recently "
+        "used entries are removed first",
+        default=1024, min=1)
+
+    incremental_export = bpy.props.BoolProperty(
+        name="Incremental export",
+        description="Only convert objects which changed since the last export "
+        "of the same file in this session, and reuse the rest",
+        default=False)
+
+    profile_export = bpy.props.BoolProperty(
+        name="Profile export",
+        description="Measure the time and memory of each export phase and "
+        "object, and write them to a .profile.json file next to the bam file",
+        default=False)
+
+    weld_vertices = bpy.props.BoolProperty(
+        name="Weld vertices",
+        description="Merge all vertices which share the same position, normal "
+        "and texture coordinate, instead of only reusing a vertex when its "
+        "texture coordinate matches the previous one",
+        default=False)
+
+    weld_epsilon = bpy.props.FloatProperty(
+        name="Weld epsilon",
+        description="Normals and texture coordinates are compared with this "
+        "precision when welding vertices. Zero only welds exactly equal vertices",
+        default=1e-5, min=0.0, max=0.01, precision=6)
+
+    split_large_geoms = bpy.props.BoolProperty(
+        name="Split large geoms",
+        description="Split geoms with too many vertices for 16 bit indices into "
+        "several smaller geoms, instead of using 32 bit indices",
+        default=True)
+
+    optimize_vertex_cache = bpy.props.BoolProperty(
+        name="Optimize vertex cache",
+        description="Reorder the triangles and vertices of each geom for a "
+        "better post-transform vertex cache usage. This slows down the export",
+        default=False)
+
+    batch_static_meshes = bpy.props.BoolProperty(
+        name="Batch static meshes",
+        description="Merge the geometry of static meshes without animation, "
+        "tags or modifiers into one geom per material and grid cell. This "
+        "reduces the amount of draw calls, but the objects can no longer be "
+        "found by name",
+        default=False)
+
+    batch_cell_size = bpy.props.FloatProperty(
+        name="Batch cell size",
+        description="Size of the grid cells used to batch static meshes. "
+        "Smaller cells allow better culling, larger cells fewer draw calls",
+        default=10.0, min=0.01, max=100000.0)
+
+    generate_lods = bpy.props.BoolProperty(
+        name="Generate LODs",
+        description="Generate LOD levels for meshes without manual LOD levels, "
+        "by decimating the packed geometry",
+        default=False)
+
+    lod_count = bpy.props.IntProperty(
+        name="LOD levels",
+        description="Amount of LOD levels to generate in addition to the full mesh",
+        default=2, min=1, max=6)
+
+    lod_reduction = bpy.props.FloatProperty(
+        name="LOD reduction",
+        description="Ratio of the triangles each LOD level keeps from the previous level",
+        default=0.5, min=0.05, max=0.95)
+
+    lod_min_triangles = bpy.props.IntProperty(
+        name="LOD min triangles",
+        description="Only generate LOD levels for meshes with at least this many triangles",
+        default=1000, min=0)
+
+    lod_screen_size = bpy.props.FloatProperty(
+        name="LOD screen size",
+        description="Fraction of the screen height covered by the bounding sphere of "
+        "a mesh when switching to the first LOD level. Each further level "
+        "switches at half the size of the previous one",
+        default=0.5, min=0.01, max=2.0)
+
+    write_bounds = bpy.props.BoolProperty(
+        name="Precompute bounds",
+        description="Compute the bounding box and sphere of every node while "
+        "packing the geometry, and store them in the bounds_box and "
+        "bounds_sphere tags, so they do not have to be computed at load time",
+        default=False)
+
+    particle_mode = bpy.props.EnumProperty(
+        name="Particles",
+        description="How to export particle systems using an object as render type",
+        items=[
+            ("NODES", "Nodes", "Create a node with its own transform for every particle"),
+            ("INSTANCED", "Instanced", "Write the mesh once, and store the transforms of "
+             "all particles as packed floats in the instance_transforms tag of its node"),
+        ],
+        default="NODES")
+
+    skinning_mode = bpy.props.EnumProperty(
+        name="Skinning",
+        description="How to store the bone weights of skinned meshes",
+        items=[
+            ("BLEND_TABLE", "Blend table", "Store a transform blend per vertex, "
+             "animated on the CPU by Panda3D"),
+            ("HARDWARE", "Hardware", "Store packed transform indices and weights "
+             "per vertex, with a limited amount of influences, to animate in a shader"),
+        ],
+        default="BLEND_TABLE")
+
+    max_bone_influences = bpy.props.IntProperty(
+        name="Max bone influences",
+        description="Maximum amount of bones influencing a vertex with hardware "
+        "skinning. Only the strongest influences are kept, and their weights "
+        "are normalized",
+        default=4, min=1, max=8)
+
+    anim_export_mode = bpy.props.EnumProperty(
+        name="Animations",
+        description="Which actions to export for each armature",
+        items=[
+            ("ACTIVE", "Active action", "Export the active action of the armature"),
+            ("ALL", "All actions", "Export every action animating the bones of the "
+             "armature, each as its own animation"),
+        ],
+        default="ACTIVE")
+
+    anim_action_filter = bpy.props.StringProperty(
+        name="Action filter",
+        description="Comma separated action names to export, which may contain "
+        "wildcards like walk_*. Empty exports all actions",
+        default="")
+
+    anim_fps = bpy.props.IntProperty(
+        name="Animation frame rate",
+        description="Resample animations to this frame rate, if it is lower "
+        "than the frame rate of the scene. 0 keeps the frame rate of the scene",
+        default=0, min=0, max=240)
+
+    anim_position_tolerance = bpy.props.FloatProperty(
+        name="Position tolerance",
+        description="Maximum error of the bone positions when reducing "
+        "animation tables. Zero only reduces exactly constant tables",
+        default=0.0, min=0.0, max=1.0, precision=5)
+
+    anim_angle_tolerance = bpy.props.FloatProperty(
+        name="Angle tolerance (degrees)",
+        description="Maximum error of the bone rotations when reducing "
+        "animation tables. Zero only reduces exactly constant tables",
+        default=0.0, min=0.0, max=10.0, precision=4)
+
+    anim_scale_tolerance = bpy.props.FloatProperty(
+        name="Scale tolerance",
+        description="Maximum error of the bone scales when reducing "
+        "animation tables. Zero only reduces exactly constant tables",
+        default=0.0, min=0.0, max=1.0, precision=5)
+
+    anim_quantize = bpy.props.BoolProperty(
+        name="Quantize animations",
+        description="Round the animation values to multiples of the "
+        "tolerances, which makes nearly equal values exactly equal",
+        default=False)
+
     bam_version = bpy.props.EnumProperty(
         name="Bam Version",
         description="Bam version to write out",
@@ -59,8 +313,80 @@ class ExportSettings(bpy.types.PropertyGroup):
         if self.tex_mode == "COPY":
             box = layout.box()
             box.row().prop(self, 'tex_copy_path')
+            box.row().prop(self, 'tex_copy_hardlinks')
+
+        if self.tex_mode in ("COPY", "INCLUDE"):
+            box = layout.box()
+            box.row().prop(self, 'tex_mipmaps')
+            box.row().prop(self, 'tex_compression')
+
+        layout.row().prop(self, 'tex_deduplicate')
+        layout.row().prop(self, 'tex_atlas')
+
+        if self.tex_atlas:
+            box = layout.box()
+            box.row().prop(self, 'tex_atlas_size')
+            box.row().prop(self, 'tex_atlas_max_image_size')
+            box.row().prop(self, 'tex_atlas_padding')
 
         layout.row().prop(self, 'use_pbs')
+        layout.row().prop(self, 'incremental_export')
+        layout.row().prop(self, 'profile_export')
+        layout.row().prop(self, 'pack_processes')
+        layout.row().prop(self, 'geometry_engine')
+
+        if self.geometry_engine == "NUMPY":
+            box = layout.box()
+            box.row().prop(self, 'use_geometry_cache')
+
+            if self.use_geometry_cache:
+                box.row().prop(self, 'geometry_cache_path')
+                box.row().prop(self, 'geometry_cache_size')
+
+        layout.row().prop(self, 'weld_vertices')
+
+        if self.weld_vertices:
+            box = layout.box()
+            box.row().prop(self, 'weld_epsilon')
+
+        layout.row().prop(self, 'split_large_geoms')
+        layout.row().prop(self, 'optimize_vertex_cache')
+        layout.row().prop(self, 'batch_static_meshes')
+
+        if self.batch_static_meshes:
+            box = layout.box()
+            box.row().prop(self, 'batch_cell_size')
+
+        layout.row().prop(self, 'generate_lods')
+
+        if self.generate_lods:
+            box = layout.box()
+            box.row().prop(self, 'lod_count')
+            box.row().prop(self, 'lod_reduction')
+            box.row().prop(self, 'lod_min_triangles')
+            box.row().prop(self, 'lod_screen_size')
+
+        layout.row().prop(self, 'write_bounds')
+        layout.row().prop(self, 'particle_mode')
+        layout.row().prop(self, 'skinning_mode')
+
+        if self.skinning_mode == "HARDWARE":
+            box = layout.box()
+            box.row().prop(self, 'max_bone_influences')
+
+        layout.row().prop(self, 'anim_export_mode')
+
+        if self.anim_export_mode == "ALL":
+            box = layout.box()
+            box.row().prop(self, 'anim_action_filter')
+
+        layout.row().prop(self, 'anim_fps')
+
+        box = layout.box()
+        box.row().prop(self, 'anim_position_tolerance')
+        box.row().prop(self, 'anim_angle_tolerance')
+        box.row().prop(self, 'anim_scale_tolerance')
+        box.row().prop(self, 'anim_quantize')
 
 
 class ExportOperator(bpy.types.Operator, ExportHelper):
@@ -0,0 +1,55 @@
+import numpy
+from array import array
+
+from NodeBounds import get_vertex_bounds
+
+
+class GeomBuffers(object):
+
+    """ Container for the packed per-geom buffers. Both geometry engines fill
+    this structure, and the GeometryWriter turns it into the actual Geom. It
+    only stores plain arrays, so it does not depend on any blender data """
+
+    def __init__(self, name, have_texcoords=False, use_32_bit_indices=False):
+        self.name = name
+        self.have_texcoords = have_texcoords
+        self.use_32_bit_indices = use_32_bit_indices
+
+        # Interleaved vertex data, either v3n3 or v3n3t2
+        self.vertex_buffer = array('f')
+
+        # Triangle indices, 16 or 32 bit depending on the vertex count
+        if use_32_bit_indices:
+            self.index_buffer = array('I')  # Unsigned Int
+        else:
+            self.index_buffer = array('H')  # Unsigned Short
+
+        # The mesh vertex each exported vertex was created from. This is
+        # required to look up the vertex groups for the transform blends
+        self.source_indices = array('I')
+
+        self.num_vertices = 0
+        self.num_triangles = 0
+        self.num_duplicated = 0
+        self.num_welded = 0
+
+        # Bounding box and sphere of the vertices, see compute_bounds
+        self.bounds = None
+
+    @property
+    def vertex_stride(self):
+        """ Returns the amount of floats per vertex """
+        return 8 if self.have_texcoords else 6
+
+    def narrow_indices(self):
+        """ Converts the index buffer to 16 bit indices. This is only valid if
+        the buffers have less than 2 ** 16 - 1 vertices """
+        self.index_buffer = array('H', self.index_buffer)
+        self.use_32_bit_indices = False
+
+    def compute_bounds(self):
+        """ Computes the bounds of the vertex positions, as returned by
+        get_vertex_bounds. This has to be called again whenever the vertices
+        change """
+        vertices = numpy.frombuffer(self.vertex_buffer, dtype=numpy.float32)
+        self.bounds = get_vertex_bounds(vertices.reshape(-1, self.vertex_stride)[:, :3])
@@ -0,0 +1,104 @@
+import os
+import pickle
+import hashlib
+
+
+class GeometryCache(object):
+
+    """ On-disk cache for the packed geometry, which persists across export
+    runs. Entries are keyed by a hash of everything that affects the packed
+    buffers, so changed meshes get a new key, and unused entries get evicted
+    least recently used first once the cache exceeds its size limit """
+
+    # Increment this whenever the layout of the packed buffers changes, so
+    # old cache entries are not used anymore
+    CACHE_VERSION = 4
+
+    FILE_EXTENSION = ".pbegeom"
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.num_hits = 0
+        self.num_misses = 0
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def make_key(self, snapshot, vertex_groups, obj, options):
+        """ Computes the cache key of a mesh, based on the evaluated mesh data,
+        the vertex group weights, the modifier stack, the material slots and
+        the export settings """
+        hasher = hashlib.sha1()
+        hasher.update(str(self.CACHE_VERSION).encode("utf-8"))
+
+        for array in (snapshot.vertex_coords, snapshot.vertex_normals, snapshot.loop_vertices,
+                      snapshot.polygon_loop_starts, snapshot.polygon_normals, snapshot.polygon_centers,
+                      snapshot.polygon_materials, snapshot.polygon_smooth, snapshot.loop_uvs):
+            if array is None:
+                hasher.update(b"none")
+            else:
+                hasher.update(str(array.shape).encode("utf-8"))
+                hasher.update(array.tobytes())
+
+        modifiers = [(modifier.name, modifier.type, modifier.show_viewport) for modifier in obj.modifiers]
+        material_slots = [slot.material.name if slot.material else None for slot in obj.material_slots]
+        settings = sorted(vars(options).items())
+
+        hasher.update(repr((vertex_groups, modifiers, material_slots, settings)).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _get_path(self, key):
+        """ Returns the file path of a cache entry """
+        return os.path.join(self.directory, key + self.FILE_EXTENSION)
+
+    def load(self, key):
+        """ Returns the cached (packed_geoms, report) tuple for the given key,
+        or None if there is no such entry """
+        path = self._get_path(key)
+
+        try:
+            with open(path, "rb") as handle:
+                result = pickle.load(handle)
+        except (IOError, OSError, pickle.UnpicklingError, EOFError):
+            self.num_misses += 1
+            return None
+
+        # Mark the entry as recently used
+        os.utime(path, None)
+        self.num_hits += 1
+        return result
+
+    def store(self, key, result):
+        """ Stores a (packed_geoms, report) tuple under the given key """
+        path = self._get_path(key)
+
+        # Write to a temporary file first, so an interrupted export never
+        # leaves a broken entry behind
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as handle:
+            pickle.dump(result, handle, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    def trim(self):
+        """ Removes the least recently used entries until the cache fits into
+        its size limit. Returns the amount of removed entries """
+        entries = []
+        total_bytes = 0
+
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(self.FILE_EXTENSION):
+                continue
+            stat = os.stat(os.path.join(self.directory, filename))
+            entries.append((stat.st_mtime, stat.st_size, filename))
+            total_bytes += stat.st_size
+
+        num_removed = 0
+        for mtime, size, filename in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, filename))
+            total_bytes -= size
+            num_removed += 1
+
+        return num_removed
@@ -1,7 +1,20 @@
 
 import bpy
+import math
 import bmesh
+import numpy
+import multiprocessing
+import multiprocessing.spawn
+from concurrent.futures import ProcessPoolExecutor
 from array import array
+from NodeBounds import merge_bounds
+from VectorizedGeometry import MeshSnapshot
+from GeometryCache import GeometryCache
+from ExportProfiler import profile_phase
+from MeshPacker import PackOptions, PackReport, pack_material_group, finish_packed_geoms, pack_snapshot, \
+    pack_polygons
+from SkinningPacker import pack_vertex_influences, interleave_skinning_columns, find_unique_blends
+from TextureAtlas import remap_texcoords
 from pybamwriter.panda_types import *
 
 
@@ -9,16 +22,30 @@ class GeometryWriter:
 
     """ Helper class to write out the actual vertices """
 
+    # Vertical field of view in degrees used to derive the LOD switch
+    # distances, matching the default lens of Panda3D
+    LOD_FOV = 30.0
+
     def __init__(self, writer):
         self._create_default_array_formats()
         self.writer = writer
         self.geom_cache = {}
+        self.pool = None
+        self.previous_executable = None
+        self.pending_geoms = []
+        self.disk_cache = None
 
     @property
     def log_instance(self):
         """ Helper to access the log instance """
         return self.writer.log_instance
 
+    @property
+    def profiler(self):
+        """ Helper to access the export profiler """
+        return self.writer.profiler
+
+    @profile_phase("face_grouping")
     def _group_mesh_faces_by_material(self, mesh, num_slots=40):
         """ Iterates over all faces of the given mesh, grouping them by their
         material index """
@@ -86,135 +113,104 @@ class GeometryWriter:
         self.gvd_formats['blend16'].add_column("transform_blend", 1, GeomEnums.NT_uint16,
                                                GeomEnums.C_index, start=0, column_alignment=1)
 
-    def _create_geom_from_polygons(self, obj, mesh, polygons, uv_coordinates=None, char=None):
-        """ Creates a Geom from a set of polygons. If uv_coordinates is not None,
-        texcoords will be written as well """
-
-        # Compute the maximum possible amount of vertices for this geom. If it
-        # extends the range of 16 bit, we have to use 32 bit indices
-        use_32_bit_indices = False
-        max_possible_vtx_count = len(polygons) * 3
-
-        if max_possible_vtx_count >= 2**16 - 1:
-            use_32_bit_indices = True
-            self.log_instance.warning("Using 32 bit indices for large geom '" + mesh.name + "' - consider splitting it")
-
-        # Check wheter the object has texture coordinates assigned
-        have_texcoords = uv_coordinates is not None
-
-        # Create handles to the data, this makes accessing it faster
-        vertices = mesh.vertices
-
-        # Store the number of written triangles and vertices
-        num_triangles = 0
-        num_vertices = 0
-        num_duplicated = 0
-
-        # Create the buffers to store the data inside
-        if use_32_bit_indices:
-            index_buffer = array('I')  # Unsigned Int
-        else:
-            index_buffer = array('H')  # Unsigned Short
-
-        vertex_buffer = array('f')
+    def _get_skinning_format(self, num_transforms, index_size):
+        """ Returns the format storing the transform weights and indices used
+        for hardware skinning, creating it on first use """
+        key = "skin{}x{}".format(num_transforms, index_size)
+        if key not in self.gvd_formats:
+            index_type = GeomEnums.NT_uint8 if index_size == 1 else GeomEnums.NT_uint16
+            skin_format = GeomVertexArrayFormat()
+            skin_format.stride = num_transforms * (4 + index_size)
+            skin_format.total_bytes = skin_format.stride
+            skin_format.pad_to = 1
+            skin_format.add_column("transform_weight", num_transforms, GeomEnums.NT_float32,
+                                   GeomEnums.C_other, start=0, column_alignment=4)
+            skin_format.add_column("transform_index", num_transforms, index_type,
+                                   GeomEnums.C_index, start=num_transforms * 4, column_alignment=1)
+            self.gvd_formats[key] = skin_format
+        return self.gvd_formats[key]
+
+    def _read_vertex_groups(self, obj, mesh, char):
+        """ Copies the non-zero vertex group weights of each mesh vertex, or
+        returns None if the object is not animated by a character """
+
+        if not char or not obj.vertex_groups:
+            return None
+
+        return [[(element.group, element.weight) for element in vertex.groups if element.weight != 0.0]
+                for vertex in mesh.vertices]
+
+    def _create_blend_buffer(self, obj, vertex_groups, char, source_indices):
+        """ Creates the transform blend table and the per-vertex blend indices
+        for the given exported vertices, or returns (None, None) if the object
+        is not animated by a character """
+
+        if vertex_groups is None:
+            return None, None
 
         jvts = []
-        if char and obj.vertex_groups:
-            for group in obj.vertex_groups:
-                # We need to do this later, since the Character may not have
-                # been created yet.
-                joint = char.find_joint(group.name)
-                jvts.append(JointVertexTransform(joint))
-
-            blend_table = TransformBlendTable()
-            blend_buffer = array('H')
+        for group in obj.vertex_groups:
+            # We need to do this later, since the Character may not have
+            # been created yet.
+            joint = char.find_joint(group.name)
+            jvts.append(JointVertexTransform(joint))
+
+        # Vertices with the same influences share a single blend
+        unique_influences, blend_rows = find_unique_blends(vertex_groups, source_indices)
+
+        # Store the transform blends.
+        blend_table = TransformBlendTable()
+        table_indices = []
+        for influences in unique_influences:
+            blend = TransformBlend()
+            for group, weight in influences:
+                blend.add_transform(jvts[group], weight)
+            table_indices.append(blend_table.add_blend(blend))
+
+        blend_buffer = array('H', (table_indices[row] for row in blend_rows))
+
+        self.writer._stats_blend_vertices += len(source_indices)
+        self.writer._stats_unique_blends += len(unique_influences)
+        return blend_table, blend_buffer
+
+    def _create_skinning_buffer(self, obj, vertex_groups, char, source_indices):
+        """ Creates the transform table and the packed per-vertex transform
+        weights and indices used for hardware skinning, limiting the
+        influences of each vertex. Returns (None, None, 0) if the object is not
+        animated by a character """
+
+        if vertex_groups is None:
+            return None, None, 0
+
+        max_influences = self.writer.settings.max_bone_influences
+        transform_groups, indices, weights, num_limited = pack_vertex_influences(
+            vertex_groups, source_indices, max_influences)
+
+        transform_table = TransformTable()
+        for group in transform_groups:
+            joint = char.find_joint(obj.vertex_groups[group].name)
+            transform_table.add_transform(JointVertexTransform(joint))
+
+        skinning_buffer, index_size = interleave_skinning_columns(indices, weights)
+        self.writer._stats_limited_influences += num_limited
+        return transform_table, skinning_buffer, index_size
+
+    @profile_phase("geom_creation")
+    def _create_geom_from_buffers(self, obj, vertex_groups, buffers, char=None):
+        """ Creates a Geom from a set of packed GeomBuffers """
+
+        num_vertices = buffers.num_vertices
+        num_triangles = buffers.num_triangles
+        use_32_bit_indices = buffers.use_32_bit_indices
+
+        blend_table, blend_buffer = None, None
+        transform_table, skinning_buffer = None, None
+
+        if self.writer.settings.skinning_mode == "HARDWARE":
+            transform_table, skinning_buffer, index_size = self._create_skinning_buffer(
+                obj, vertex_groups, char, buffers.source_indices)
         else:
-            blend_table = None
-            blend_buffer = None
-
-        # Store the location of each mesh vertex
-        vertex_mappings = [-1 for i in range(len(vertices))]
-        vertex_uvs = [0.0 for i in range(len(vertices))]
-
-        # Iterate over all triangles
-        for poly in polygons:
-
-            # Check if the polygon uses smooth shading
-            is_smooth = poly.use_smooth
-
-            # Iterate over the 3 vertices of that triangle
-            for idx, vertex_index in enumerate(poly.vertices):
-
-                # If the vertex is already known, just write its index, but only
-                # if the polygon does use smooth shading, otherwise all vertices
-                # are duplicated anyway.
-                if is_smooth and vertex_mappings[vertex_index] >= 0:
-
-                    # Store wheter we can reuse the vertex data
-                    can_reuse = True
-
-                    if have_texcoords:
-                        # Check if the vertex texcoord matches. This might not be
-                        # the cases on corners
-                        u, v = uv_coordinates[poly.loop_indices[idx]].uv.to_2d()
-                        uv_key = u * 10000.0 + v
-                        if abs(vertex_uvs[vertex_index] - uv_key) > 0.0001:
-                            # Vertex uv does *not* match. Most likely we are on an
-                            # edge, so duplicate the vertex
-                            can_reuse = False
-                            num_duplicated += 1
-
-                    # If we can reuse the vertex data, just reference it
-                    if can_reuse:
-                        index_buffer.append(vertex_mappings[vertex_index])
-                        continue
-
-                # If the vertex is not known, store its data and then write its index
-                vertex = vertices[vertex_index]
-
-                # Write the vertex object position
-                vertex_buffer.append(vertex.co[0])
-                vertex_buffer.append(vertex.co[1])
-                vertex_buffer.append(vertex.co[2])
-
-                # Write the vertex normal
-                # When smooth shading is enabled, write per vertex normals,
-                # otherwise write the per-poly normal for all vertices
-                if is_smooth:
-                    vertex_buffer.append(vertex.normal[0])
-                    vertex_buffer.append(vertex.normal[1])
-                    vertex_buffer.append(vertex.normal[2])
-                else:
-                    vertex_buffer.append(poly.normal[0])
-                    vertex_buffer.append(poly.normal[1])
-                    vertex_buffer.append(poly.normal[2])
-
-                # Add the texcoord
-                if have_texcoords:
-                    u, v = uv_coordinates[poly.loop_indices[idx]].uv.to_2d()
-                    vertex_buffer.append(u)
-                    vertex_buffer.append(v)
-                    vertex_uvs[vertex_index] = u * 10000.0 + v
-
-                # Store the vertex index in the triangle data
-                index_buffer.append(num_vertices)
-
-                # Store the transform blends.
-                if blend_table:
-                    blend = TransformBlend()
-                    for element in vertex.groups:
-                        if element.weight != 0.0:
-                            blend.add_transform(jvts[element.group], element.weight)
-
-                    index = blend_table.add_blend(blend)
-                    blend_buffer.append(index)
-
-                # Store the vertex index in the mappings and increment the
-                # vertex counter
-                vertex_mappings[vertex_index] = num_vertices
-                num_vertices += 1
-
-            num_triangles += 1
+            blend_table, blend_buffer = self._create_blend_buffer(obj, vertex_groups, char, buffers.source_indices)
 
         # Determine the right vertex format
         vertex_format = self.gvd_formats['v3n3']
@@ -225,18 +221,18 @@ class GeometryWriter:
             index_format = self.gvd_formats['index32']
 
         # If we use texcoords, use a format which supports them
-        if have_texcoords:
+        if buffers.have_texcoords:
             vertex_format = self.gvd_formats['v3n3t2']
 
         format = GeomVertexFormat(vertex_format)
 
         # Create the vertex array data, to store the per-vertex data
         array_data = GeomVertexArrayData(vertex_format, GeomEnums.UH_static)
-        array_data.buffer += vertex_buffer
+        array_data.buffer += buffers.vertex_buffer
 
         # Create the index array data, to store the per-primitive vertex references
         index_array_data = GeomVertexArrayData(index_format, GeomEnums.UH_static)
-        index_array_data.buffer += index_buffer
+        index_array_data.buffer += buffers.index_buffer
 
         # Create the animation array data, to store transform blend indices
         if blend_table:
@@ -249,6 +245,18 @@ class GeometryWriter:
             blend_array_data = GeomVertexArrayData(blend_format, GeomEnums.UH_static)
             blend_array_data.buffer += blend_buffer
 
+        # Create the skinning array data, to store the transform weights and
+        # indices, which get applied by the shader
+        if transform_table:
+            skinning_format = self._get_skinning_format(self.writer.settings.max_bone_influences, index_size)
+            format.arrays.append(skinning_format)
+            format.animation_type = GeomEnums.AT_hardware
+            format.num_transforms = self.writer.settings.max_bone_influences
+            format.indexed_transforms = True
+
+            skinning_array_data = GeomVertexArrayData(skinning_format, GeomEnums.UH_static)
+            skinning_array_data.buffer += skinning_buffer
+
         # Create the array container for the per-vertex data
         vertex_data = GeomVertexData("triangle", format, GeomEnums.UH_static)
         vertex_data.arrays.append(array_data)
@@ -257,6 +265,10 @@ class GeometryWriter:
             vertex_data.arrays.append(blend_array_data)
             vertex_data.transform_blend_table = blend_table
 
+        if transform_table:
+            vertex_data.arrays.append(skinning_array_data)
+            vertex_data.transform_table = transform_table
+
         # Create the primitive container
         triangles = GeomTriangles(GeomEnums.UH_static)
         triangles.vertices = index_array_data
@@ -274,14 +286,277 @@ class GeometryWriter:
         geom = Geom(vertex_data)
         geom.primitives.append(triangles)
 
+        # The vertices of skinned geoms move, so their bounds are not known
+        if self.writer.bounds_builder:
+            if blend_table or transform_table:
+                self.writer.bounds_builder.add_geom(geom, None)
+            else:
+                self.writer.bounds_builder.add_geom(geom, buffers.bounds)
+
         # Increment statistics
         self.writer._stats_exported_vertices += num_vertices
         self.writer._stats_exported_tris += num_triangles
-        self.writer._stats_duplicated_vertices += num_duplicated
+        self.writer._stats_duplicated_vertices += buffers.num_duplicated
+        self.writer._stats_welded_vertices += buffers.num_welded
         self.writer._stats_exported_geoms += 1
 
+        if use_32_bit_indices:
+            self.writer._stats_index32_geoms += 1
+        else:
+            self.writer._stats_index16_geoms += 1
+
         return geom
 
+    @profile_phase("packing")
+    def _pack_mesh(self, mesh, uv_coordinates, num_slots, options):
+        """ Packs the polygons of a triangulated mesh, walking each polygon in
+        python. Returns a list of (material index, GeomBuffers) tuples for all
+        material slots which are referenced by at least one polygon, and the
+        PackReport """
+
+        # Group the polygons by their material index. We have to perform this
+        # operation, because we have to create a single geom for each material
+        polygons_by_material = self._group_mesh_faces_by_material(mesh)
+        report = PackReport()
+
+        packed_geoms = []
+        for index in range(num_slots):
+            polygons = polygons_by_material[index]
+
+            # Skip the material slot if no polygon references it
+            if len(polygons) < 1:
+                continue
+
+            def pack(selection, use_32_bit_indices):
+                return pack_polygons(mesh, [polygons[i] for i in selection], uv_coordinates,
+                                     use_32_bit_indices, options.reuse_vertices)
+
+            centers = numpy.array([tuple(polygon.center) for polygon in polygons], dtype=numpy.float32)
+            for buffers in pack_material_group(mesh.name, centers, pack, options, report):
+                packed_geoms.append((index, buffers))
+
+        finish_packed_geoms(packed_geoms, options, report)
+        return packed_geoms, report
+
+    def _should_generate_lods(self, mesh, char, parent):
+        """ Returns whether LOD levels should be generated for a mesh. Skinned
+        meshes and meshes which are already part of an LOD are skipped """
+        if char is not None or isinstance(parent, LODNode):
+            return False
+        return len(mesh.polygons) >= self.writer.settings.lod_min_triangles
+
+    def _add_packed_geoms(self, virtual_geom_node, obj, material_slots, vertex_groups, char,
+                          packed_geoms, report):
+        """ Creates the geoms from the packed buffers and adds them to the geom
+        node, using the render state of their material slot. If LOD levels
+        were generated, the node is an LOD node, which gets a geom node per
+        level instead """
+
+        self._log_pack_report(report)
+
+        if report.lod_levels:
+            self._add_lod_levels(virtual_geom_node, obj, material_slots, vertex_groups, char,
+                                 [packed_geoms] + report.lod_levels)
+        else:
+            self._add_geoms(virtual_geom_node, obj, material_slots, vertex_groups, char, packed_geoms)
+
+    def _add_lod_levels(self, lod_node, obj, material_slots, vertex_groups, char, levels):
+        """ Adds a geom node for each level to the LOD node. The switch
+        distances are chosen so that the next level is used once the bounding
+        sphere of the mesh covers less than half of the screen size of the
+        previous switch """
+        radius = merge_bounds([buffers.bounds for index, buffers in levels[0]])[2]
+        screen_size = self.writer.settings.lod_screen_size
+        tan_half_fov = math.tan(math.radians(self.LOD_FOV) * 0.5)
+
+        distances = [0.0]
+        for level in range(1, len(levels)):
+            distances.append(radius / (screen_size * tan_half_fov))
+            screen_size *= 0.5
+        distances.append(float('inf'))
+
+        for level, packed_geoms in enumerate(levels):
+            level_node = GeomNode("{}-LOD{}".format(obj.data.name, level))
+            self._add_geoms(level_node, obj, material_slots, vertex_groups, char, packed_geoms)
+            lod_node.add_switch(distances[level + 1], distances[level])
+            lod_node.add_child(level_node)
+
+    def _add_geoms(self, virtual_geom_node, obj, material_slots, vertex_groups, char, packed_geoms):
+        """ Creates the geoms from the packed buffers and adds them to the geom
+        node, using the render state of their material slot """
+
+        # Create the different geoms, 1 per material
+        for index, buffers in packed_geoms:
+            use_atlas = self.apply_texture_atlas(material_slots[index], buffers)
+            render_state = self.get_render_state(material_slots[index], use_atlas)
+
+            # Create a geom from the packed buffers
+            virtual_geom = self._create_geom_from_buffers(obj, vertex_groups, buffers, char=char)
+
+            # Add that geom to the geom node
+            virtual_geom_node.add_geom(virtual_geom, render_state)
+
+    def _log_pack_report(self, report):
+        """ Logs the messages collected while packing a mesh """
+        for message in report.warnings:
+            self.log_instance.warning(message)
+        for message in report.infos:
+            self.log_instance.info(message)
+        self.writer._stats_split_geoms += report.num_splits
+
+        if report.vertex_cache_seconds:
+            self.profiler.add_record("vertex_cache", report.vertex_cache_seconds)
+
+    def open_disk_cache(self, directory, max_bytes):
+        """ Enables the on-disk geometry cache, which only works with the
+        numpy engine, since it is keyed on the mesh snapshot """
+        self.disk_cache = GeometryCache(directory, max_bytes)
+
+    def close_disk_cache(self):
+        """ Evicts old entries from the on-disk geometry cache and closes it """
+        if self.disk_cache:
+            num_removed = self.disk_cache.trim()
+            self.log_instance.info("Geometry cache:", self.disk_cache.num_hits, "hits,",
+                                   self.disk_cache.num_misses, "misses, evicted", num_removed, "entries")
+            self.disk_cache = None
+
+    def start_pool(self, num_workers):
+        """ Starts the worker processes used to pack the geometry. While the
+        pool is running, write_mesh only snapshots the mesh data and queues it,
+        the geoms get created by finish_pending_geoms """
+
+        # The worker processes have to run the bundled python interpreter,
+        # and not the blender executable. The setting is global, so the
+        # previous executable gets restored by shutdown_pool
+        self.previous_executable = multiprocessing.spawn.get_executable()
+        multiprocessing.set_executable(bpy.app.binary_path_python)
+        self.pool = ProcessPoolExecutor(max_workers=num_workers or None)
+        self.pending_geoms = []
+
+    def finish_pending_geoms(self):
+        """ Waits for all queued meshes and creates their geoms, in the same
+        order they were queued in, so the output does not depend on which
+        worker finishes first """
+        for virtual_geom_node, obj, material_slots, vertex_groups, char, cache_key, future in self.pending_geoms:
+            with self.profiler.object(obj.name):
+                with self.profiler.phase("packing_wait"):
+                    packed_geoms, report = future.result()
+                if cache_key:
+                    self.disk_cache.store(cache_key, (packed_geoms, report))
+                self._add_packed_geoms(virtual_geom_node, obj, material_slots, vertex_groups, char,
+                                       packed_geoms, report)
+        self.pending_geoms = []
+
+    def shutdown_pool(self):
+        """ Stops the worker processes, if they were started, and restores the
+        executable used by multiprocessing, so other addons are not affected """
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+        if self.previous_executable:
+            multiprocessing.set_executable(self.previous_executable)
+            self.previous_executable = None
+
+    def _convert_mesh(self, obj):
+        """ Converts an object to a triangulated mesh with the modifiers
+        applied. Returns the mesh, which has to be removed by the caller, and
+        its active uv layer, or None if it has no uvs """
+
+        # Convert the object to a mesh, so we can read the polygons
+        with self.profiler.phase("to_mesh"):
+            mesh = obj.to_mesh(self.writer.context.scene,
+                               apply_modifiers=True,
+                               settings='PREVIEW',
+                               calc_tessface=True,
+                               calc_undeformed=True)
+
+        with self.profiler.phase("triangulation"):
+            # Get a BMesh representation
+            b_mesh = bmesh.new()
+            b_mesh.from_mesh(mesh)
+
+            # Triangulate the mesh. This makes stuff simpler, and panda can't handle
+            # polygons with more than 3 vertices.
+            bmesh.ops.triangulate(b_mesh, faces=b_mesh.faces)
+
+            # Copy the bmesh back to the original mesh
+            b_mesh.to_mesh(mesh)
+
+        # Find the active uv layer, in case there is one.
+        if mesh.uv_layers.active:
+            active_uv_layer = mesh.uv_layers.active.data
+        else:
+            active_uv_layer = None
+
+        # Calculate the per-vertex normals, in case blender did not do that yet.
+        mesh.calc_normals()
+
+        return mesh, active_uv_layer
+
+    def _get_material_slots(self, obj):
+        """ Extracts the material slots, but ensures there is always one slot, so
+        objects with no actual material get exported, too """
+        material_slots = obj.material_slots
+
+        if len(material_slots) == 0:
+            material_slots = [None]
+
+        return material_slots
+
+    def get_render_state(self, slot, use_atlas=False):
+        """ Returns the render state of a material slot, using the texture
+        atlases of its material if use_atlas is set """
+
+        # Create a virtual material if the slot contains a material. Otherwise
+        # just use an empty material
+        if slot:
+            return self.writer.material_writer.create_state_from_material(slot.material, use_atlas)
+        return RenderState.empty
+
+    def apply_texture_atlas(self, slot, buffers):
+        """ Moves the texcoords of the buffers into the atlas region of the
+        material of the slot, if its images are in a texture atlas. Returns
+        whether the buffers have to use the atlased render state. Buffers
+        whose texcoords repeat the texture keep the original images """
+        atlas_builder = self.writer.atlas_builder
+        if not atlas_builder or not slot or not buffers.have_texcoords:
+            return False
+
+        region = atlas_builder.get_region(slot.material)
+        if not region:
+            return False
+
+        if remap_texcoords(buffers, region.offset, region.scale):
+            return True
+
+        atlas_builder.num_repeating_geoms += 1
+        return False
+
+    def pack_static_mesh(self, obj):
+        """ Converts and packs the mesh of an object without creating any geoms,
+        used to batch static meshes. Returns the material slots and a list of
+        (material index, GeomBuffers) tuples """
+
+        mesh, active_uv_layer = self._convert_mesh(obj)
+        material_slots = self._get_material_slots(obj)
+
+        # Batched meshes are merged, so they do not get LOD levels
+        options = PackOptions(self.writer.settings)
+        options.lod_ratios = ()
+
+        if self.writer.settings.geometry_engine == "NUMPY":
+            with self.profiler.phase("snapshot"):
+                snapshot = MeshSnapshot(mesh, active_uv_layer)
+            with self.profiler.phase("packing"):
+                packed_geoms, report = pack_snapshot(snapshot, len(material_slots), options)
+        else:
+            packed_geoms, report = self._pack_mesh(mesh, active_uv_layer, len(material_slots), options)
+
+        bpy.data.meshes.remove(mesh)
+        self._log_pack_report(report)
+        return material_slots, packed_geoms
+
     def write_mesh(self, obj, parent):
         """ Internal method to process a mesh during the export process """
 
@@ -312,72 +587,58 @@ class GeometryWriter:
             virtual_geom_node = self.geom_cache[key]
 
         else:
-
-            # Create a new geom node to store all geoms
-            virtual_geom_node = GeomNode(obj.data.name)
-
-            # Convert the object to a mesh, so we can read the polygons
-            mesh = obj.to_mesh(self.writer.context.scene,
-                               apply_modifiers=True,
-                               settings='PREVIEW',
-                               calc_tessface=True,
-                               calc_undeformed=True)
-
-            # Get a BMesh representation
-            b_mesh = bmesh.new()
-            b_mesh.from_mesh(mesh)
-
-            # Triangulate the mesh. This makes stuff simpler, and panda can't handle
-            # polygons with more than 3 vertices.
-            bmesh.ops.triangulate(b_mesh, faces=b_mesh.faces)
-
-            # Copy the bmesh back to the original mesh
-            b_mesh.to_mesh(mesh)
-
-            # Find the active uv layer and its name, in case there is one.
-            if mesh.uv_layers.active:
-                active_uv_layer = mesh.uv_layers.active.data
-                active_uv_name = mesh.uv_layers.active.name
+            mesh, active_uv_layer = self._convert_mesh(obj)
+            material_slots = self._get_material_slots(obj)
+
+            vertex_groups = self._read_vertex_groups(obj, mesh, char)
+            options = PackOptions(self.writer.settings)
+            num_slots = len(material_slots)
+
+            # Meshes which get LOD levels are stored in an LOD node, with a
+            # geom node per level. Otherwise create a new geom node to store
+            # all geoms
+            if options.lod_ratios and self._should_generate_lods(mesh, char, parent):
+                virtual_geom_node = LODNode(obj.data.name)
             else:
-                active_uv_layer = None
-                active_uv_name = ""
-
-            # Group the polygons by their material index. We have to perform this
-            # operation, because we have to create a single geom for each material
-            polygons_by_material = self._group_mesh_faces_by_material(mesh)
-
-            # Calculate the per-vertex normals, in case blender did not do that yet.
-            mesh.calc_normals()
-
-            # Extract material slots, but ensure there is always one slot, so objects
-            # with no actual material get exported, too
-            material_slots = obj.material_slots
-
-            if len(material_slots) == 0:
-                material_slots = [None]
-
-            # Create the different geoms, 1 per material
-            for index, slot in enumerate(material_slots):
-
-                # Skip the material slot if no polygon references it
-                if len(polygons_by_material[index]) < 1:
-                    continue
-
-                # Create a virtual material if the slot contains a material. Otherwise
-                # just use an empty material
-                if slot:
-                    render_state = self.writer.material_writer.create_state_from_material(slot.material)
+                options.lod_ratios = ()
+                virtual_geom_node = GeomNode(obj.data.name)
+
+            # Pack the geom buffers, 1 per material
+            if self.writer.settings.geometry_engine == "NUMPY":
+                with self.profiler.phase("snapshot"):
+                    snapshot = MeshSnapshot(mesh, active_uv_layer)
+                cache_key = None
+                cached = None
+
+                # Check if the packed buffers are stored from a previous export
+                if self.disk_cache:
+                    cache_key = self.disk_cache.make_key(snapshot, vertex_groups, obj, options)
+                    cached = self.disk_cache.load(cache_key)
+
+                if cached:
+                    packed_geoms, report = cached
+
+                    # The vertex cache was optimized by a previous export
+                    report.vertex_cache_seconds = 0.0
+                    self._add_packed_geoms(virtual_geom_node, obj, material_slots,
+                                           vertex_groups, char, packed_geoms, report)
+                elif self.pool:
+                    # Queue the snapshot, the geoms get added once all objects
+                    # are processed
+                    future = self.pool.submit(pack_snapshot, snapshot, num_slots, options)
+                    self.pending_geoms.append((virtual_geom_node, obj, material_slots,
+                                               vertex_groups, char, cache_key, future))
                 else:
-                    render_state = RenderState.empty
-
-                # Extract the per-material polygon list
-                polygons = polygons_by_material[index]
-
-                # Create a geom from those polygons
-                virtual_geom = self._create_geom_from_polygons(obj, mesh, polygons, active_uv_layer, char=char)
-
-                # Add that geom to the geom node
-                virtual_geom_node.add_geom(virtual_geom, render_state)
+                    with self.profiler.phase("packing"):
+                        packed_geoms, report = pack_snapshot(snapshot, num_slots, options)
+                    if cache_key:
+                        self.disk_cache.store(cache_key, (packed_geoms, report))
+                    self._add_packed_geoms(virtual_geom_node, obj, material_slots,
+                                           vertex_groups, char, packed_geoms, report)
+            else:
+                packed_geoms, report = self._pack_mesh(mesh, active_uv_layer, num_slots, options)
+                self._add_packed_geoms(virtual_geom_node, obj, material_slots,
+                                       vertex_groups, char, packed_geoms, report)
 
             bpy.data.meshes.remove(mesh)
 
@@ -0,0 +1,76 @@
+import hashlib
+import numpy
+
+
+# Amount of bytes read at once when hashing image files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Amount of pixel rows converted at once, to avoid large temporary arrays
+CONVERT_CHUNK_ROWS = 256
+
+# Amount of pixel rows read at once from blender versions without
+# foreach_get, which return the pixels as tuple of python floats
+READ_CHUNK_ROWS = 64
+
+
+def hash_file(filepath, chunk_size=HASH_CHUNK_SIZE):
+    """ Computes the sha1 hash of a file, reading it in chunks so large
+    images do not have to be loaded at once """
+    hasher = hashlib.sha1()
+    with open(filepath, "rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_bytes(data, chunk_size=HASH_CHUNK_SIZE):
+    """ Computes the sha1 hash of a bytes like object, like the data of a
+    packed file, in chunks """
+    hasher = hashlib.sha1()
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        hasher.update(view[start:start + chunk_size])
+    return hasher.hexdigest()
+
+
+def read_image_pixels(image):
+    """ Reads the pixels of a blender image as (height, width, channels)
+    float32 array, with the bottom row first """
+    width, height = image.size
+    pixels = numpy.empty(width * height * image.channels, dtype=numpy.float32)
+
+    # Newer blender versions can copy the pixels directly into the array,
+    # older ones have to go through a tuple. A tuple of the whole image
+    # takes several times the memory of the array, so it is read in slices
+    # of rows
+    if hasattr(image.pixels, "foreach_get"):
+        image.pixels.foreach_get(pixels)
+    else:
+        row_size = width * image.channels
+        for start in range(0, height, READ_CHUNK_ROWS):
+            end = min(height, start + READ_CHUNK_ROWS)
+            pixels[start * row_size:end * row_size] = image.pixels[start * row_size:end * row_size]
+
+    return pixels.reshape(height, width, image.channels)
+
+
+def convert_to_ram_image(pixels, num_components):
+    """ Converts float pixels to the layout of a Panda3D ram image: unsigned
+    bytes with the bottom row first, and the color components in BGR(A)
+    order. The rows are converted in chunks, so only a small float temporary
+    is needed. Returns a bytearray """
+    height, width, channels = pixels.shape
+
+    # Missing channels of images with less channels are filled with the last one
+    order = {1: [0], 2: [0, 3], 3: [2, 1, 0], 4: [2, 1, 0, 3]}[num_components]
+    order = [min(channel, channels - 1) for channel in order]
+
+    row_bytes = width * num_components
+    ram_image = bytearray(height * row_bytes)
+    target = numpy.frombuffer(ram_image, dtype=numpy.uint8).reshape(height, width, num_components)
+
+    for start in range(0, height, CONVERT_CHUNK_ROWS):
+        chunk = pixels[start:start + CONVERT_CHUNK_ROWS][:, :, order]
+        target[start:start + CONVERT_CHUNK_ROWS] = numpy.clip(chunk * 255.0 + 0.5, 0.0, 255.0)
+
+    return ram_image
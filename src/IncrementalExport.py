@@ -0,0 +1,273 @@
+import os
+import bpy
+import numpy
+import hashlib
+
+
+class IncrementalExportCache(object):
+
+    """ Keeps the converted scene graph of each exported object between export
+    runs of the same blender session. Each entry stores a fingerprint of
+    everything the object depends on: its transform, mesh data, modifiers,
+    materials and textures. Objects whose fingerprint did not change reuse
+    their converted subtree instead of being converted again. Skinned objects
+    are never cached, see is_reusable. Reused subtrees keep their render
+    states, so the textures of their materials have to be written again, see
+    get_object_materials """
+
+    # One cache per bam file, so exporting different files does not evict
+    # each others entries
+    _caches = {}
+
+    @classmethod
+    def get(cls, filepath):
+        """ Returns the cache for the given bam file """
+        filepath = os.path.abspath(filepath)
+        if filepath not in cls._caches:
+            cls._caches[filepath] = cls()
+        return cls._caches[filepath]
+
+    def __init__(self):
+        self.entries = {}
+        self.num_reused = 0
+        self.num_rebuilt = 0
+
+    def lookup(self, obj, fingerprint):
+        """ Returns the cached node of the object, or None if the object changed
+        since the last export """
+        entry = self.entries.get(obj.name)
+        if entry and entry[0] == fingerprint:
+            self.num_reused += 1
+            return entry[1]
+
+        self.num_rebuilt += 1
+        return None
+
+    def store(self, obj, fingerprint, node):
+        """ Stores the converted node of an object """
+        self.entries[obj.name] = (fingerprint, node)
+
+    def reset_stats(self):
+        """ Resets the reuse statistics, called at the start of each export """
+        self.num_reused = 0
+        self.num_rebuilt = 0
+
+
+def is_reusable(obj, visited=None):
+    """ Returns whether the converted subtree of an object can be reused. The
+    skinned geometry of objects with an armature is parented to the joints of
+    the character, which is created again on every export, so these objects
+    and all objects referencing them are always converted again """
+    visited = visited if visited is not None else set()
+    if obj.name in visited:
+        return True
+    visited.add(obj.name)
+
+    if any(modifier.type == "ARMATURE" for modifier in obj.modifiers):
+        return False
+
+    return all(is_reusable(sub_obj, visited) for sub_obj in _get_subtree_objects(obj))
+
+
+def get_object_materials(obj, visited=None):
+    """ Returns the materials used in the converted subtree of an object. When
+    the subtree gets reused, these have to be created again, so their
+    textures get copied or baked again in case the destination files were
+    changed or deleted, and they show up in the export statistics """
+    visited = visited if visited is not None else set()
+    if obj.name in visited:
+        return []
+    visited.add(obj.name)
+
+    materials = [slot.material for slot in obj.material_slots if slot.material]
+    for sub_obj in _get_subtree_objects(obj):
+        materials += get_object_materials(sub_obj, visited)
+    return materials
+
+
+def _get_subtree_objects(obj):
+    """ Returns the objects which get converted as part of the subtree of an
+    object, like particle, level of detail and dupli group objects """
+    referenced = []
+    for modifier in obj.modifiers:
+        if modifier.type == "PARTICLE_SYSTEM" and modifier.particle_system.settings.dupli_object:
+            referenced.append(modifier.particle_system.settings.dupli_object)
+
+    if hasattr(obj, "lod_levels"):
+        referenced += [level.object for level in obj.lod_levels if level.object and level.object != obj]
+
+    if obj.dupli_type == "GROUP" and obj.dupli_group:
+        referenced += list(obj.dupli_group.objects)
+
+    return referenced
+
+
+def make_object_fingerprint(obj, writer):
+    """ Computes the fingerprint of an object, covering everything which
+    affects its converted subtree """
+    hasher = hashlib.sha1()
+    _hash_rna(hasher, writer.settings)
+    _hash_object(hasher, obj, writer, set())
+    return hasher.hexdigest()
+
+
+def _hash_object(hasher, obj, writer, visited):
+    """ Hashes an object and all objects it references """
+
+    # Objects can reference each other, e.g. through dupli groups
+    if obj.name in visited:
+        hasher.update(b"visited:" + obj.name.encode("utf-8"))
+        return
+    visited.add(obj.name)
+
+    hasher.update(repr((obj.name, obj.type, obj.data.name if obj.data else None)).encode("utf-8"))
+    hasher.update(repr(_to_plain(obj.matrix_world)).encode("utf-8"))
+    _hash_rna(hasher, obj)
+
+    # Object data
+    if obj.type == "MESH":
+        _hash_mesh(hasher, obj.data)
+    elif obj.data:
+        _hash_rna(hasher, obj.data)
+        if hasattr(obj.data, "pbepbs"):
+            _hash_rna(hasher, obj.data.pbepbs)
+
+    for group in obj.vertex_groups:
+        hasher.update(group.name.encode("utf-8"))
+
+    # Modifiers, including the particle systems and objects they reference,
+    # like mirror, boolean, shrinkwrap and curve targets
+    for modifier in obj.modifiers:
+        _hash_rna(hasher, modifier)
+
+        for prop in modifier.bl_rna.properties:
+            if prop.type == "POINTER" and prop.fixed_type.identifier == "Object":
+                target = getattr(modifier, prop.identifier)
+                hasher.update(repr((prop.identifier, target.name if target else None)).encode("utf-8"))
+                if target:
+                    _hash_object(hasher, target, writer, visited)
+
+        if modifier.type == "PARTICLE_SYSTEM":
+            particle_system = modifier.particle_system
+            _hash_rna(hasher, particle_system.settings)
+            _hash_array(hasher, particle_system.particles, "location", 3)
+            _hash_array(hasher, particle_system.particles, "rotation", 4)
+            _hash_array(hasher, particle_system.particles, "size", 1)
+            if particle_system.settings.dupli_object:
+                _hash_object(hasher, particle_system.settings.dupli_object, writer, visited)
+
+    # Materials and textures
+    for slot in obj.material_slots:
+        _hash_material(hasher, slot.material, writer)
+
+    # Game properties, which are written as tags
+    for prop in obj.game.properties:
+        hasher.update(repr((prop.name, str(prop.value))).encode("utf-8"))
+
+    # Level of detail
+    if hasattr(obj, "lod_levels"):
+        for level in obj.lod_levels:
+            hasher.update(repr((level.distance, level.use_mesh)).encode("utf-8"))
+            if level.object and level.object != obj:
+                _hash_object(hasher, level.object, writer, visited)
+
+    # Dupli groups
+    if obj.dupli_type == "GROUP" and obj.dupli_group:
+        for sub_obj in obj.dupli_group.objects:
+            _hash_object(hasher, sub_obj, writer, visited)
+
+
+def _hash_mesh(hasher, mesh):
+    """ Hashes the geometry of a mesh datablock, including its shape keys and
+    settings like auto smooth """
+    _hash_rna(hasher, mesh)
+    _hash_array(hasher, mesh.vertices, "co", 3)
+    _hash_array(hasher, mesh.loops, "vertex_index", 1, numpy.int32)
+    _hash_array(hasher, mesh.polygons, "loop_start", 1, numpy.int32)
+    _hash_array(hasher, mesh.polygons, "material_index", 1, numpy.int32)
+    _hash_array(hasher, mesh.polygons, "use_smooth", 1, bool)
+
+    for uv_layer in mesh.uv_layers:
+        hasher.update(repr((uv_layer.name, uv_layer.active)).encode("utf-8"))
+        _hash_array(hasher, uv_layer.data, "uv", 2)
+
+    for vertex in mesh.vertices:
+        for element in vertex.groups:
+            hasher.update(repr((element.group, element.weight)).encode("utf-8"))
+
+    if mesh.shape_keys:
+        _hash_rna(hasher, mesh.shape_keys)
+        for key_block in mesh.shape_keys.key_blocks:
+            _hash_rna(hasher, key_block)
+            hasher.update(repr(key_block.relative_key.name if key_block.relative_key else None).encode("utf-8"))
+            _hash_array(hasher, key_block.data, "co", 3)
+
+
+def _hash_material(hasher, material, writer):
+    """ Hashes a material, including its texture slots, images and its
+    region in the texture atlases """
+    _hash_rna(hasher, material)
+    if not material:
+        return
+
+    # The texcoords of atlased geoms depend on the packing of the atlas
+    region = writer.atlas_builder.get_region(material) if writer.atlas_builder else None
+    if region:
+        texture_names = sorted((index, texture.name) for index, texture in region.textures.items())
+        hasher.update(repr((region.offset, region.scale, texture_names)).encode("utf-8"))
+
+    _hash_rna(hasher, material.pbepbs)
+    _hash_rna(hasher, material.game_settings)
+
+    for tex_slot in material.texture_slots:
+        _hash_rna(hasher, tex_slot)
+        if not tex_slot or not tex_slot.texture:
+            continue
+
+        _hash_rna(hasher, tex_slot.texture)
+        image = getattr(tex_slot.texture, "image", None)
+        _hash_rna(hasher, image)
+
+        # Also check the file itself, in case the image was edited externally
+        if image and image.filepath:
+            path = bpy.path.abspath(image.filepath)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                hasher.update(repr((stat.st_size, stat.st_mtime)).encode("utf-8"))
+
+
+def _hash_array(hasher, collection, attribute, size, dtype=numpy.float32):
+    """ Hashes an attribute of all elements of a collection, using the bulk
+    foreach_get accessor """
+    values = numpy.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attribute, values)
+    hasher.update(values.tobytes())
+
+
+# Properties which change without affecting the export
+VOLATILE_PROPERTIES = ("rna_type", "is_updated", "is_updated_data", "tag", "users", "select")
+
+
+def _hash_rna(hasher, struct):
+    """ Hashes all plain properties of a blender struct. Pointers and
+    collections are skipped, they have to be hashed explicitly """
+    if struct is None:
+        hasher.update(b"none")
+        return
+
+    for prop in struct.bl_rna.properties:
+        if prop.identifier in VOLATILE_PROPERTIES or prop.type in ("POINTER", "COLLECTION"):
+            continue
+        value = getattr(struct, prop.identifier, None)
+        hasher.update(repr((prop.identifier, _to_plain(value))).encode("utf-8"))
+
+
+def _to_plain(value):
+    """ Converts blender property values, like vectors and matrices, to plain
+    python values """
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return value
+    try:
+        return tuple(_to_plain(item) for item in value)
+    except TypeError:
+        return repr(value)
@@ -0,0 +1,57 @@
+import numpy
+
+
+# Bytes used by each value of an animation table in the bam file
+BYTES_PER_VALUE = 4
+
+# Default values of the scale, heading/pitch/roll and translation channels.
+# Tables containing only the default value are not written at all.
+CHANNEL_DEFAULTS = (1.0, 1.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+
+def reduce_channel(values, default, tolerance=0.0, quantize=False):
+    """ Reduces the sampled values of a channel, so that no value differs by
+    more than the tolerance from the original one. Returns an empty array if
+    the channel is at its default value, a single value if it is constant, and
+    otherwise all values, snapped to a grid of the tolerance when quantizing """
+    if len(values) == 0:
+        return values
+
+    low, high = values.min(), values.max()
+
+    if max(abs(low - default), abs(high - default)) <= tolerance:
+        return values[:0]
+
+    if high - low <= 2.0 * tolerance:
+        if low == high:
+            return values[:1]
+        return numpy.array([(low + high) * 0.5], dtype=values.dtype)
+
+    # Rounding to multiples of the tolerance changes each value by at most
+    # half of the tolerance, and makes nearly equal values exactly equal
+    if quantize and tolerance > 0.0:
+        return (numpy.round(values / tolerance) * tolerance).astype(values.dtype)
+
+    return values
+
+
+def reduce_channels(channels, position_tolerance=0.0, angle_tolerance=0.0, scale_tolerance=0.0,
+                    quantize=False):
+    """ Reduces the channels returned by bake_bone_channels. Returns a list of
+    arrays for the scale, heading/pitch/roll and translation channels """
+    tolerances = [scale_tolerance] * 3 + [angle_tolerance] * 3 + [position_tolerance] * 3
+    return [reduce_channel(values, default, tolerance, quantize)
+            for values, default, tolerance in zip(channels, CHANNEL_DEFAULTS, tolerances)]
+
+
+def get_channels_size(channels, num_frames=None):
+    """ Returns the amount of bytes the channels take up in the bam file. When
+    num_frames is given, animated channels are counted with that many frames
+    instead of their actual length, to estimate the size at another frame rate """
+    num_values = 0
+    for values in channels:
+        if num_frames is not None and len(values) > 1:
+            num_values += num_frames
+        else:
+            num_values += len(values)
+    return num_values * BYTES_PER_VALUE
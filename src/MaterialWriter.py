@@ -4,6 +4,7 @@ import bpy
 import time
 
 from ExportException import ExportException
+from ExportProfiler import profile_phase
 
 from pybamwriter.panda_types import *
 
@@ -20,8 +21,17 @@ class MaterialWriter(object):
         "TRANSPARENT_EMISSIVE"
     ]
 
+    # Properties of the virtual material and the samplers which have to be
+    # equal for atlased materials to share a render state
+    MATERIAL_PROPERTIES = ("diffuse", "ambient", "specular", "emission", "base_color",
+                           "metallic", "roughness", "refractive_index")
+    SAMPLER_PROPERTIES = ("magfilter", "minfilter", "wrap_u", "wrap_v", "wrap_w", "anisotropic_degree")
+
     def __init__(self, writer):
         self.material_state_cache = {}
+        self.atlas_state_cache = {}
+        self.atlas_states_by_signature = {}
+        self.num_shared_atlas_states = 0
         self.writer = writer
         self.make_default_material()
 
@@ -30,6 +40,11 @@ class MaterialWriter(object):
         """ Helper to access the log instance """
         return self.writer.log_instance
 
+    @property
+    def profiler(self):
+        """ Helper to access the export profiler """
+        return self.writer.profiler
+
     def make_default_material(self):
         """ Creates the default material """
         self.default_material = Material()
@@ -42,15 +57,42 @@ class MaterialWriter(object):
         self.default_material.refractive_index = 1.5
         self.default_material.emission = (0, 0, 0, 0)
 
-    def create_state_from_material(self, material):
-        """ Creates a render state based on a material """
+    def is_srgb_slot(self, idx, tex_slot):
+        """ Returns whether a texture slot stores srgb colors. This is the case
+        for the first slot, and for slots named like a color texture """
+        lower_name = tex_slot.name.lower().replace(" ", "")
+        return idx == 0 or "diffuse" in lower_name or "albedo" in lower_name or "basecolor" in lower_name
+
+    def _get_state_signature(self, virtual_material, stage_nodes, virtual_state):
+        """ Returns a key which is equal for atlased render states with the same
+        effect, so materials which only differ in their atlased images can
+        share one state. Attributes which are not created per material are
+        compared by identity """
+        properties = tuple(getattr(virtual_material, name, None) for name in self.MATERIAL_PROPERTIES)
+        stages = tuple((stage.stage.sort, id(stage.texture)) +
+                       tuple(getattr(stage.sampler, name, None) for name in self.SAMPLER_PROPERTIES)
+                       for stage in stage_nodes)
+        attribs = tuple(id(attrib) for attrib in virtual_state.attributes
+                        if not isinstance(attrib, (MaterialAttrib, TextureAttrib, TexMatrixAttrib)))
+        return properties, stages, attribs
+
+    @profile_phase("material_creation")
+    def create_state_from_material(self, material, use_atlas=False):
+        """ Creates a render state based on a material. If use_atlas is set and
+        the images of the material are in a texture atlas, the state uses the
+        atlas textures instead """
 
         if not material:
             return self.default_state
 
+        region = None
+        if use_atlas and self.writer.atlas_builder:
+            region = self.writer.atlas_builder.get_region(material)
+        state_cache = self.atlas_state_cache if region else self.material_state_cache
+
         # Check if we already created this material
-        if material.name in self.material_state_cache:
-            return self.material_state_cache[material.name]
+        if material.name in state_cache:
+            return state_cache[material.name]
 
         # Create the render and material state
         virtual_state = RenderState()
@@ -148,20 +190,16 @@ class MaterialWriter(object):
         # Iterate over the texture slots and extract the stage nodes
         stage_nodes = []
         for idx, tex_slot in enumerate(material.texture_slots):
-            use_srgb = idx == 0
-
             if tex_slot:
-                lower_name = tex_slot.name.lower().replace(" ", "")
-                if ("diffuse" in lower_name or "albedo" in lower_name or
-                        "basecolor" in lower_name):
-                    use_srgb = True
+                use_srgb = self.is_srgb_slot(idx, tex_slot)
 
                 if use_srgb:
                     self.log_instance.info("Detected srgb for texture", tex_slot.name)
                 else:
                     self.log_instance.info("Using standard rgb for texture", tex_slot.name)
                 stage_node = self.writer.texture_writer.create_stage_node_from_texture_slot(
-                    tex_slot, sort=idx * 10, use_srgb=use_srgb)
+                    tex_slot, sort=idx * 10, use_srgb=use_srgb,
+                    atlas_texture=region.textures.get(idx) if region else None)
                 if stage_node:
                     stage_nodes.append(stage_node)
                 else:
@@ -224,6 +262,15 @@ class MaterialWriter(object):
             if attrib:
                 virtual_state.attributes.append(attrib)
 
-        self.material_state_cache[material.name] = virtual_state
+        # Materials which only differ in their atlased images share one state
+        if region:
+            signature = self._get_state_signature(virtual_material, stage_nodes, virtual_state)
+            if signature in self.atlas_states_by_signature:
+                virtual_state = self.atlas_states_by_signature[signature]
+                self.num_shared_atlas_states += 1
+            else:
+                self.atlas_states_by_signature[signature] = virtual_state
+
+        state_cache[material.name] = virtual_state
 
         return virtual_state
@@ -0,0 +1,288 @@
+import heapq
+import numpy
+from array import array
+
+from GeomBuffers import GeomBuffers
+
+
+# Weight of the planes which keep boundary and seam edges in place, relative
+# to the planes of the triangles
+BOUNDARY_WEIGHT = 100.0
+
+# Collapses which rotate the normal of a remaining triangle so that the dot
+# product of the old and new normal drops below this value are rejected, to
+# avoid folding triangles over
+MIN_NORMAL_DOT = 0.2
+
+# The edge collapses run in python, so larger geoms are not decimated. Geoms
+# split to 16 bit indices usually stay below this
+MAX_DECIMATE_TRIANGLES = 2 ** 17
+
+
+def _index_dtype(buffers):
+    """ Returns the numpy dtype matching the index buffer """
+    return numpy.uint32 if buffers.use_32_bit_indices else numpy.uint16
+
+
+def _position_keys(positions):
+    """ Returns one hashable value per row of a (n, 3) float32 position
+    array, to compare positions exactly """
+    positions = numpy.ascontiguousarray(positions, dtype=numpy.float32)
+    return positions.view(numpy.dtype((numpy.void, positions.dtype.itemsize * 3))).reshape(-1)
+
+
+def find_shared_positions(buffers_list):
+    """ Returns the (n, 3) array of the vertex positions which are used by
+    more than one of the given GeomBuffers, like the borders between the
+    parts of a split geom """
+    positions = []
+    for buffers in buffers_list:
+        vertices = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32)
+        vertices = vertices.reshape(buffers.num_vertices, buffers.vertex_stride)
+        positions.append(numpy.unique(vertices[:, :3], axis=0))
+
+    if not positions:
+        return numpy.zeros((0, 3), dtype=numpy.float32)
+    unique_positions, counts = numpy.unique(numpy.concatenate(positions), axis=0, return_counts=True)
+    return unique_positions[counts > 1]
+
+
+def _plane_quadrics(points, normals, weights):
+    """ Computes the weighted 4x4 error quadrics of the planes through the
+    given points with the given unit normals """
+    planes = numpy.column_stack((normals, -(normals * points).sum(axis=1)))
+    return weights[:, numpy.newaxis, numpy.newaxis] * planes[:, :, numpy.newaxis] * planes[:, numpy.newaxis, :]
+
+
+def _compute_quadrics(positions, triangles, corner_vertices, num_positions):
+    """ Computes the error quadric of each position, from the planes of its
+    triangles and the planes perpendicular to its boundary and seam edges.
+    Seams are edges which are shared in position, but not in the packed
+    vertices, like the borders of uv islands """
+    corners = positions[triangles]
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = numpy.sqrt((normals * normals).sum(axis=1))
+    unit_normals = normals / numpy.maximum(areas, 1e-30)[:, numpy.newaxis]
+
+    quadrics = numpy.zeros((num_positions, 4, 4), dtype=numpy.float64)
+    triangle_quadrics = _plane_quadrics(corners[:, 0], unit_normals, areas * 0.5)
+    for corner in range(3):
+        numpy.add.at(quadrics, triangles[:, corner], triangle_quadrics)
+
+    # Edges of the packed vertices which are only used by one triangle are
+    # either on the boundary of the mesh, or on a seam
+    edges = numpy.concatenate([corner_vertices[:, (0, 1)], corner_vertices[:, (1, 2)], corner_vertices[:, (2, 0)]])
+    edge_triangles = numpy.tile(numpy.arange(len(triangles)), 3)
+    _, inverse, counts = numpy.unique(numpy.sort(edges, axis=1), axis=0, return_inverse=True, return_counts=True)
+    single = counts[inverse.reshape(-1)] == 1
+
+    if single.any():
+        position_edges = numpy.concatenate([triangles[:, (0, 1)], triangles[:, (1, 2)], triangles[:, (2, 0)]])[single]
+        start, end = positions[position_edges[:, 0]], positions[position_edges[:, 1]]
+        direction = end - start
+        lengths_squared = (direction * direction).sum(axis=1)
+
+        edge_normals = numpy.cross(direction, unit_normals[edge_triangles[single]])
+        edge_normals /= numpy.maximum(numpy.sqrt((edge_normals * edge_normals).sum(axis=1)), 1e-30)[:, numpy.newaxis]
+
+        edge_quadrics = _plane_quadrics(start, edge_normals, lengths_squared * BOUNDARY_WEIGHT)
+        numpy.add.at(quadrics, position_edges[:, 0], edge_quadrics)
+        numpy.add.at(quadrics, position_edges[:, 1], edge_quadrics)
+
+    return quadrics
+
+
+class _Decimator(object):
+
+    """ Greedy edge collapse simplification, using quadric error metrics as
+    described by Garland and Heckbert. Edges are collapsed into one of their
+    end points, so the surviving packed vertices keep their exact normals,
+    texcoords and source indices. Locked positions never move, so geoms
+    sharing them keep matching borders """
+
+    def __init__(self, vertices, triangles, locked_positions=None):
+        self.vertices = vertices
+        self.attributes = vertices[:, 3:].astype(numpy.float64)
+
+        # Vertices with the same position get collapsed together, regardless
+        # of their normal and texcoord
+        unique_positions, position_of = numpy.unique(vertices[:, :3], axis=0, return_inverse=True)
+        self.position_of = position_of.reshape(-1)
+        self.positions = unique_positions.astype(numpy.float64)
+        num_positions = len(self.positions)
+
+        self.locked = numpy.zeros(num_positions, dtype=bool)
+        if locked_positions is not None and len(locked_positions):
+            self.locked = numpy.isin(_position_keys(unique_positions), _position_keys(locked_positions))
+
+        self.corners = triangles.astype(numpy.int64)
+        position_triangles = self.position_of[self.corners]
+        self.quadrics = _compute_quadrics(self.positions, position_triangles, self.corners, num_positions)
+
+        self.triangle_alive = numpy.ones(len(triangles), dtype=bool)
+        self.num_alive = len(triangles)
+
+        self.position_alive = numpy.ones(num_positions, dtype=bool)
+        self.position_version = numpy.zeros(num_positions, dtype=numpy.int64)
+        self.position_triangles = [set() for i in range(num_positions)]
+        self.position_vertices = [[] for i in range(num_positions)]
+
+        for triangle, corner_positions in enumerate(position_triangles.tolist()):
+            for position in corner_positions:
+                self.position_triangles[position].add(triangle)
+        for vertex, position in enumerate(self.position_of.tolist()):
+            self.position_vertices[position].append(vertex)
+
+        # Homogeneous coordinates of the positions, to evaluate the quadrics
+        self.points = numpy.column_stack((self.positions, numpy.ones(num_positions)))
+
+        edges = numpy.concatenate([position_triangles[:, (0, 1)], position_triangles[:, (1, 2)],
+                                   position_triangles[:, (2, 0)]])
+        edges = numpy.unique(numpy.sort(edges, axis=1), axis=0)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+
+        self.heap = self._make_entries(edges[:, 0], edges[:, 1])
+        heapq.heapify(self.heap)
+
+    def _make_entries(self, a, b):
+        """ Computes the heap entries of the edges between the positions a and
+        b. Each edge gets collapsed into the end point with the lower error.
+        Locked positions are never removed, so edges between two of them get
+        no entry """
+        quadrics = self.quadrics[a] + self.quadrics[b]
+        cost_a = numpy.einsum("ki,kij,kj->k", self.points[a], quadrics, self.points[a])
+        cost_b = numpy.einsum("ki,kij,kj->k", self.points[b], quadrics, self.points[b])
+        cost_a[self.locked[b]] = numpy.inf
+        cost_b[self.locked[a]] = numpy.inf
+
+        keep_a = cost_a < cost_b
+        removed = numpy.where(keep_a, b, a)
+        kept = numpy.where(keep_a, a, b)
+        costs = numpy.minimum(cost_a, cost_b)
+
+        movable = numpy.isfinite(costs)
+        costs, removed, kept = costs[movable], removed[movable], kept[movable]
+
+        return list(zip(costs.tolist(), removed.tolist(), kept.tolist(),
+                        self.position_version[removed].tolist(), self.position_version[kept].tolist()))
+
+    def _causes_flip(self, removed, kept):
+        """ Checks whether moving the removed position onto the kept position
+        folds over any of the remaining triangles """
+        triangles = [triangle for triangle in self.position_triangles[removed]
+                     if triangle not in self.position_triangles[kept]]
+        if not triangles:
+            return False
+
+        # Compute the old and new normals at once
+        corner_positions = self.position_of[self.corners[triangles]]
+        corners = self.positions[numpy.concatenate((
+            corner_positions, numpy.where(corner_positions == removed, kept, corner_positions)))]
+        u, v = corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]
+        normals = numpy.column_stack((u[:, 1] * v[:, 2] - u[:, 2] * v[:, 1],
+                                      u[:, 2] * v[:, 0] - u[:, 0] * v[:, 2],
+                                      u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]))
+        old_normals, new_normals = normals[:len(triangles)], normals[len(triangles):]
+
+        old_lengths = numpy.sqrt((old_normals * old_normals).sum(axis=1))
+        new_lengths = numpy.sqrt((new_normals * new_normals).sum(axis=1))
+        dots = (old_normals * new_normals).sum(axis=1)
+        return bool(((new_lengths == 0.0) | (dots < MIN_NORMAL_DOT * old_lengths * new_lengths)).any())
+
+    def _match_vertex(self, vertex, candidates):
+        """ Returns the candidate vertex with the most similar normal and
+        texcoord, used to replace a vertex of the removed position """
+        differences = self.attributes[candidates] - self.attributes[vertex]
+        return candidates[int(numpy.argmin((differences * differences).sum(axis=1)))]
+
+    def _collapse(self, removed, kept):
+        """ Moves the removed position onto the kept position """
+        candidates = numpy.array(self.position_vertices[kept])
+        replacements = {vertex: self._match_vertex(vertex, candidates)
+                        for vertex in self.position_vertices[removed]}
+
+        for triangle in list(self.position_triangles[removed]):
+            if triangle in self.position_triangles[kept]:
+                # Triangles using both positions become degenerate
+                self.triangle_alive[triangle] = False
+                self.num_alive -= 1
+                for vertex in self.corners[triangle]:
+                    self.position_triangles[self.position_of[vertex]].discard(triangle)
+            else:
+                corners = self.corners[triangle]
+                for corner in range(3):
+                    if corners[corner] in replacements:
+                        corners[corner] = replacements[corners[corner]]
+                self.position_triangles[kept].add(triangle)
+
+        self.position_alive[removed] = False
+        self.position_triangles[removed] = set()
+        self.position_vertices[removed] = []
+        self.quadrics[kept] += self.quadrics[removed]
+        self.position_version[kept] += 1
+
+        # Requeue the edges around the kept position with the new quadric
+        neighbors = set()
+        for triangle in self.position_triangles[kept]:
+            for vertex in self.corners[triangle]:
+                neighbors.add(self.position_of[vertex])
+        neighbors.discard(kept)
+        if neighbors:
+            neighbors = numpy.array(sorted(neighbors))
+            for entry in self._make_entries(numpy.full(len(neighbors), kept), neighbors):
+                heapq.heappush(self.heap, entry)
+
+    def run(self, target_triangles):
+        """ Collapses edges until at most target_triangles remain, or no edge
+        can be collapsed anymore """
+        while self.num_alive > target_triangles and self.heap:
+            cost, removed, kept, removed_version, kept_version = heapq.heappop(self.heap)
+
+            # Skip outdated entries of positions which changed since
+            if not self.position_alive[removed] or not self.position_alive[kept]:
+                continue
+            if self.position_version[removed] != removed_version or self.position_version[kept] != kept_version:
+                continue
+
+            if self._causes_flip(removed, kept):
+                continue
+
+            self._collapse(removed, kept)
+
+        return self.corners[self.triangle_alive]
+
+
+def decimate_buffers(buffers, ratio, locked_positions=None, max_triangles=MAX_DECIMATE_TRIANGLES):
+    """ Simplifies the triangles of the given GeomBuffers to about the given
+    ratio of the original triangle count. Vertices at one of the locked
+    positions are kept in place. Geoms with more than max_triangles
+    triangles are not simplified. Returns new GeomBuffers containing only the
+    vertices which are still used, in the order of the original vertices """
+    num_vertices = buffers.num_vertices
+    vertices = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32)
+    vertices = vertices.reshape(num_vertices, buffers.vertex_stride)
+    triangles = numpy.frombuffer(buffers.index_buffer, dtype=_index_dtype(buffers)).reshape(-1, 3)
+    sources = numpy.frombuffer(buffers.source_indices, dtype=numpy.uint32)
+
+    target_triangles = int(len(triangles) * ratio)
+    if 0 < len(triangles) <= max_triangles and target_triangles < len(triangles):
+        triangles = _Decimator(vertices, triangles, locked_positions).run(target_triangles)
+
+    # Remove the vertices which are not referenced anymore
+    used = numpy.zeros(num_vertices, dtype=bool)
+    used[triangles.reshape(-1)] = True
+    kept = numpy.flatnonzero(used)
+    remap = numpy.zeros(num_vertices, dtype=numpy.int64)
+    remap[kept] = numpy.arange(len(kept))
+
+    decimated = GeomBuffers(buffers.name, buffers.have_texcoords, len(kept) >= 2**16 - 1)
+    decimated.vertex_buffer = array('f')
+    decimated.vertex_buffer.frombytes(vertices[kept].tobytes())
+    decimated.index_buffer = array(decimated.index_buffer.typecode)
+    decimated.index_buffer.frombytes(remap[triangles].astype(_index_dtype(decimated)).tobytes())
+    decimated.source_indices = array('I')
+    decimated.source_indices.frombytes(sources[kept].tobytes())
+    decimated.num_vertices = len(kept)
+    decimated.num_triangles = len(triangles)
+    decimated.compute_bounds()
+    return decimated
@@ -0,0 +1,301 @@
+import time
+import numpy
+
+from GeomBuffers import GeomBuffers
+from VectorizedGeometry import pack_triangles
+from VertexWelder import weld_vertices
+from VertexCacheOptimizer import optimize_vertex_cache, MAX_REORDER_TRIANGLES
+from MeshDecimator import decimate_buffers, find_shared_positions, MAX_DECIMATE_TRIANGLES
+
+
+class PackOptions(object):
+
+    """ Plain copy of the export settings which affect the geometry packing.
+    Unlike the settings datablock, this can be sent to worker processes """
+
+    def __init__(self, settings):
+        self.weld_vertices = bool(settings.weld_vertices)
+        self.weld_epsilon = float(settings.weld_epsilon)
+        self.split_large_geoms = bool(settings.split_large_geoms)
+        self.optimize_vertex_cache = bool(settings.optimize_vertex_cache)
+
+        # Triangle ratio of each generated LOD level, relative to the full
+        # mesh. The GeometryWriter clears this for meshes which get no LODs
+        if settings.generate_lods:
+            self.lod_ratios = tuple(settings.lod_reduction ** (level + 1) for level in range(settings.lod_count))
+        else:
+            self.lod_ratios = ()
+
+    @property
+    def reuse_vertices(self):
+        """ Whether the packing step should reuse vertices. When welding, all
+        vertices get merged afterwards anyway """
+        return not self.weld_vertices
+
+
+class PackReport(object):
+
+    """ Collects the statistics and messages of the packing step. Worker
+    processes have no access to the export log, so they return this instead,
+    and the GeometryWriter applies it afterwards """
+
+    def __init__(self):
+        self.num_splits = 0
+        self.warnings = []
+        self.infos = []
+
+        # Time spent optimizing for the vertex cache, which the GeometryWriter
+        # adds to the profiler, since workers have no access to it
+        self.vertex_cache_seconds = 0.0
+
+        # Packed geoms of the generated LOD levels, each a list of (material
+        # index, GeomBuffers) tuples like the packed geoms of the full mesh
+        self.lod_levels = []
+
+
+def pack_polygons(mesh, polygons, uv_coordinates=None, use_32_bit_indices=False, reuse_vertices=True):
+    """ Packs a set of triangles of a mesh into GeomBuffers, walking each
+    polygon in python. This is the python geometry engine, see pack_triangles
+    for the numpy one. If uv_coordinates is not None, texcoords will be
+    written as well. If reuse_vertices is False, a new vertex is written for
+    every triangle corner """
+
+    # Check wheter the object has texture coordinates assigned
+    have_texcoords = uv_coordinates is not None
+
+    # Create handles to the data, this makes accessing it faster
+    vertices = mesh.vertices
+
+    # Store the number of written triangles and vertices
+    num_triangles = 0
+    num_vertices = 0
+    num_duplicated = 0
+
+    # Create the buffers to store the data inside
+    buffers = GeomBuffers(mesh.name, have_texcoords, use_32_bit_indices)
+    index_buffer = buffers.index_buffer
+    vertex_buffer = buffers.vertex_buffer
+    source_indices = buffers.source_indices
+
+    # Store the location of each mesh vertex
+    vertex_mappings = [-1 for i in range(len(vertices))]
+    vertex_uvs = [0.0 for i in range(len(vertices))]
+
+    # Iterate over all triangles
+    for poly in polygons:
+
+        # Check if the polygon uses smooth shading
+        is_smooth = poly.use_smooth
+
+        # Iterate over the 3 vertices of that triangle
+        for idx, vertex_index in enumerate(poly.vertices):
+
+            # If the vertex is already known, just write its index, but only
+            # if the polygon does use smooth shading, otherwise all vertices
+            # are duplicated anyway.
+            if reuse_vertices and is_smooth and vertex_mappings[vertex_index] >= 0:
+
+                # Store wheter we can reuse the vertex data
+                can_reuse = True
+
+                if have_texcoords:
+                    # Check if the vertex texcoord matches. This might not be
+                    # the cases on corners
+                    u, v = uv_coordinates[poly.loop_indices[idx]].uv.to_2d()
+                    uv_key = u * 10000.0 + v
+                    if abs(vertex_uvs[vertex_index] - uv_key) > 0.0001:
+                        # Vertex uv does *not* match. Most likely we are on an
+                        # edge, so duplicate the vertex
+                        can_reuse = False
+                        num_duplicated += 1
+
+                # If we can reuse the vertex data, just reference it
+                if can_reuse:
+                    index_buffer.append(vertex_mappings[vertex_index])
+                    continue
+
+            # If the vertex is not known, store its data and then write its index
+            vertex = vertices[vertex_index]
+
+            # Write the vertex object position
+            vertex_buffer.append(vertex.co[0])
+            vertex_buffer.append(vertex.co[1])
+            vertex_buffer.append(vertex.co[2])
+
+            # Write the vertex normal
+            # When smooth shading is enabled, write per vertex normals,
+            # otherwise write the per-poly normal for all vertices
+            if is_smooth:
+                vertex_buffer.append(vertex.normal[0])
+                vertex_buffer.append(vertex.normal[1])
+                vertex_buffer.append(vertex.normal[2])
+            else:
+                vertex_buffer.append(poly.normal[0])
+                vertex_buffer.append(poly.normal[1])
+                vertex_buffer.append(poly.normal[2])
+
+            # Add the texcoord
+            if have_texcoords:
+                u, v = uv_coordinates[poly.loop_indices[idx]].uv.to_2d()
+                vertex_buffer.append(u)
+                vertex_buffer.append(v)
+                vertex_uvs[vertex_index] = u * 10000.0 + v
+
+            # Store the vertex index in the triangle data
+            index_buffer.append(num_vertices)
+
+            # Remember which mesh vertex this vertex was created from
+            source_indices.append(vertex_index)
+
+            # Store the vertex index in the mappings and increment the
+            # vertex counter
+            vertex_mappings[vertex_index] = num_vertices
+            num_vertices += 1
+
+        num_triangles += 1
+
+    buffers.num_vertices = num_vertices
+    buffers.num_triangles = num_triangles
+    buffers.num_duplicated = num_duplicated
+    return buffers
+
+
+def pack_material_group(name, centers, pack, options, report):
+    """ Packs the triangles of a single material, using the given pack
+    function, and welds them if enabled. Geoms which exceed the range of 16
+    bit indices get split into several spatially coherent geoms, unless
+    splitting is disabled. Returns a list of GeomBuffers """
+
+    pending = [numpy.arange(len(centers))]
+    packed = []
+
+    while pending:
+        selection = pending.pop(0)
+
+        # Compute the maximum possible amount of vertices for this geom. If it
+        # extends the range of 16 bit, we might have to use 32 bit indices
+        max_possible_vtx_count = len(selection) * 3
+        might_exceed = max_possible_vtx_count >= 2**16 - 1
+
+        buffers = pack(selection, might_exceed)
+        if options.weld_vertices:
+            buffers.num_welded = weld_vertices(buffers, options.weld_epsilon)
+
+        # Most geoms have much less vertices than triangle corners, so check
+        # the actual count before using 32 bit indices
+        if might_exceed and buffers.num_vertices < 2**16 - 1:
+            buffers.narrow_indices()
+
+        if buffers.use_32_bit_indices and options.split_large_geoms:
+            report.num_splits += 1
+            pending += split_triangles(centers, selection)
+            continue
+
+        if buffers.use_32_bit_indices:
+            report.warnings.append("Using 32 bit indices for large geom '" + name + "' - consider splitting it")
+
+        buffers.compute_bounds()
+        packed.append(buffers)
+
+    return packed
+
+
+def split_triangles(centers, selection):
+    """ Splits a set of triangles into two halves, at the median of their
+    centers along the longest axis """
+    selected_centers = centers[selection]
+    extent = selected_centers.max(axis=0) - selected_centers.min(axis=0)
+    axis = int(numpy.argmax(extent))
+
+    half = len(selection) // 2
+    order = numpy.argpartition(selected_centers[:, axis], half)
+
+    # Keep the original triangle order within each half
+    return [numpy.sort(selection[order[:half]]), numpy.sort(selection[order[half:]])]
+
+
+def optimize_packed_geoms(packed_geoms, report):
+    """ Reorders the triangles and vertices of the packed geoms for the
+    post-transform vertex cache, see VertexCacheOptimizer """
+    start_time = time.perf_counter()
+    for index, buffers in packed_geoms:
+        acmr_before, acmr_after = optimize_vertex_cache(buffers)
+        if buffers.num_triangles <= MAX_REORDER_TRIANGLES:
+            report.infos.append("Optimized vertex cache of geom '{}', ACMR {} -> {}".format(
+                buffers.name, round(acmr_before, 3), round(acmr_after, 3)))
+        else:
+            report.infos.append("Skipped reordering the {} triangles of geom '{}' for the vertex cache, "
+                                "only renumbered its vertices, ACMR {} -> {}".format(
+                                    buffers.num_triangles, buffers.name, round(acmr_before, 3),
+                                    round(acmr_after, 3)))
+    report.vertex_cache_seconds += time.perf_counter() - start_time
+
+
+def generate_lod_levels(packed_geoms, options, report):
+    """ Generates the LOD levels of the packed geoms by decimating them, see
+    MeshDecimator. Each level is decimated from the previous one, which is
+    much faster than starting from the full mesh every time. The geoms are
+    decimated one by one, so the borders between the parts of split geoms
+    stay in place to avoid cracks. Borders between materials are kept by the
+    boundary weights of the decimator instead, locking them would prevent
+    decimating meshes with many small material regions """
+    previous_geoms, previous_ratio = packed_geoms, 1.0
+
+    for index, buffers in packed_geoms:
+        if buffers.num_triangles > MAX_DECIMATE_TRIANGLES:
+            report.infos.append("Skipped decimating the {} triangles of geom '{}' for the LOD levels".format(
+                buffers.num_triangles, buffers.name))
+
+    for ratio in options.lod_ratios:
+        locked_positions = {index: find_shared_positions([buffers for other_index, buffers in previous_geoms
+                                                          if other_index == index])
+                            for index, buffers in previous_geoms}
+        level_geoms = [(index, decimate_buffers(buffers, ratio / previous_ratio, locked_positions[index]))
+                       for index, buffers in previous_geoms]
+        report.lod_levels.append(level_geoms)
+
+        num_triangles = sum(buffers.num_triangles for index, buffers in level_geoms)
+        report.infos.append("Generated LOD level {} with {} triangles".format(len(report.lod_levels),
+                                                                               num_triangles))
+        previous_geoms, previous_ratio = level_geoms, ratio
+
+
+def finish_packed_geoms(packed_geoms, options, report):
+    """ Runs the steps which work on all packed geoms of a mesh, once they are
+    packed: generating the LOD levels, and optimizing for the vertex cache """
+    if options.lod_ratios:
+        generate_lod_levels(packed_geoms, options, report)
+
+    if options.optimize_vertex_cache:
+        optimize_packed_geoms(packed_geoms, report)
+        for level_geoms in report.lod_levels:
+            optimize_packed_geoms(level_geoms, report)
+
+
+def pack_snapshot(snapshot, num_slots, options):
+    """ Runs the whole packing pipeline on a MeshSnapshot. Returns a list of
+    (material index, GeomBuffers) tuples for all material slots which are
+    referenced by at least one polygon, and the PackReport. This does not
+    access any blender data, so it can run in a worker process """
+
+    report = PackReport()
+    polygons_by_material = snapshot.group_polygons_by_material()
+
+    packed_geoms = []
+    for index in range(num_slots):
+        polygon_indices = polygons_by_material[index]
+
+        # Skip the material slot if no polygon references it
+        if len(polygon_indices) < 1:
+            continue
+
+        def pack(selection, use_32_bit_indices):
+            return pack_triangles(snapshot, polygon_indices[selection], use_32_bit_indices,
+                                  options.reuse_vertices)
+
+        centers = snapshot.triangle_centers(polygon_indices)
+        for buffers in pack_material_group(snapshot.name, centers, pack, options, report):
+            packed_geoms.append((index, buffers))
+
+    finish_packed_geoms(packed_geoms, options, report)
+    return packed_geoms, report
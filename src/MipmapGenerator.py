@@ -0,0 +1,66 @@
+import numpy
+
+
+def srgb_to_linear(values):
+    """ Converts srgb encoded values in the range 0 .. 1 to linear values """
+    return numpy.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(values):
+    """ Converts linear values in the range 0 .. 1 to srgb encoded values """
+    values = numpy.clip(values, 0.0, 1.0)
+    return numpy.where(values <= 0.0031308, values * 12.92, 1.055 * values ** (1.0 / 2.4) - 0.055)
+
+
+def get_mipmap_count(width, height):
+    """ Returns the amount of mipmap levels down to 1x1, including the base level """
+    return int(max(width, height)).bit_length()
+
+
+def downsample(pixels):
+    """ Halves the size of a (height, width, channels) image with a 2x2 box
+    filter. Odd sizes are rounded down, like the mipmaps of Panda3D, and
+    sizes of 1 stay 1 """
+    height, width = pixels.shape[:2]
+    new_height, new_width = max(1, height // 2), max(1, width // 2)
+
+    rows = [0, 1] if height > 1 else [0, 0]
+    columns = [0, 1] if width > 1 else [0, 0]
+
+    result = numpy.zeros((new_height, new_width, pixels.shape[2]), dtype=pixels.dtype)
+    for row in rows:
+        for column in columns:
+            result += pixels[row:row + new_height * 2:2 if height > 1 else 1,
+                             column:column + new_width * 2:2 if width > 1 else 1]
+    return result * 0.25
+
+
+def generate_mipmaps(pixels, use_srgb=False, is_normal_map=False):
+    """ Generates the full mipmap chain of a (height, width, channels) float
+    image, including the image itself as first level. Colors of srgb images
+    are averaged in linear space, and normals of normal maps get normalized
+    again after each step, since averaging shortens them """
+    pixels = numpy.asarray(pixels, dtype=numpy.float32)
+    color_channels = min(3, pixels.shape[2])
+
+    # Convert to the space in which the pixels get averaged
+    current = pixels.copy()
+    if use_srgb:
+        current[:, :, :color_channels] = srgb_to_linear(current[:, :, :color_channels])
+
+    levels = [pixels]
+    for level in range(1, get_mipmap_count(pixels.shape[1], pixels.shape[0])):
+        current = downsample(current)
+
+        result = current.copy()
+        if is_normal_map and color_channels == 3:
+            normals = result[:, :, :3] * 2.0 - 1.0
+            lengths = numpy.sqrt((normals * normals).sum(axis=2))[:, :, numpy.newaxis]
+            result[:, :, :3] = numpy.where(lengths > 0.0, normals / numpy.maximum(lengths, 1e-6), 0.0) * 0.5 + 0.5
+            current = result.copy()
+        elif use_srgb:
+            result[:, :, :color_channels] = linear_to_srgb(result[:, :, :color_channels])
+
+        levels.append(result.astype(numpy.float32))
+
+    return levels
@@ -0,0 +1,172 @@
+import numpy
+
+from pybamwriter.panda_types import *
+
+
+def get_vertex_bounds(positions):
+    """ Computes the bounds of a (num_vertices, 3) array of positions, as a
+    (box_min, box_max, radius) tuple. The bounding sphere is centered at the
+    center of the box. Returns None if there are no vertices """
+    if len(positions) == 0:
+        return None
+    positions = numpy.asarray(positions, dtype=numpy.float64)
+    box_min, box_max = positions.min(axis=0), positions.max(axis=0)
+    offsets = positions - (box_min + box_max) * 0.5
+    radius = numpy.sqrt((offsets * offsets).sum(axis=1)).max()
+    return tuple(box_min.tolist()), tuple(box_max.tolist()), float(radius)
+
+
+def _limit_radius(box_min, box_max, radius):
+    """ The sphere around the box center never needs to be larger than the
+    sphere enclosing the box itself """
+    return float(min(radius, numpy.linalg.norm(box_max - box_min) * 0.5))
+
+
+def transform_bounds(bounds, matrices):
+    """ Transforms bounds by one or more 4x4 matrices, returning bounds
+    which enclose all transformed copies """
+    matrices = numpy.asarray(matrices, dtype=numpy.float64).reshape(-1, 4, 4)
+    box_min, box_max, radius = bounds
+    box_min, box_max = numpy.array(box_min), numpy.array(box_max)
+
+    corners = numpy.array([[box_max[0] if i & 1 else box_min[0],
+                            box_max[1] if i & 2 else box_min[1],
+                            box_max[2] if i & 4 else box_min[2]] for i in range(8)])
+    corners = numpy.einsum("nij,kj->nki", matrices[:, :3, :3], corners) + matrices[:, numpy.newaxis, :3, 3]
+    new_min, new_max = corners.min(axis=(0, 1)), corners.max(axis=(0, 1))
+    new_center = (new_min + new_max) * 0.5
+
+    centers = matrices[:, :3, :3].dot((box_min + box_max) * 0.5) + matrices[:, :3, 3]
+
+    # The largest factor a matrix scales any direction by is its spectral
+    # norm. The longest column is not enough for sheared matrices
+    scales = numpy.linalg.norm(matrices[:, :3, :3], ord=2, axis=(1, 2))
+    new_radius = (numpy.sqrt(((centers - new_center) ** 2).sum(axis=1)) + radius * scales).max()
+
+    return tuple(new_min.tolist()), tuple(new_max.tolist()), _limit_radius(new_min, new_max, new_radius)
+
+
+def merge_bounds(bounds_list):
+    """ Returns bounds enclosing all given bounds """
+    box_min = numpy.array([bounds[0] for bounds in bounds_list]).min(axis=0)
+    box_max = numpy.array([bounds[1] for bounds in bounds_list]).max(axis=0)
+    center = (box_min + box_max) * 0.5
+
+    radius = max(numpy.linalg.norm((numpy.array(bounds[0]) + bounds[1]) * 0.5 - center) + bounds[2]
+                 for bounds in bounds_list)
+    return tuple(box_min.tolist()), tuple(box_max.tolist()), _limit_radius(box_min, box_max, radius)
+
+
+def format_bounds_tags(bounds):
+    """ Returns the tags storing the bounds of a node. The box is stored as
+    min x/y/z and max x/y/z, the sphere as center x/y/z and radius """
+    box_min, box_max, radius = bounds
+    center = [(low + high) * 0.5 for low, high in zip(box_min, box_max)]
+    return {"bounds_box": " ".join("{:.9g}".format(value) for value in list(box_min) + list(box_max)),
+            "bounds_sphere": " ".join("{:.9g}".format(value) for value in center + [radius])}
+
+
+def parse_bounds_tags(tags):
+    """ Reads back the bounds stored by format_bounds_tags, or returns None """
+    if "bounds_box" not in tags or "bounds_sphere" not in tags:
+        return None
+    box = [float(value) for value in tags["bounds_box"].split()]
+    radius = float(tags["bounds_sphere"].split()[3])
+    return tuple(box[:3]), tuple(box[3:]), radius
+
+
+class BoundsBuilder(object):
+
+    """ Computes the bounds of all nodes of the exported scene graph from the
+    bounds of their geoms, which get computed while packing. Panda3D would
+    otherwise compute them at load time by reading every vertex again. The bam
+    format has no field for precomputed bounds, so they are written as the
+    bounds_box and bounds_sphere tags, to be applied by the loading code """
+
+    def __init__(self):
+        # Dict from id(geom) to (geom, bounds). The geom is kept, so the id
+        # can not be reused by another object. Bounds of None mark geoms whose
+        # vertices move at runtime, like skinned geoms
+        self.geom_bounds = {}
+
+        # Dict from id(node) to (node, matrices) for the nodes whose children
+        # are drawn once per instance transform
+        self.instance_matrices = {}
+
+    def add_geom(self, geom, bounds):
+        """ Stores the bounds of a geom, or None if they are not known """
+        self.geom_bounds[id(geom)] = (geom, bounds)
+
+    def add_instances(self, node, matrices):
+        """ Marks a node as drawing its children at each of the given matrices """
+        self.instance_matrices[id(node)] = (node, matrices)
+
+    def write_tags(self, root):
+        """ Computes the bounds of all nodes below the root and stores them as
+        tags. Returns the amount of nodes which got bounds """
+        cache = {}
+        self._get_node_bounds(root, cache)
+
+        num_nodes = 0
+        for node, bounds in cache.values():
+            if bounds is not None:
+                node.tags.update(format_bounds_tags(bounds))
+                num_nodes += 1
+        return num_nodes
+
+    def _get_node_bounds(self, node, cache):
+        """ Returns the bounds of a node in its own coordinate space, or None
+        if they can not be computed, in which case the parents do not get any
+        bounds either """
+        if id(node) in cache:
+            return cache[id(node)][1]
+
+        bounds = self._compute_node_bounds(node, cache)
+
+        # Nodes reused by the incremental export still carry the bounds of
+        # the previous export
+        if bounds is None:
+            bounds = parse_bounds_tags(node.tags)
+
+        cache[id(node)] = (node, bounds)
+        return bounds
+
+    def _compute_node_bounds(self, node, cache):
+        """ Merges the bounds of the geoms and children of a node """
+        parts = []
+        known = True
+
+        if isinstance(node, GeomNode):
+            for geom, state in node.geoms:
+                geom, bounds = self.geom_bounds.get(id(geom), (geom, None))
+                if bounds is None:
+                    known = False
+                else:
+                    parts.append(bounds)
+
+        for child, sort in node.children:
+            bounds = self._get_node_bounds(child, cache)
+            if bounds is None:
+                # Nodes without geometry, like lights, do not contribute
+                known = known and not self._has_geometry(child)
+                continue
+
+            # TransformStates without a matrix are the identity
+            matrix = getattr(child.transform, "mat", None)
+            if matrix is not None:
+                bounds = transform_bounds(bounds, matrix)
+            parts.append(bounds)
+
+        if not known or not parts:
+            return None
+
+        bounds = merge_bounds(parts)
+        if id(node) in self.instance_matrices:
+            bounds = transform_bounds(bounds, self.instance_matrices[id(node)][1])
+        return bounds
+
+    def _has_geometry(self, node):
+        """ Returns whether a node or any of its children contains geoms """
+        if isinstance(node, GeomNode) and node.geoms:
+            return True
+        return any(self._has_geometry(child) for child, sort in node.children)
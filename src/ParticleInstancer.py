@@ -0,0 +1,44 @@
+import base64
+import numpy
+
+from AnimationBaker import quaternions_to_matrices
+
+
+# Layout of the packed instance transforms, stored as tag so the runtime
+# knows how to decode them
+INSTANCE_FORMAT = "mat4x3"
+
+
+def compute_particle_matrices(particles, particle_transform):
+    """ Computes the matrix of each particle, as particle_transform * location
+    * rotation * scale, reading the particle data in bulk. Returns a
+    (num_particles, 4, 4) array """
+    num_particles = len(particles)
+
+    locations = numpy.empty(num_particles * 3, dtype=numpy.float32)
+    rotations = numpy.empty(num_particles * 4, dtype=numpy.float32)
+    sizes = numpy.empty(num_particles, dtype=numpy.float32)
+    particles.foreach_get("location", locations)
+    particles.foreach_get("rotation", rotations)
+    particles.foreach_get("size", sizes)
+
+    locations = locations.reshape(-1, 3).astype(numpy.float64)
+    rotations = rotations.reshape(-1, 4).astype(numpy.float64)
+
+    local = numpy.zeros((num_particles, 4, 4), dtype=numpy.float64)
+    local[:, :3, :3] = quaternions_to_matrices(*rotations.T) * sizes[:, numpy.newaxis, numpy.newaxis]
+    local[:, :3, 3] = locations
+    local[:, 3, 3] = 1.0
+
+    return numpy.einsum("ij,njk->nik", numpy.array(particle_transform, dtype=numpy.float64), local)
+
+
+def pack_instance_transforms(matrices):
+    """ Packs the instance matrices into a base64 encoded string of little
+    endian floats. Each instance stores the four rows of its Panda3D matrix,
+    which uses row vectors, without the constant last column """
+
+    # Blender uses column vectors, so the rows of the Panda3D matrix are the
+    # columns of the blender matrix
+    rows = matrices[:, :3, :].transpose(0, 2, 1)
+    return base64.b64encode(rows.astype("<f4").tobytes()).decode("ascii")
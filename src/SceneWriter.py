@@ -3,24 +3,25 @@ import os
 import bpy
 import time
 import math
+import fnmatch
 import mathutils
 from ExportException import ExportException
 from TextureWriter import TextureWriter
 from GeometryWriter import GeometryWriter
 from MaterialWriter import MaterialWriter
+from IncrementalExport import IncrementalExportCache, is_reusable, make_object_fingerprint, get_object_materials
+from ExportProfiler import ExportProfiler, profile_phase, profile_object
+from AnimationBaker import sample_bone_curves, bake_action
+from SkeletonIndex import SkeletonIndex
+from StaticBatcher import StaticBatcher
+from NodeBounds import BoundsBuilder
+from TextureAtlas import TextureAtlasBuilder
+from ParticleInstancer import compute_particle_matrices, pack_instance_transforms, INSTANCE_FORMAT
 
 from pybamwriter.panda_types import *
 from pybamwriter.bam_writer import BamWriter
 
 
-class DummyCurve:
-    def __init__(self, value):
-        self.value = value
-
-    def evaluate(self, i):
-        return self.value
-
-
 class SceneWriter:
 
     """ This class handles the conversion from the blender scene graph to the
@@ -34,11 +35,31 @@ class SceneWriter:
         self._stats_exported_objs = 0
         self._stats_exported_geoms = 0
         self._stats_duplicated_vertices = 0
+        self._stats_welded_vertices = 0
+        self._stats_split_geoms = 0
+        self._stats_index16_geoms = 0
+        self._stats_index32_geoms = 0
+        self._stats_anim_bytes_saved = 0
+        self._stats_limited_influences = 0
+        self._stats_blend_vertices = 0
+        self._stats_unique_blends = 0
+        self._stats_batched_objects = 0
+        self._stats_batch_cells = 0
+        self._stats_bounded_nodes = 0
+        self.profiler = ExportProfiler()
         self.texture_writer = TextureWriter(self)
         self.geometry_writer = GeometryWriter(self)
         self.material_writer = MaterialWriter(self)
 
         self.characters = {}
+        self.bounds_builder = None
+        self.atlas_builder = None
+
+    @property
+    def stats(self):
+        """ Returns the statistics of the export as dict, keyed on the names of
+        the statistics, e.g. "exported_vertices" """
+        return {name[len("_stats_"):]: value for name, value in vars(self).items() if name.startswith("_stats_")}
 
     def set_log_instance(self, log_instance):
         """ Sets the export logger instance, used for reporting warnings and errors
@@ -72,27 +93,104 @@ class SceneWriter:
         # os.system("cls")
         start_time = time.time()
 
+        if self.settings.profile_export:
+            self.profiler.start()
+
         # Create the root of our model. All objects will be parented to this
         virtual_model_root = ModelRoot("SceneRoot")
 
-        # First import all armatures.
-        for armature in bpy.data.armatures:
-            self.characters[armature] = self._handle_armature(armature, virtual_model_root)
-
-        # Handle all selected objects
-        for obj in self.objects:
-            try:
-                if obj.type != 'ARMATURE':
-                    self._handle_object(obj, virtual_model_root)
-            except Exception as msg:
-                self.log_instance.error("Exception while exporting object '{}': {}".format(obj.name, msg))
-                raise
-
-        writer = BamWriter()
-        writer.file_version = tuple(int(i) for i in self.settings.bam_version.split("."))
-        writer.open_file(self.filepath)
-        writer.write_object(virtual_model_root)
-        writer.close()
+        # Collect the bounds of the packed geoms, if enabled
+        self.bounds_builder = BoundsBuilder() if self.settings.write_bounds else None
+
+        # Pack the geometry and bake the animations in worker processes, if
+        # enabled. Only the numpy engine packs geometry in the workers, since
+        # the python engine reads the blender data directly, but the animations
+        # are baked in the workers with both engines.
+        num_workers = self.settings.pack_processes
+        if num_workers != 1:
+            self.geometry_writer.start_pool(num_workers)
+
+        # Reuse the packed geometry of previous exports, if enabled
+        if self.settings.use_geometry_cache and self.settings.geometry_engine == "NUMPY":
+            self.geometry_writer.open_disk_cache(bpy.path.abspath(self.settings.geometry_cache_path),
+                                                 self.settings.geometry_cache_size * 1024 * 1024)
+
+        try:
+            # Pack the small images of the materials into texture atlases,
+            # before any render state gets created
+            self.atlas_builder = None
+            if self.settings.tex_atlas:
+                if self.settings.tex_mode == "KEEP":
+                    self.log_instance.warning("Texture atlases are not supported with the texture mode KEEP")
+                else:
+                    self.atlas_builder = TextureAtlasBuilder(self, self.settings.tex_atlas_size,
+                                                             self.settings.tex_atlas_max_image_size,
+                                                             self.settings.tex_atlas_padding)
+                    self.atlas_builder.build(self.objects)
+
+            # First import all armatures.
+            for armature in bpy.data.armatures:
+                self.characters[armature] = self._handle_armature(armature, virtual_model_root)
+
+            # Reuse the converted objects of the previous export, if enabled
+            incremental_cache = None
+            if self.settings.incremental_export:
+                incremental_cache = IncrementalExportCache.get(self.filepath)
+                incremental_cache.reset_stats()
+
+            # Merge small static meshes by material, if enabled
+            batcher = None
+            if self.settings.batch_static_meshes:
+                batcher = StaticBatcher(self, self.settings.batch_cell_size)
+
+            # Handle all selected objects
+            for obj in self.objects:
+                try:
+                    if obj.type == 'ARMATURE':
+                        continue
+
+                    if batcher and batcher.can_batch(obj):
+                        with self.profiler.phase("batching"):
+                            batcher.add(obj)
+                    elif incremental_cache:
+                        self._handle_object_incremental(obj, virtual_model_root, incremental_cache)
+                    else:
+                        self._handle_object(obj, virtual_model_root)
+                except Exception as msg:
+                    self.log_instance.error("Exception while exporting object '{}': {}".format(obj.name, msg))
+                    raise
+
+            if batcher:
+                with self.profiler.phase("batching"):
+                    batcher.write(virtual_model_root)
+                self._stats_batched_objects = batcher.num_objects
+                self._stats_batch_cells = batcher.num_cells
+                self._stats_exported_objs += batcher.num_objects
+
+            # Add the geoms which were packed by the worker processes. This
+            # creates their render states, which might queue texture copies
+            self.geometry_writer.finish_pending_geoms()
+            self.geometry_writer.shutdown_pool()
+            self.geometry_writer.close_disk_cache()
+
+            # Wait for the textures which are copied in the background. This
+            # has to happen after all render states are created
+            self.texture_writer.finish_textures()
+
+            if self.bounds_builder:
+                with self.profiler.phase("bounds"):
+                    self._stats_bounded_nodes = self.bounds_builder.write_tags(virtual_model_root)
+
+            writer = BamWriter()
+            writer.file_version = tuple(int(i) for i in self.settings.bam_version.split("."))
+            writer.open_file(self.filepath)
+            with self.profiler.phase("bam_write"):
+                writer.write_object(virtual_model_root)
+            writer.close()
+        finally:
+            self.geometry_writer.shutdown_pool()
+            self.texture_writer.shutdown_copier()
+            self.profiler.stop()
 
         end_time = time.time()
         duration = round(end_time - start_time, 4)
@@ -107,11 +205,72 @@ class SceneWriter:
 
         if self._stats_duplicated_vertices:
             self.log_instance.info("Had to duplicate", format(self._stats_duplicated_vertices, ",d"),
-                                   "Vertices due to different texture coordinates.")
+                                   "Vertices due to different normals or texture coordinates.")
+
+        if self._stats_welded_vertices:
+            self.log_instance.info("Welded", format(self._stats_welded_vertices, ",d"),
+                                   "Vertices with equal position, normal and texture coordinates.")
+
+        if self._stats_batched_objects:
+            self.log_instance.info("Batched", self._stats_batched_objects, "static Objects into",
+                                   self._stats_batch_cells, "Cells")
+
+        if self._stats_bounded_nodes:
+            self.log_instance.info("Precomputed the bounds of", self._stats_bounded_nodes, "Nodes")
+
+        if self._stats_split_geoms:
+            self.log_instance.info("Split", self._stats_split_geoms, "Geoms which exceeded the range of 16 bit indices")
+
+        self.log_instance.info("Using 16 bit indices for", self._stats_index16_geoms,
+                               "Geoms and 32 bit indices for", self._stats_index32_geoms, "Geoms")
+        if self._stats_unique_blends:
+            self.log_instance.info("Used", format(self._stats_unique_blends, ",d"), "unique transform blends for",
+                                   format(self._stats_blend_vertices, ",d"), "skinned Vertices, a dedup ratio of",
+                                   round(self._stats_blend_vertices / self._stats_unique_blends, 2))
+
+        if self._stats_limited_influences:
+            self.log_instance.info("Dropped the weakest bone influences of",
+                                   format(self._stats_limited_influences, ",d"), "Vertices with more than",
+                                   self.settings.max_bone_influences, "influences")
+
+        if self._stats_anim_bytes_saved:
+            self.log_instance.info("Saved", format(self._stats_anim_bytes_saved, ",d"),
+                                   "bytes of animation data by reducing keyframes")
+
+        if incremental_cache:
+            self.log_instance.info("Reused", incremental_cache.num_reused, "unchanged Objects and rebuilt",
+                                   incremental_cache.num_rebuilt, "Objects")
 
         self.log_instance.info("Exported", len(self.material_writer.material_state_cache), "materials")
         self.log_instance.info("Exported", len(self.texture_writer.textures_cache),
                                "texture slots, using", len(self.texture_writer.images_cache), "images")
+
+        if self.texture_writer.num_included_bytes:
+            self.log_instance.info("Baked", format(self.texture_writer.num_included_bytes, ",d"),
+                                   "bytes of image data")
+
+        if self.atlas_builder and self.atlas_builder.num_atlases:
+            self.log_instance.info("Packed", self.atlas_builder.num_images, "images into",
+                                   self.atlas_builder.num_atlases, "texture atlases, sharing",
+                                   self.material_writer.num_shared_atlas_states, "render states")
+            if self.atlas_builder.num_repeating_geoms:
+                self.log_instance.info("Kept the original textures of", self.atlas_builder.num_repeating_geoms,
+                                       "Geoms whose texture coordinates repeat the texture")
+
+        if self.texture_writer.num_skipped_bakes:
+            self.log_instance.info("Skipped baking", self.texture_writer.num_skipped_bakes,
+                                   "unchanged txo files")
+
+        if self.texture_writer.num_deduplicated_images:
+            self.log_instance.info("Shared the textures of", self.texture_writer.num_deduplicated_images,
+                                   "images with identical content")
+
+        if self.settings.profile_export:
+            profile_filepath = os.path.splitext(self.filepath)[0] + ".profile.json"
+            self.profiler.write_json(profile_filepath)
+            self.profiler.report(self.log_instance)
+            self.log_instance.info("Wrote export profile to", profile_filepath)
+
         self.log_instance.info("-" * 50)
 
     def _handle_camera(self, obj, parent):
@@ -180,128 +339,138 @@ class SceneWriter:
         """ Internal method to handle a lattice """
         self.log_instance.warning("TODO: Handle lattice:", obj.name)
 
+    @profile_object
+    @profile_phase("armature")
     def _handle_armature(self, obj, parent):
         """ Internal method to handle an armature """
 
+        index = SkeletonIndex(obj)
+
         char = Character(obj.name)
         bundle = char.bundles[0]
         skeleton = PartGroup(bundle, '<skeleton>')
-        for bone in obj.bones:
-            if bone.parent is None:
-                self._handle_bone(bone, char, bundle, skeleton)
+        for bone in index.root_bones:
+            self._handle_bone(bone, index, char, bundle, skeleton)
 
         parent.add_child(char)
 
-        # Is there an active animation?  Find any instances of this armature.
-        action = None
-        pose = None
+        # Find the animations of this armature, if any
+        pose, actions = self._find_actions(obj, index)
+        if actions:
+            with self.profiler.phase("animation"):
+                self._handle_actions(obj, index, pose, actions, parent)
+
+        return char
+
+    def _handle_bone(self, obj, index, char, root, parent):
+        """ Internal method to handle a bone """
+
+        joint = CharacterJoint(char, root, parent, obj.name, index.bind_matrices[obj.name])
+        joint.initial_net_transform_inverse = index.inverse_net_transforms[obj.name]
+
+        for bone in obj.children:
+            self._handle_bone(bone, index, char, root, joint)
+
+    def _find_actions(self, obj, index):
+        """ Internal method to find the actions to export for an armature.
+        Returns the pose of an exported instance of the armature, which
+        provides the values of channels without animation, and the actions """
+
+        instance = None
         for scene_obj in self.objects:
-            if scene_obj.data == obj and scene_obj.animation_data and scene_obj.animation_data.action:
-                action = scene_obj.animation_data.action
-                pose = scene_obj.pose
+            if scene_obj.data != obj:
+                continue
+
+            if self.settings.anim_export_mode == "ACTIVE":
+                if scene_obj.animation_data and scene_obj.animation_data.action:
+                    return scene_obj.pose, [scene_obj.animation_data.action]
+            else:
+                instance = scene_obj
                 break
 
-        if action:
-            fps = bpy.context.scene.render.fps
-            num_frames = int(action.frame_range[1]) - 1
-            bundle = AnimBundle(action.name, fps, num_frames)
+        if instance is None:
+            return None, []
 
-            # Create the AnimGroup hierarchy.
-            skeleton = AnimGroup(bundle, '<skeleton>')
+        # Use all actions animating any of the bones, optionally filtered by name
+        patterns = [pattern.strip() for pattern in self.settings.anim_action_filter.split(",") if pattern.strip()]
+        actions = []
 
-            for bone in obj.bones:
-                if bone.parent is None:
-                    self._handle_bone_anim(bone, pose, action.fcurves, skeleton)
+        for action in bpy.data.actions:
+            if patterns and not any(fnmatch.fnmatchcase(action.name, pattern) for pattern in patterns):
+                continue
+            if index.get_fcurves(action):
+                actions.append(action)
 
-            parent.add_child(AnimBundleNode(obj.name, bundle))
+        return instance.pose, actions
 
-        return char
+    def _handle_actions(self, obj, index, pose, actions, parent):
+        """ Internal method to bake the actions of an armature, each into its
+        own AnimBundleNode """
 
-    def _handle_bone(self, obj, char, root, parent):
-        """ Internal method to handle a bone """
+        # The values of channels without animation are the same for all actions
+        rest_values = index.get_rest_values(pose)
 
-        matrix = obj.matrix_local
-        if obj.parent:
-            matrix = obj.parent.matrix_local.inverted() * matrix
+        tolerances = (self.settings.anim_position_tolerance, self.settings.anim_angle_tolerance,
+                      self.settings.anim_scale_tolerance)
 
-        joint = CharacterJoint(char, root, parent, obj.name, matrix)
-        joint.initial_net_transform_inverse = obj.matrix_local.inverted()
+        # Bake the actions in the worker processes, if they are running
+        pool = self.geometry_writer.pool
+        pending = []
 
-        for bone in obj.children:
-            self._handle_bone(bone, char, root, joint)
+        for action in actions:
+            fps = bpy.context.scene.render.fps
+            source_num_frames = int(action.frame_range[1]) - 1
+            num_frames = source_num_frames
+
+            # Resample the animation to a lower frame rate, if requested
+            frame_step = 1.0
+            if 0 < self.settings.anim_fps < fps:
+                frame_step = fps / self.settings.anim_fps
+                num_frames = max(1, int(math.ceil(source_num_frames / frame_step)))
+                fps = self.settings.anim_fps
+
+            # Sample the f-curves of each bone, this has to happen here since
+            # it accesses the blender data
+            fcurves = index.get_fcurves(action)
+            bone_samples = {}
+            for bone in index.bones:
+                curves = index.get_bone_curves(fcurves, bone.name, rest_values)
+                bone_samples[bone.name] = sample_bone_curves(curves, num_frames, frame_step)
+
+            bundle = AnimBundle(action.name, fps, num_frames)
+            args = (index.bind_arrays, bone_samples, source_num_frames, tolerances, self.settings.anim_quantize)
+
+            if pool:
+                pending.append((action, bundle, pool.submit(bake_action, *args)))
+            else:
+                pending.append((action, bundle, bake_action(*args)))
 
-    def _handle_bone_anim(self, bone, pose, fcurves, parent):
-        """ Internal method to handle the animation of a bone """
+        for action, bundle, result in pending:
+            baked, original_bytes, written_bytes = result.result() if pool else result
 
-        # Find all f-curves belonging to this bone.
-        prefix = 'pose.bones["{0}"].'.format(bone.name)
-        num_frames = parent.root.num_frames
+            # Create the AnimGroup hierarchy.
+            skeleton = AnimGroup(bundle, '<skeleton>')
+            for bone in index.root_bones:
+                self._handle_bone_anim(bone, baked, skeleton)
 
-        bone_matrix = bone.matrix_local
-        if bone.parent:
-            bone_matrix = bone.parent.matrix_local.inverted() * bone_matrix
+            self._stats_anim_bytes_saved += original_bytes - written_bytes
+            self.log_instance.info("Animation", action.name, "uses", format(written_bytes, ",d"),
+                                   "bytes, reduced from", format(original_bytes, ",d"), "bytes")
 
-        pose_bone = pose.bones[bone.name]
+            parent.add_child(AnimBundleNode(obj.name, bundle))
 
-        lx_curve = fcurves.find(prefix + 'location', 0) or DummyCurve(pose_bone.location.x)
-        ly_curve = fcurves.find(prefix + 'location', 1) or DummyCurve(pose_bone.location.y)
-        lz_curve = fcurves.find(prefix + 'location', 2) or DummyCurve(pose_bone.location.z)
-        qw_curve = fcurves.find(prefix + 'rotation_quaternion', 0) or DummyCurve(pose_bone.rotation_quaternion.w)
-        qx_curve = fcurves.find(prefix + 'rotation_quaternion', 1) or DummyCurve(pose_bone.rotation_quaternion.x)
-        qy_curve = fcurves.find(prefix + 'rotation_quaternion', 2) or DummyCurve(pose_bone.rotation_quaternion.y)
-        qz_curve = fcurves.find(prefix + 'rotation_quaternion', 3) or DummyCurve(pose_bone.rotation_quaternion.z)
-        sx_curve = fcurves.find(prefix + 'scale', 0) or DummyCurve(pose_bone.scale.x)
-        sy_curve = fcurves.find(prefix + 'scale', 1) or DummyCurve(pose_bone.scale.y)
-        sz_curve = fcurves.find(prefix + 'scale', 2) or DummyCurve(pose_bone.scale.z)
+    def _handle_bone_anim(self, bone, baked, parent):
+        """ Internal method to create the animation tables of a bone and its
+        children from the baked channels """
 
         group = AnimChannelMatrixXfmTable(parent, bone.name)
-        tables = group.tables
-
-        for i in range(num_frames):
-            matrix = mathutils.Matrix(((sx_curve.evaluate(i), 0, 0, 0),
-                                        (0, sy_curve.evaluate(i), 0, 0),
-                                        (0, 0, sz_curve.evaluate(i), 0),
-                                        (0, 0, 0, 1)))
-
-            matrix = mathutils.Quaternion((qw_curve.evaluate(i),
-                                           qx_curve.evaluate(i),
-                                           qy_curve.evaluate(i),
-                                           qz_curve.evaluate(i))).to_matrix().to_4x4() * matrix
-
-            matrix = mathutils.Matrix.Translation((lx_curve.evaluate(i),
-                                                   ly_curve.evaluate(i),
-                                                   lz_curve.evaluate(i))) * matrix
-            matrix = bone_matrix * matrix
-
-            loc, rot, scale = matrix.decompose()
-            prh = rot.to_euler('YXZ')
-            tables[6].append(math.degrees(prh[2]))
-            tables[7].append(math.degrees(prh[0]))
-            tables[8].append(math.degrees(prh[1]))
-
-            tables[9].append(loc[0])
-            tables[10].append(loc[1])
-            tables[11].append(loc[2])
-
-            tables[0].append(scale[0])
-            tables[1].append(scale[1])
-            tables[2].append(scale[2])
-
-        # Reduce tables down to single item if they are all the same.
-        for table in tables:
-            if len(table) > 1 and table.count(table[0]) == len(table):
-                table[1:] = []
-
-        # Clear the tables if they are containing default values.
-        for table in tables[:3]:
-            if table == [1]:
-                table.clear()
-        for table in tables[3:12]:
-            if table == [0]:
-                table.clear()
+
+        # The shear tables 3 to 5 are not used.
+        for table_index, values in zip((0, 1, 2, 6, 7, 8, 9, 10, 11), baked[bone.name]):
+            group.tables[table_index].extend(values.tolist())
 
         for child in bone.children:
-            self._handle_bone_anim(child, pose, fcurves, group)
+            self._handle_bone_anim(child, baked, group)
 
     def _handle_mesh(self, obj, parent):
         """ Internal method to handle a mesh """
@@ -319,8 +488,9 @@ class SceneWriter:
             if level.use_mesh:
                 self._handle_object_data(level.object, lod_node)
             else:
-                self._handle_object_data(object, lod_node)
+                self._handle_object_data(obj, lod_node)
 
+    @profile_object
     def _handle_object(self, obj, parent):
         """ Internal method to process an object during the export process """
         print("Exporting object:", obj.name)
@@ -347,6 +517,29 @@ class SceneWriter:
         self._check_dupli(obj, node)
         self._check_billboard(obj, node)
 
+        return node
+
+    def _handle_object_incremental(self, obj, parent, incremental_cache):
+        """ Internal method to process an object, reusing its node from the
+        previous export in case none of its dependencies changed """
+        if not is_reusable(obj):
+            incremental_cache.num_rebuilt += 1
+            return self._handle_object(obj, parent)
+
+        fingerprint = make_object_fingerprint(obj, self)
+        node = incremental_cache.lookup(obj, fingerprint)
+
+        if node:
+            parent.add_child(node)
+
+            # The reused node keeps its render states, but their textures
+            # still have to be written, in case the copies were deleted
+            for material in get_object_materials(obj):
+                self.material_writer.create_state_from_material(material, use_atlas=True)
+        else:
+            node = self._handle_object(obj, parent)
+            incremental_cache.store(obj, fingerprint, node)
+
     def _handle_object_data(self, obj, parent):
         """ Internal method to process an object datablock """
 
@@ -435,15 +628,26 @@ class SceneWriter:
             # Take object transform into account
             particle_transform *= duplicated_object.matrix_local
 
-        for i, particle in enumerate(particle_system.particles):
-            rotation = particle.rotation.to_matrix().to_4x4()
-            location = mathutils.Matrix.Translation(particle.location)
-            scale = mathutils.Matrix.Scale(particle.size, 3).to_4x4()
-            particle_mat = particle_transform * (location * rotation * scale)
-            node = PandaNode("Particle-" + str(i))
-            node.transform = TransformState()
-            node.transform.mat = particle_mat
+        matrices = compute_particle_matrices(particle_system.particles, particle_transform)
+
+        if self.settings.particle_mode == "INSTANCED":
+            # Write the mesh only once, and store the transforms of all
+            # particles on its node, to be used as instance buffer
+            node = PandaNode(particle_system.name)
+            node.tags["instance_count"] = str(len(matrices))
+            node.tags["instance_format"] = INSTANCE_FORMAT
+            node.tags["instance_transforms"] = pack_instance_transforms(matrices)
+            if self.bounds_builder:
+                self.bounds_builder.add_instances(node, matrices)
             parent.add_child(node)
             self.geometry_writer.write_mesh(duplicated_object, node)
 
+        else:
+            for i, particle_mat in enumerate(matrices):
+                node = PandaNode("Particle-" + str(i))
+                node.transform = TransformState()
+                node.transform.mat = mathutils.Matrix(particle_mat.tolist())
+                parent.add_child(node)
+                self.geometry_writer.write_mesh(duplicated_object, node)
+
         self.log_instance.info("Wrote", len(particle_system.particles), "particles for system", particle_system.name)
@@ -0,0 +1,79 @@
+import re
+import numpy
+
+
+class SkeletonIndex(object):
+
+    """ Precomputed data of an armature, which is shared by the joints and the
+    animation channels of all actions. Computing it once per armature avoids
+    inverting the rest matrices and searching the fcurves for every bone in
+    every pass """
+
+    # Animated channels of a bone, in the order expected by sample_bone_curves
+    CHANNELS = [("location", 0), ("location", 1), ("location", 2),
+                ("rotation_quaternion", 0), ("rotation_quaternion", 1),
+                ("rotation_quaternion", 2), ("rotation_quaternion", 3),
+                ("scale", 0), ("scale", 1), ("scale", 2)]
+
+    # Matches the data path of a bone channel, like pose.bones["Arm"].location
+    DATA_PATH_PATTERN = re.compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]\.(\w+)$')
+
+    def __init__(self, armature):
+        self.armature = armature
+        self.bones = list(armature.bones)
+        self.root_bones = [bone for bone in self.bones if bone.parent is None]
+
+        self.bind_matrices = {}
+        self.inverse_net_transforms = {}
+        for bone in self.root_bones:
+            self._add_bone(bone, None)
+
+        # Plain arrays of the bind matrices, for the baking in the worker processes
+        self.bind_arrays = {name: numpy.array(matrix, dtype=numpy.float64)
+                            for name, matrix in self.bind_matrices.items()}
+
+        self._fcurves = {}
+
+    def _add_bone(self, bone, parent_inverse):
+        """ Computes the matrices of a bone and its children, inverting the
+        rest matrix of each bone only once """
+        inverse = bone.matrix_local.inverted()
+        self.inverse_net_transforms[bone.name] = inverse
+
+        if parent_inverse is None:
+            self.bind_matrices[bone.name] = bone.matrix_local
+        else:
+            self.bind_matrices[bone.name] = parent_inverse * bone.matrix_local
+
+        for child in bone.children:
+            self._add_bone(child, inverse)
+
+    def get_fcurves(self, action):
+        """ Returns a dict from (bone name, channel, index) to the fcurves of
+        the action animating the bones of this armature """
+        if action.name not in self._fcurves:
+            fcurves = {}
+            for fcurve in action.fcurves:
+                match = self.DATA_PATH_PATTERN.match(fcurve.data_path)
+                if match:
+                    bone_name = match.group(1).replace('\\"', '"').replace("\\\\", "\\")
+                    if bone_name in self.bind_matrices:
+                        fcurves[(bone_name, match.group(2), fcurve.array_index)] = fcurve
+            self._fcurves[action.name] = fcurves
+        return self._fcurves[action.name]
+
+    def get_rest_values(self, pose):
+        """ Returns the values of all channels of each bone in the given pose,
+        used for channels without animation """
+        rest_values = {}
+        for bone in self.bones:
+            pose_bone = pose.bones[bone.name]
+            rest_values[bone.name] = list(pose_bone.location) + list(pose_bone.rotation_quaternion) + \
+                list(pose_bone.scale)
+        return rest_values
+
+    def get_bone_curves(self, fcurves, bone_name, rest_values):
+        """ Returns the fcurves of all channels of a bone, using the rest
+        values for channels without animation """
+        return [fcurves.get((bone_name, channel, index), value)
+                for (channel, index), value in zip(self.CHANNELS, rest_values[bone_name])]
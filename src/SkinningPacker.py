@@ -0,0 +1,106 @@
+import numpy
+
+
+# Blend weights which are equal up to 1 / BLEND_WEIGHT_STEPS are considered
+# identical, and share a transform blend
+BLEND_WEIGHT_STEPS = 65536
+
+
+def limit_influences(influences, max_influences):
+    """ Keeps the strongest (group, weight) influences of a vertex and
+    renormalizes their weights, so they sum up to one """
+    influences = sorted(influences, key=lambda influence: (-influence[1], influence[0]))[:max_influences]
+    total = sum(weight for group, weight in influences)
+    if total <= 0.0:
+        return ()
+    return tuple((group, weight / total) for group, weight in influences)
+
+
+def find_unique_blends(vertex_groups, source_indices, weight_steps=BLEND_WEIGHT_STEPS):
+    """ Finds the distinct transform blends of the exported vertices, for the
+    blend table path. Blends are looked up by their quantized weights, and
+    additionally by the mesh vertex, since vertices split at uv seams have the
+    same influences. Returns the sorted influences of each unique blend, and
+    the blend row of each vertex """
+    blend_rows = {}
+    source_rows = {}
+    unique_influences = []
+    vertex_rows = []
+
+    for vertex_index in source_indices:
+        row = source_rows.get(vertex_index)
+
+        if row is None:
+            influences = sorted(vertex_groups[vertex_index])
+            key = tuple((group, int(round(weight * weight_steps))) for group, weight in influences)
+            row = blend_rows.get(key)
+
+            if row is None:
+                row = len(unique_influences)
+                unique_influences.append(influences)
+                blend_rows[key] = row
+
+            source_rows[vertex_index] = row
+
+        vertex_rows.append(row)
+
+    return unique_influences, vertex_rows
+
+
+def pack_vertex_influences(vertex_groups, source_indices, max_influences):
+    """ Computes the hardware skinning columns of the exported vertices.
+    Vertices with equal influences share one entry of a hash table, so each
+    distinct influence set is only limited and normalized once. Returns the
+    vertex groups used, in the order of their transform index, the per-vertex
+    transform indices and weights as (num_vertices, max_influences) arrays,
+    and the amount of source vertices which had influences dropped """
+    source_indices = numpy.asarray(source_indices, dtype=numpy.int64)
+    unique_sources, inverse = numpy.unique(source_indices, return_inverse=True)
+
+    influence_rows = {}
+    unique_influences = []
+    source_rows = numpy.empty(len(unique_sources), dtype=numpy.int64)
+    num_limited = 0
+
+    for i, source_index in enumerate(unique_sources):
+        key = tuple(vertex_groups[source_index])
+        if len(key) > max_influences:
+            num_limited += 1
+
+        row = influence_rows.get(key)
+        if row is None:
+            row = len(unique_influences)
+            influence_rows[key] = row
+            unique_influences.append(limit_influences(key, max_influences))
+        source_rows[i] = row
+
+    # Only the groups which are actually used get a transform index
+    transform_groups = []
+    transform_indices = {}
+    indices = numpy.zeros((len(unique_influences), max_influences), dtype=numpy.uint16)
+    weights = numpy.zeros((len(unique_influences), max_influences), dtype=numpy.float32)
+
+    for row, influences in enumerate(unique_influences):
+        for column, (group, weight) in enumerate(influences):
+            if group not in transform_indices:
+                transform_indices[group] = len(transform_groups)
+                transform_groups.append(group)
+            indices[row, column] = transform_indices[group]
+            weights[row, column] = weight
+
+    vertex_rows = source_rows[inverse]
+    return transform_groups, indices[vertex_rows], weights[vertex_rows], num_limited
+
+
+def interleave_skinning_columns(indices, weights):
+    """ Packs the transform weights and indices into the bytes of a vertex
+    array, with the weights first. Indices use a single byte when there are
+    at most 256 transforms """
+    num_vertices, num_columns = weights.shape
+    index_type = "<u1" if indices.size == 0 or indices.max() < 256 else "<u2"
+
+    packed = numpy.empty(num_vertices, dtype=[("weight", "<f4", (num_columns, )),
+                                              ("index", index_type, (num_columns, ))])
+    packed["weight"] = weights
+    packed["index"] = indices
+    return packed.tobytes(), numpy.dtype(index_type).itemsize
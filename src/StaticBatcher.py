@@ -0,0 +1,168 @@
+import math
+import numpy
+from array import array
+
+from GeomBuffers import GeomBuffers
+from pybamwriter.panda_types import *
+
+
+# Merged geoms are kept below this amount of vertices, so they can use 16
+# bit indices
+MAX_BATCH_VERTICES = 2 ** 16 - 1
+
+
+def transform_buffers(buffers, matrix):
+    """ Transforms the vertices of the buffers into world space, in place.
+    Normals are transformed by the inverse transpose, so non uniform scales
+    keep them perpendicular, and the winding order is flipped for mirroring
+    transforms """
+    matrix = numpy.array(matrix, dtype=numpy.float64)
+    rotation = matrix[:3, :3]
+
+    vertices = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32)
+    vertices = vertices.reshape(-1, buffers.vertex_stride).astype(numpy.float64)
+
+    vertices[:, 0:3] = vertices[:, 0:3].dot(rotation.T) + matrix[:3, 3]
+
+    normals = vertices[:, 3:6].dot(numpy.linalg.inv(rotation))
+    lengths = numpy.sqrt((normals * normals).sum(axis=1))
+    lengths[lengths == 0.0] = 1.0
+    vertices[:, 3:6] = normals / lengths[:, numpy.newaxis]
+
+    buffers.vertex_buffer = array('f', vertices.astype(numpy.float32).tobytes())
+
+    if numpy.linalg.det(rotation) < 0.0:
+        indices = numpy.array(buffers.index_buffer, dtype=numpy.int64).reshape(-1, 3)
+        buffers.index_buffer = array(buffers.index_buffer.typecode, indices[:, (0, 2, 1)].ravel().tolist())
+
+
+def merge_buffers(name, buffers_list):
+    """ Merges several GeomBuffers with the same vertex format into a single
+    one, offsetting the indices of each part """
+    num_vertices = sum(buffers.num_vertices for buffers in buffers_list)
+    merged = GeomBuffers(name, buffers_list[0].have_texcoords, num_vertices > MAX_BATCH_VERTICES)
+
+    offset = 0
+    for buffers in buffers_list:
+        merged.vertex_buffer.extend(buffers.vertex_buffer)
+        indices = numpy.array(buffers.index_buffer, dtype=numpy.int64) + offset
+        merged.index_buffer.extend(indices.tolist())
+        offset += buffers.num_vertices
+
+        merged.num_vertices += buffers.num_vertices
+        merged.num_triangles += buffers.num_triangles
+        merged.num_duplicated += buffers.num_duplicated
+        merged.num_welded += buffers.num_welded
+
+    merged.compute_bounds()
+    return merged
+
+
+class StaticBatcher(object):
+
+    """ Collects many small static meshes, and merges their geometry by
+    material into one geom per cell of a uniform grid. This is the same as
+    calling flattenStrong on the loaded model, but done at export time, and
+    the grid keeps the batches small enough to be culled """
+
+    def __init__(self, writer, cell_size):
+        self.writer = writer
+        self.cell_size = cell_size
+        self.num_objects = 0
+
+        # Dict from (cell, state name, have_texcoords) to a list of world
+        # space GeomBuffers. Materials which share a render state through the
+        # texture atlases share a state name, and get merged
+        self.groups = {}
+        self.render_states = {}
+        self.state_names = {}
+
+    @property
+    def num_cells(self):
+        """ Returns the amount of cells containing batched geometry """
+        return len(set(cell for cell, state_name, have_texcoords in self.groups))
+
+    def can_batch(self, obj):
+        """ Returns whether the object is a static mesh whose node can be
+        removed, because nothing needs to reference it at runtime """
+        if obj.type != "MESH":
+            return False
+        if hasattr(obj, 'lod_levels') and len(obj.lod_levels) > 0:
+            return False
+        if any(modifier.type in ("ARMATURE", "PARTICLE_SYSTEM") for modifier in obj.modifiers):
+            return False
+        if len(obj.game.properties) > 0 or obj.dupli_type != "NONE":
+            return False
+        if obj.animation_data and obj.animation_data.action:
+            return False
+
+        # Billboards need their own node to be rotated
+        material = obj.active_material
+        if material and material.game_settings and \
+           material.game_settings.face_orientation in ('HALO', 'BILLBOARD'):
+            return False
+
+        return True
+
+    def get_cell(self, obj):
+        """ Returns the grid cell of the world space center of an object """
+        matrix = numpy.array(obj.matrix_world, dtype=numpy.float64)
+        corners = numpy.array([tuple(corner) for corner in obj.bound_box], dtype=numpy.float64)
+        corners = corners.dot(matrix[:3, :3].T) + matrix[:3, 3]
+        center = (corners.min(axis=0) + corners.max(axis=0)) * 0.5
+        return tuple(int(math.floor(value / self.cell_size)) for value in center)
+
+    def add(self, obj):
+        """ Packs the mesh of the object and stores its geometry in world space """
+        material_slots, packed_geoms = self.writer.geometry_writer.pack_static_mesh(obj)
+        cell = self.get_cell(obj)
+
+        geometry_writer = self.writer.geometry_writer
+
+        for index, buffers in packed_geoms:
+            slot = material_slots[index]
+            material = slot.material if slot else None
+
+            use_atlas = geometry_writer.apply_texture_atlas(slot, buffers)
+            render_state = geometry_writer.get_render_state(slot, use_atlas)
+
+            # Name the render state after the first material using it
+            state_name = (material.name if material else "") + ("-atlas" if use_atlas else "")
+            state_name = self.state_names.setdefault(id(render_state), state_name)
+            self.render_states[state_name] = render_state
+            key = (cell, state_name, buffers.have_texcoords)
+
+            transform_buffers(buffers, obj.matrix_world)
+            self.groups.setdefault(key, []).append(buffers)
+
+        self.num_objects += 1
+
+    def write(self, parent):
+        """ Merges the collected geometry and attaches one geom node per cell
+        to the parent node """
+        geometry_writer = self.writer.geometry_writer
+        cell_nodes = {}
+
+        for key in sorted(self.groups):
+            cell, state_name, have_texcoords = key
+            if cell not in cell_nodes:
+                cell_nodes[cell] = GeomNode("Batch-{}_{}_{}".format(*cell))
+                parent.add_child(cell_nodes[cell])
+
+            for chunk in self._split_chunks(self.groups[key]):
+                buffers = merge_buffers(state_name, chunk)
+                geom = geometry_writer._create_geom_from_buffers(None, None, buffers)
+                cell_nodes[cell].add_geom(geom, self.render_states[state_name])
+
+    def _split_chunks(self, buffers_list):
+        """ Splits a list of GeomBuffers into chunks which fit into 16 bit
+        indices. Buffers which are too large on their own get their own chunk """
+        chunk, chunk_vertices = [], 0
+        for buffers in buffers_list:
+            if chunk and chunk_vertices + buffers.num_vertices > MAX_BATCH_VERTICES:
+                yield chunk
+                chunk, chunk_vertices = [], 0
+            chunk.append(buffers)
+            chunk_vertices += buffers.num_vertices
+        if chunk:
+            yield chunk
@@ -0,0 +1,340 @@
+import os
+import numpy
+from array import array
+from collections import OrderedDict
+
+from ImageData import hash_bytes, read_image_pixels
+from ExportProfiler import profile_phase
+
+
+# Texcoords may exceed the 0 .. 1 range by this amount and still be moved
+# into an atlas, they get clamped to the region of the image
+TEXCOORD_EPSILON = 1e-3
+
+# Image regions are aligned to this amount of pixels, so block compression
+# never mixes two images in one block
+REGION_ALIGNMENT = 4
+
+
+def _next_power_of_two(value):
+    """ Returns the smallest power of two which is at least the value """
+    return 1 << max(0, int(value) - 1).bit_length()
+
+
+class _Skyline(object):
+
+    """ Skyline of a single atlas, storing the height of the placed
+    rectangles as list of (x, y, width) segments, sorted by x """
+
+    def __init__(self, size):
+        self.size = size
+        self.segments = [(0, 0, size)]
+        self.used_width = 0
+        self.used_height = 0
+
+    def _get_top(self, index, width):
+        """ Returns the height a rectangle of the given width would be placed
+        at, starting at the segment with the given index, or None if it
+        exceeds the atlas on the right """
+        x = self.segments[index][0]
+        if x + width > self.size:
+            return None
+
+        top = 0
+        for segment_x, segment_y, segment_width in self.segments[index:]:
+            if segment_x >= x + width:
+                break
+            top = max(top, segment_y)
+        return top
+
+    def insert(self, width, height):
+        """ Places a rectangle at the lowest position, preferring the left
+        one, and returns its (x, y) position, or None if it does not fit """
+        best = None
+        for index, (x, y, segment_width) in enumerate(self.segments):
+            top = self._get_top(index, width)
+            if top is None or top + height > self.size:
+                continue
+            if best is None or (top + height, x) < best[0]:
+                best = ((top + height, x), x, top)
+
+        if best is None:
+            return None
+
+        score, x, top = best
+        self._add_segment(x, top + height, width)
+        self.used_width = max(self.used_width, x + width)
+        self.used_height = max(self.used_height, top + height)
+        return x, top
+
+    def _add_segment(self, x, y, width):
+        """ Raises the skyline to y between x and x + width """
+        end = x + width
+        segments = [(x, y, width)]
+        for segment_x, segment_y, segment_width in self.segments:
+            segment_end = segment_x + segment_width
+            if segment_end <= x or segment_x >= end:
+                segments.append((segment_x, segment_y, segment_width))
+                continue
+            if segment_x < x:
+                segments.append((segment_x, segment_y, x - segment_x))
+            if segment_end > end:
+                segments.append((end, segment_y, segment_end - end))
+
+        # Merge neighbouring segments at the same height
+        self.segments = []
+        for segment in sorted(segments):
+            if self.segments and self.segments[-1][1] == segment[1]:
+                last_x, last_y, last_width = self.segments[-1]
+                self.segments[-1] = (last_x, last_y, last_width + segment[2])
+            else:
+                self.segments.append(segment)
+
+
+def pack_rectangles(sizes, atlas_size):
+    """ Packs (width, height) rectangles into square atlases of the given
+    size, using the skyline bottom-left heuristic, and starting a new atlas
+    whenever a rectangle fits into none of the previous ones. Rectangles are
+    placed from the tallest to the shortest. Returns a list with the (atlas
+    index, x, y) of each rectangle, and a list with the (width, height) of
+    each atlas, shrunk to the powers of two covering its rectangles """
+    order = sorted(range(len(sizes)), key=lambda index: (-sizes[index][1], -sizes[index][0], index))
+    skylines = []
+    placements = [None] * len(sizes)
+
+    for index in order:
+        width, height = sizes[index]
+        if width > atlas_size or height > atlas_size:
+            raise ValueError("Rectangle of size {}x{} exceeds the atlas size".format(width, height))
+
+        for atlas, skyline in enumerate(skylines):
+            position = skyline.insert(width, height)
+            if position is not None:
+                break
+        else:
+            skylines.append(_Skyline(atlas_size))
+            atlas = len(skylines) - 1
+            position = skylines[atlas].insert(width, height)
+
+        placements[index] = (atlas, position[0], position[1])
+
+    atlas_sizes = [(_next_power_of_two(skyline.used_width), _next_power_of_two(skyline.used_height))
+                   for skyline in skylines]
+    return placements, atlas_sizes
+
+
+def pad_image(pixels, padding, width, height):
+    """ Expands a (height, width, channels) image to rgba, and pads it to
+    the given size by repeating its border pixels. The image gets padding
+    pixels on the left and bottom, and the rest on the right and top. The
+    repeated border keeps filtering and the first mipmap levels from
+    sampling neighbouring images in the atlas """
+    channels = pixels.shape[2]
+    if channels < 3:
+        gray = pixels[:, :, :1]
+        alpha = pixels[:, :, 1:2] if channels == 2 else numpy.ones_like(gray)
+        pixels = numpy.concatenate((gray, gray, gray, alpha), axis=2)
+    elif channels == 3:
+        pixels = numpy.concatenate((pixels, numpy.ones_like(pixels[:, :, :1])), axis=2)
+
+    image_height, image_width = pixels.shape[:2]
+    return numpy.pad(pixels, ((padding, height - image_height - padding),
+                              (padding, width - image_width - padding), (0, 0)), mode="edge")
+
+
+def remap_texcoords(buffers, offset, scale):
+    """ Moves the texcoords of the buffers into the region of an atlas,
+    given by its offset and scale. Texcoords outside of 0 .. 1 repeat the
+    texture, which does not work in an atlas, so the buffers are left
+    unchanged in that case. Returns whether the texcoords were moved """
+    vertices = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32)
+    vertices = vertices.reshape(-1, buffers.vertex_stride).copy()
+
+    texcoords = vertices[:, 6:8]
+    if len(texcoords) and (texcoords.min() < -TEXCOORD_EPSILON or texcoords.max() > 1.0 + TEXCOORD_EPSILON):
+        return False
+
+    vertices[:, 6:8] = numpy.clip(texcoords, 0.0, 1.0) * scale + offset
+    buffers.vertex_buffer = array('f', vertices.tobytes())
+    return True
+
+
+class AtlasRegion(object):
+
+    """ Location of the images of a material in its atlases. The images of
+    all texture slots share one region, in an atlas per slot """
+
+    def __init__(self, textures, offset, scale):
+        # Dict from the texture slot index to the atlas texture
+        self.textures = textures
+        self.offset = offset
+        self.scale = scale
+
+
+class TextureAtlasBuilder(object):
+
+    """ Packs the small images of the exported materials into texture
+    atlases, so materials which only differ in their images can share one
+    texture, and often one render state. The texcoords of the geoms get
+    moved into the region of their material by the GeometryWriter """
+
+    def __init__(self, writer, atlas_size, max_image_size, padding):
+        self.writer = writer
+        self.atlas_size = atlas_size
+        self.max_image_size = max_image_size
+        self.padding = padding
+
+        # Dict from material name to its AtlasRegion
+        self.regions = {}
+
+        self.num_atlases = 0
+        self.num_images = 0
+        self.num_repeating_geoms = 0
+
+    @property
+    def log_instance(self):
+        """ Helper to access the log instance """
+        return self.writer.log_instance
+
+    @property
+    def profiler(self):
+        """ Helper to access the export profiler """
+        return self.writer.profiler
+
+    def get_region(self, material):
+        """ Returns the AtlasRegion of a material, or None if its images are
+        not in an atlas """
+        if not material:
+            return None
+        return self.regions.get(material.name)
+
+    def _get_padded_size(self, image):
+        """ Returns the size an image occupies in the atlas, including the
+        padding and the alignment """
+        width, height = image.size
+        return tuple((value + 2 * self.padding + REGION_ALIGNMENT - 1) // REGION_ALIGNMENT * REGION_ALIGNMENT
+                     for value in (width, height))
+
+    def _get_image_slots(self, material, active_uv_names):
+        """ Returns a list of (slot index, texture slot) tuples of the image
+        textures of a material, or None if the material can not use an
+        atlas. All images share one region, so they need the same size.
+        Only the texcoords of the active uv map get exported and moved, so
+        slots naming another uv map of any of the meshes are not atlased """
+        image_slots = []
+        for index, tex_slot in enumerate(material.texture_slots):
+            if not tex_slot or not tex_slot.texture or tex_slot.texture.type == "NONE":
+                continue
+
+            texture = tex_slot.texture
+            if texture.type != "IMAGE" or not texture.image or tex_slot.texture_coords != "UV":
+                return None
+
+            if tex_slot.uv_layer and any(tex_slot.uv_layer != name for name in active_uv_names):
+                return None
+
+            # Scaled texcoords repeat the texture
+            if tuple(tex_slot.scale) != (1, 1, 1):
+                return None
+
+            width, height = texture.image.size
+            padded_width, padded_height = self._get_padded_size(texture.image)
+            if width == 0 or height == 0 or max(width, height) > self.max_image_size or \
+               max(padded_width, padded_height) > self.atlas_size:
+                return None
+
+            image_slots.append((index, tex_slot))
+
+        if not image_slots:
+            return None
+        if len(set(tuple(tex_slot.texture.image.size) for index, tex_slot in image_slots)) > 1:
+            return None
+        return image_slots
+
+    def _get_layer_key(self, index, tex_slot):
+        """ Returns the key of the atlas a texture slot can be stored in.
+        Images in one atlas share the format and the sampler settings """
+        texture = tex_slot.texture
+        texture_writer = self.writer.texture_writer
+        return (index,
+                texture_writer.get_num_components(texture.image),
+                self.writer.material_writer.is_srgb_slot(index, tex_slot),
+                texture_writer.is_normal_map_slot(tex_slot),
+                getattr(texture, "use_mipmap", False),
+                getattr(texture, "use_interpolation", False),
+                getattr(texture, "extension", None))
+
+    def _collect_layouts(self, objects):
+        """ Groups the materials of the mesh objects by the layers of their
+        atlases. Returns a dict from the layer keys to a dict from the image
+        names to the images and the names of the materials using them """
+        # Find the active uv maps of all meshes using each material
+        materials = OrderedDict()
+        for obj in objects:
+            if obj.type != "MESH":
+                continue
+
+            active_uv_layer = obj.data.uv_layers.active
+            for slot in obj.material_slots:
+                if slot.material:
+                    entry = materials.setdefault(slot.material.name, (slot.material, set()))
+                    entry[1].add(active_uv_layer.name if active_uv_layer else "")
+
+        layouts = OrderedDict()
+        for material, active_uv_names in materials.values():
+            image_slots = self._get_image_slots(material, active_uv_names)
+            if not image_slots:
+                continue
+
+            layout_key = tuple(self._get_layer_key(index, tex_slot) for index, tex_slot in image_slots)
+            images = tuple(tex_slot.texture.image for index, tex_slot in image_slots)
+            entries = layouts.setdefault(layout_key, OrderedDict())
+            entries.setdefault(tuple(image.name for image in images), (images, []))[1].append(material.name)
+
+        return layouts
+
+    @profile_phase("texture_atlas")
+    def build(self, objects):
+        """ Packs the images of the materials used by the objects into atlases
+        and creates the atlas textures. Layouts with a single set of images
+        are skipped, since they would not save anything """
+        for layout_key, entries in self._collect_layouts(objects).items():
+            if len(entries) < 2:
+                continue
+
+            entries = list(entries.values())
+            sizes = [self._get_padded_size(images[0]) for images, material_names in entries]
+            placements, atlas_sizes = pack_rectangles(sizes, self.atlas_size)
+
+            for atlas, (atlas_width, atlas_height) in enumerate(atlas_sizes):
+                members = [(entry, size, placement) for entry, size, placement in zip(entries, sizes, placements)
+                           if placement[0] == atlas]
+
+                textures = {}
+                for layer, layer_key in enumerate(layout_key):
+                    index, num_components, use_srgb, is_normal_map = layer_key[:4]
+
+                    pixels = numpy.zeros((atlas_height, atlas_width, 4), dtype=numpy.float32)
+                    for (images, material_names), (width, height), (atlas_index, x, y) in members:
+                        pixels[y:y + height, x:x + width] = pad_image(read_image_pixels(images[layer]),
+                                                                      self.padding, width, height)
+
+                    # Name the atlas after the bam file and its content, since
+                    # several bam files can share the texture copy path
+                    name = "{}-Atlas{}-{}-{}".format(os.path.splitext(os.path.basename(self.writer.filepath))[0],
+                                                     self.num_atlases, index, hash_bytes(pixels.tobytes())[:12])
+                    textures[index] = self.writer.texture_writer.create_atlas_texture(
+                        name, pixels, num_components, use_srgb, is_normal_map)
+
+                for (images, material_names), size, (atlas_index, x, y) in members:
+                    image_width, image_height = images[0].size
+                    region = AtlasRegion(textures,
+                                         ((x + self.padding) / atlas_width, (y + self.padding) / atlas_height),
+                                         (image_width / atlas_width, image_height / atlas_height))
+                    for material_name in material_names:
+                        self.regions[material_name] = region
+
+                self.log_instance.info("Packed", len(members), "images into atlas", self.num_atlases,
+                                       "with a size of", atlas_width, "x", atlas_height)
+                self.num_atlases += 1
+                self.num_images += len(members)
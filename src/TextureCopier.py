@@ -0,0 +1,223 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ImageData import hash_file
+from ExportException import ExportException
+
+
+# Amount of threads copying textures. Copying is bound by the disk, so more
+# threads do not help
+MAX_COPY_THREADS = 8
+
+# Amount of bytes os.sendfile copies per call
+SENDFILE_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+class FileHashIndex(object):
+
+    """ Persistent index of the content hashes of files, keyed on their
+    absolute path. Entries store the size and modification time of the file
+    when it was hashed, so files are only hashed again once they change """
+
+    # Increment this whenever the layout of the entries changes
+    INDEX_VERSION = 1
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.num_hashed = 0
+        self.lock = threading.Lock()
+        self.entries = self._load_entries()
+
+    def _load_entries(self):
+        """ Reads the entries stored on disk, returns no entries if the index
+        is missing, broken or of another version """
+        try:
+            with open(self.filepath, "r") as handle:
+                data = json.load(handle)
+            if data.get("version") == self.INDEX_VERSION:
+                return data["entries"]
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def _get_key(self, path):
+        """ Returns the index key of a file """
+        return os.path.normcase(os.path.abspath(path))
+
+    def lookup(self, path):
+        """ Returns the stored hash of a file, or None if the file is missing
+        or changed since it was hashed """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(self._get_key(path))
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def store(self, path, content_hash):
+        """ Stores the hash of a file with its current size and modification time """
+        stat = os.stat(path)
+        with self.lock:
+            self.entries[self._get_key(path)] = [stat.st_size, stat.st_mtime_ns, content_hash]
+
+    def get_hash(self, path):
+        """ Returns the hash of a file, only hashing it if it is not indexed
+        or changed since it was hashed """
+        content_hash = self.lookup(path)
+        if content_hash is None:
+            content_hash = hash_file(path)
+            self.store(path, content_hash)
+            with self.lock:
+                self.num_hashed += 1
+        return content_hash
+
+    def save(self):
+        """ Writes the index back to disk, dropping entries of deleted files.
+        Other exports into the same directory might have saved the index in
+        the meantime, so their entries are merged instead of overwritten """
+        entries = self._load_entries()
+        with self.lock:
+            entries.update(self.entries)
+        entries = {key: entry for key, entry in entries.items() if os.path.isfile(key)}
+
+        directory = os.path.dirname(self.filepath)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Each save uses its own temporary file, so concurrent saves do not
+        # write into the same file
+        fd, temp_filepath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as handle:
+                json.dump({"version": self.INDEX_VERSION, "entries": entries}, handle)
+            os.replace(temp_filepath, self.filepath)
+        except BaseException:
+            os.remove(temp_filepath)
+            raise
+
+
+class TextureCopier(object):
+
+    """ Copies texture files in a thread pool. Destinations which already
+    have the content of their source, according to the hash index, are
+    skipped, so repeated exports only copy changed textures. The caller
+    saves the index """
+
+    def __init__(self, index, use_hardlinks=False):
+        self.index = index
+        self.use_hardlinks = use_hardlinks
+        self.pool = ThreadPoolExecutor(max_workers=min(MAX_COPY_THREADS, os.cpu_count() or 1))
+        self.futures = []
+        self.destinations = set()
+
+        self.num_copied = 0
+        self.num_linked = 0
+        self.num_skipped = 0
+        self.num_copied_bytes = 0
+        self.lock = threading.Lock()
+
+    def copy(self, source, dest):
+        """ Queues copying the source file to the destination. Each
+        destination is only copied once """
+        key = os.path.normcase(os.path.abspath(dest))
+        if key in self.destinations:
+            return
+        self.destinations.add(key)
+        self.futures.append(self.pool.submit(self._copy, source, dest))
+
+    def _copy(self, source, dest):
+        """ Copies a file, unless the destination already has the same content """
+        if os.path.isfile(dest):
+            if os.path.samefile(source, dest) or self.index.get_hash(source) == self.index.get_hash(dest):
+                with self.lock:
+                    self.num_skipped += 1
+                return
+
+        # Write to a temporary file first, so a cancelled export never
+        # leaves a truncated texture behind. The name is unique, so
+        # concurrent exports copying the same texture do not collide
+        fd, temp_dest = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=os.path.basename(dest) + ".",
+                                         suffix=".tmp")
+        os.close(fd)
+        try:
+            # Hardlinks can not replace an existing file
+            os.remove(temp_dest)
+            linked = self.use_hardlinks and self._link(source, temp_dest)
+            if not linked:
+                self._copy_file(source, temp_dest)
+            os.replace(temp_dest, dest)
+        except BaseException:
+            if os.path.isfile(temp_dest):
+                os.remove(temp_dest)
+            raise
+
+        # The copy has the content of the source, so it is indexed with the
+        # hash of the source, and the next export does not have to hash it
+        self.index.store(dest, self.index.get_hash(source))
+
+        with self.lock:
+            if linked:
+                self.num_linked += 1
+            else:
+                self.num_copied += 1
+                self.num_copied_bytes += os.path.getsize(dest)
+
+    def _link(self, source, dest):
+        """ Tries to create a hardlink, which fails across file systems and
+        on file systems without hardlinks. Returns whether it succeeded """
+        try:
+            os.link(source, dest)
+            return True
+        except (OSError, AttributeError):
+            return False
+
+    def _copy_file(self, source, dest):
+        """ Copies a file, using os.sendfile to copy inside the kernel where
+        it is supported, and shutil otherwise """
+        if hasattr(os, "sendfile"):
+            try:
+                with open(source, "rb") as source_handle, open(dest, "wb") as dest_handle:
+                    size = os.fstat(source_handle.fileno()).st_size
+                    offset = 0
+                    while offset < size:
+                        sent = os.sendfile(dest_handle.fileno(), source_handle.fileno(), offset,
+                                           min(SENDFILE_CHUNK_SIZE, size - offset))
+                        if sent == 0:
+                            break
+                        offset += sent
+                if offset == size:
+                    shutil.copystat(source, dest)
+                    return
+            except OSError:
+                pass
+
+        shutil.copyfile(source, dest)
+        shutil.copystat(source, dest)
+
+    def shutdown(self):
+        """ Cancels the queued copies and stops the threads. Copies which
+        already started are completed """
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+        self.pool.shutdown()
+
+    def finish(self):
+        """ Waits for all copies and stops the threads """
+        try:
+            for future in self.futures:
+                try:
+                    future.result()
+                except (IOError, OSError) as msg:
+                    raise ExportException("Error while copying texture: " + str(msg))
+        finally:
+            self.futures = []
+            self.pool.shutdown()
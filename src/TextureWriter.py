@@ -1,12 +1,17 @@
 
 import bpy
 import os
-import shutil
 
 from Util import convert_blender_file_format, convert_to_panda_filepath
+from ImageData import hash_bytes, read_image_pixels, convert_to_ram_image
+from MipmapGenerator import generate_mipmaps
+from BlockCompressor import compress_bc1, compress_bc3, compress_bc5
+from TextureCopier import TextureCopier, FileHashIndex
 
 from ExportException import ExportException
+from ExportProfiler import profile_phase
 from pybamwriter.panda_types import *
+from pybamwriter.bam_writer import BamWriter
 
 
 class TextureWriter(object):
@@ -14,16 +19,36 @@ class TextureWriter(object):
     """ This class handles the writing of textures, either generated ones
     or from the disk """
 
+    # Name of the index storing the content hashes of the image files, next
+    # to the bam file
+    HASH_INDEX_FILENAME = ".pbe_texture_hashes.json"
+
+    # First bam version which supports rgtc compression and the rg format
+    RGTC_BAM_VERSION = (6, 37)
+
     def __init__(self, writer):
         self.textures_cache = {}
         self.images_cache = {}
+        self.content_cache = {}
+        self.hash_index = None
+        self.copier = None
         self.writer = writer
 
+        self.num_included_bytes = 0
+        self.num_deduplicated_images = 0
+        self.num_skipped_bakes = 0
+
     @property
     def log_instance(self):
         """ Helper to access the log instance """
         return self.writer.log_instance
 
+    @property
+    def profiler(self):
+        """ Helper to access the export profiler """
+        return self.writer.profiler
+
+    @profile_phase("texture_copy")
     def _save_image(self, image):
         """ Saves an image to the disk """
 
@@ -44,20 +69,12 @@ class TextureWriter(object):
         if not os.path.isdir(target_dir):
             os.makedirs(target_dir)
 
-        # In case the file is found on disk, just copy it
+        # In case the file is found on disk, just copy it. The copies run in
+        # the background, and skip destinations which are still up to date
         if os.path.isfile(old_filename):
-
-            # If there is already a file at the location, delete that first
-            if os.path.isfile(dest_filename):
-
-                # If the file source is equal to the file target, just return,
-                # no copying needed
-                if os.stat(dest_filename) == os.stat(old_filename):
-                    return dest_filename
-
-                os.remove(dest_filename)
-
-            shutil.copyfile(old_filename, dest_filename)
+            if not self.copier:
+                self.copier = TextureCopier(self._get_hash_index(), self.writer.settings.tex_copy_hardlinks)
+            self.copier.copy(old_filename, dest_filename)
 
         # When its not on disk, try to use the image.save() function
         else:
@@ -82,6 +99,207 @@ class TextureWriter(object):
 
         return dest_filename
 
+    def _get_image_content_hash(self, image):
+        """ Returns a hash of the source data of an image, which is the same
+        for images loading the same file. Generated images, which have no
+        source data, return None """
+        if image.packed_file is not None:
+            return hash_bytes(image.packed_file.data)
+
+        filepath = bpy.path.abspath(image.filepath)
+        if filepath and os.path.isfile(filepath):
+            return self._get_hash_index().get_hash(filepath)
+
+        return None
+
+    def _get_hash_index(self):
+        """ Returns the persistent index of the image file hashes, loading it
+        on first use """
+        if not self.hash_index:
+            self.hash_index = FileHashIndex(os.path.join(os.path.dirname(self.writer.filepath),
+                                                         self.HASH_INDEX_FILENAME))
+        return self.hash_index
+
+    def _should_bake_images(self):
+        """ Returns whether copied textures get baked to txo files, instead of
+        copying the image files """
+        settings = self.writer.settings
+        return settings.tex_mipmaps or settings.tex_compression != "NONE"
+
+    def _get_compression(self, texture, is_normal_map):
+        """ Returns the block compression function and mode for a texture, or
+        (None, CM_off) if it stays uncompressed. Normal maps only keep their
+        x and y components, which the shader has to renormalize. Older bam
+        versions can not store rgtc, so normal maps stay uncompressed there,
+        since the other modes lose too much precision for them """
+        if self.writer.settings.tex_compression == "NONE":
+            return None, Texture.CM_off
+        if is_normal_map and texture.num_components >= 3:
+            if self._get_bam_version() < self.RGTC_BAM_VERSION:
+                return None, Texture.CM_off
+            return compress_bc5, Texture.CM_rgtc
+        if texture.num_components == 4:
+            return compress_bc3, Texture.CM_dxt5
+        if texture.num_components == 3:
+            return compress_bc1, Texture.CM_dxt1
+        return None, Texture.CM_off
+
+    def _bake_ram_images(self, image, texture, use_srgb=False, is_normal_map=False):
+        """ Stores the pixels of an image as ram images of the texture, see
+        _bake_pixels """
+        width, height = image.size
+        if width == 0 or height == 0:
+            raise ExportException("Image '" + image.name + "' has no pixels, it might be missing on disk")
+
+        self._bake_pixels(read_image_pixels(image), texture, use_srgb, is_normal_map)
+
+    @profile_phase("texture_bake")
+    def _bake_pixels(self, pixels, texture, use_srgb=False, is_normal_map=False):
+        """ Stores (height, width, channels) float pixels as ram images of the
+        texture, so they get written into the bam file. Depending on the
+        settings, the whole mipmap chain is stored, and the images are block
+        compressed """
+        height, width = pixels.shape[:2]
+        if self.writer.settings.tex_mipmaps:
+            with self.profiler.phase("texture_mipmaps"):
+                levels = generate_mipmaps(pixels, use_srgb, is_normal_map)
+        else:
+            levels = [pixels]
+
+        compress, compression = self._get_compression(texture, is_normal_map)
+        if compress:
+            with self.profiler.phase("texture_compression"):
+                ram_images = [compress(level) for level in levels]
+            if compression == Texture.CM_rgtc:
+                texture.num_components = 2
+                texture.format = Texture.F_rg
+        else:
+            ram_images = [convert_to_ram_image(level, texture.num_components) for level in levels]
+
+        texture.x_size = width
+        texture.y_size = height
+        texture.component_type = Texture.T_unsigned_byte
+        texture.ram_image_compression = compression
+        texture.ram_images = ram_images
+
+        self.num_included_bytes += sum(len(ram_image) for ram_image in ram_images)
+
+    def _get_copy_filename(self, tex_name):
+        """ Returns the filename of a texture in the texture copy path, and
+        creates the directory if it does not exist yet """
+        dest_filename = os.path.join(os.path.dirname(self.writer.filepath), str(self.writer.settings.tex_copy_path),
+                                     tex_name)
+
+        target_dir = os.path.dirname(dest_filename)
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+
+        return dest_filename
+
+    def _get_bam_version(self):
+        """ Returns the bam version to write as tuple """
+        return tuple(int(i) for i in self.writer.settings.bam_version.split("."))
+
+    def _get_bake_key(self, image, texture, use_srgb, is_normal_map):
+        """ Returns a key covering everything a baked txo file depends on, or
+        None for generated images, which have no source data to compare """
+        content_hash = self._get_image_content_hash(image)
+        if not content_hash:
+            return None
+
+        settings = self.writer.settings
+        return hash_bytes(repr((content_hash, texture.num_components, texture.format, use_srgb, is_normal_map,
+                                bool(settings.tex_mipmaps), str(settings.tex_compression),
+                                self._get_bam_version())).encode("utf-8"))
+
+    def _write_txo(self, image, texture, use_srgb=False, is_normal_map=False):
+        """ Bakes the ram images of an image into a txo file in the texture
+        copy path, and returns its filename. The hash index stores the bake
+        key of each written txo file in place of its content hash, so txo
+        files which are unchanged since they were written with the same source
+        and settings are not baked again """
+        tex_name = bpy.path.basename(bpy.path.abspath(image.filepath)) or image.name
+        dest_filename = self._get_copy_filename(os.path.splitext(tex_name)[0] + ".txo")
+
+        bake_key = self._get_bake_key(image, texture, use_srgb, is_normal_map)
+        if bake_key and self._get_hash_index().lookup(dest_filename) == bake_key:
+            self.num_skipped_bakes += 1
+            return dest_filename
+
+        baked = Texture(image.name)
+        baked.num_components = texture.num_components
+        baked.format = texture.format
+        self._bake_ram_images(image, baked, use_srgb, is_normal_map)
+        self._write_baked_texture(dest_filename, baked)
+
+        if bake_key:
+            self._get_hash_index().store(dest_filename, bake_key)
+
+        return dest_filename
+
+    def _write_baked_texture(self, dest_filename, baked):
+        """ Writes a texture with ram images to a txo file """
+        writer = BamWriter()
+        writer.file_version = self._get_bam_version()
+        writer.open_file(dest_filename)
+        writer.write_object(baked)
+        writer.close()
+
+    def create_atlas_texture(self, name, pixels, num_components, use_srgb=False, is_normal_map=False):
+        """ Creates a texture from the (height, width, channels) float pixels
+        of a texture atlas. Atlases have no source file, so they are included
+        in the bam file in the INCLUDE mode, and baked to a txo file in the
+        texture copy path otherwise """
+        texture = Texture(name)
+        texture.num_components = num_components
+        self._set_texture_format(texture, use_srgb)
+
+        mode = str(self.writer.settings.tex_mode)
+        if mode == "INCLUDE":
+            self._bake_pixels(pixels, texture, use_srgb, is_normal_map)
+        elif mode == "KEEP":
+            raise ExportException("Texture mode KEEP is not supported yet!")
+        else:
+            abs_filename = self._get_copy_filename(name + ".txo")
+            baked = Texture(name)
+            baked.num_components = texture.num_components
+            baked.format = texture.format
+            self._bake_pixels(pixels, baked, use_srgb, is_normal_map)
+            self._write_baked_texture(abs_filename, baked)
+
+            if mode == "ABSOLUTE":
+                texture.filename = convert_to_panda_filepath(abs_filename)
+            else:
+                rel_filename = bpy.path.relpath(abs_filename, start=os.path.dirname(self.writer.filepath))
+                texture.filename = convert_to_panda_filepath(rel_filename)
+
+        return texture
+
+    def finish_textures(self):
+        """ Waits for the queued texture copies, logs their statistics and
+        saves the hash index """
+        if self.copier:
+            copier = self.copier
+            self.copier = None
+            with self.profiler.phase("texture_copy"):
+                copier.finish()
+
+            self.log_instance.info("Copied", copier.num_copied, "textures (" + format(copier.num_copied_bytes, ",d"),
+                                   "bytes), hardlinked", copier.num_linked, "and skipped", copier.num_skipped,
+                                   "unchanged textures")
+
+        if self.hash_index:
+            self.log_instance.info("Hashed", self.hash_index.num_hashed, "new or changed image files")
+            self.hash_index.save()
+            self.hash_index = None
+
+    def shutdown_copier(self):
+        """ Stops the texture copy threads after an error, without waiting
+        for the queued copies """
+        if self.copier:
+            self.copier.shutdown()
+            self.copier = None
+
     def _create_sampler_state_from_texture_slot(self, texture_slot):
         """ Creates a sampler state from a given texture slot """
         state = SamplerState()
@@ -128,26 +346,38 @@ class TextureWriter(object):
 
         return state
 
-    def _create_texture_from_image(self, image):
-        """ Creates a texture object from a given image """
+    def _create_texture_from_image(self, image, use_srgb=False, is_normal_map=False):
+        """ Creates a texture object from a given image. The color space and
+        whether it is a normal map affect the baked mipmaps, they are taken
+        from the first texture slot using the image """
 
-        # Check if we already wrote the image
-        if image.name in self.images_cache:
-            return self.images_cache[image.name]
+        # Check if we already wrote the image. The color space and normal map
+        # handling get baked into the texture, so they are part of the key
+        cache_key = (image.name, use_srgb, is_normal_map)
+        if cache_key in self.images_cache:
+            return self.images_cache[cache_key]
 
         mode = str(self.writer.settings.tex_mode)
+
+        # Images with the same content share one texture, so the file is
+        # only copied once, and included pixels are only stored once. This
+        # is always done for included images, since they are read anyway
+        content_key = None
+        if mode == "INCLUDE" or self.writer.settings.tex_deduplicate:
+            content_hash = self._get_image_content_hash(image)
+            if content_hash:
+                content_key = (content_hash, use_srgb, is_normal_map)
+            if content_key in self.content_cache:
+                self.log_instance.info("Image '" + image.name + "' has the same content as '" +
+                                       self.content_cache[content_key].name + "', sharing its texture")
+                self.num_deduplicated_images += 1
+                self.images_cache[cache_key] = self.content_cache[content_key]
+                return self.content_cache[content_key]
+
         texture = Texture(image.name)
+        texture.num_components = self.get_num_components(image)
+        self._set_texture_format(texture, use_srgb)
 
-        if image.depth == 8:
-            texture.num_components = 1
-        # No case for 16bits, could be one or two channel
-        elif image.depth == 24:
-            texture.num_components = 3
-        elif image.depth == 32:
-            texture.num_components = 4
-        else:
-            self.log_instance.warning("Cannot determine component count of image '" + image.name + "' with depth", image.depth, ", assuming 3")
-            texture.num_components = 3
         is_packed = image.packed_file is not None
         current_dir = os.path.dirname(self.writer.filepath)
 
@@ -180,28 +410,67 @@ class TextureWriter(object):
 
         elif mode == "COPY":
 
-            # When copying textures, we just write all textures to disk
-            abs_filename = self._save_image(image)
+            # When copying textures, we just write all textures to disk,
+            # either as they are or baked to a txo file
+            if self._should_bake_images():
+                abs_filename = self._write_txo(image, texture, use_srgb, is_normal_map)
+            else:
+                abs_filename = self._save_image(image)
             rel_filename = bpy.path.relpath(abs_filename, start=current_dir)
             texture.filename = convert_to_panda_filepath(rel_filename)
 
         elif mode == "INCLUDE":
-            raise ExportException("Texture mode INCLUDE is not supported yet!")
+            self._bake_ram_images(image, texture, use_srgb, is_normal_map)
         elif mode == "KEEP":
             raise ExportException("Texture mode KEEP is not supported yet!")
 
-        self.images_cache[image.name] = texture
+        self.images_cache[cache_key] = texture
+        if content_key:
+            self.content_cache[content_key] = texture
 
         return texture
 
-    def create_stage_node_from_texture_slot(self, texture_slot, sort=0, use_srgb=False):
-        """ Creates a panda texture object from a blender texture object """
+    def get_num_components(self, image):
+        """ Returns the amount of components of an image, based on its depth """
+        if image.depth == 8:
+            return 1
+        # No case for 16bits, could be one or two channel
+        elif image.depth == 24:
+            return 3
+        elif image.depth == 32:
+            return 4
+
+        self.log_instance.warning("Cannot determine component count of image '" + image.name + "' with depth", image.depth, ", assuming 3")
+        return 3
+
+    def is_normal_map_slot(self, texture_slot):
+        """ Returns whether a texture slot stores a normal map """
+        return texture_slot.use_map_normal or getattr(texture_slot.texture, "use_normal_map", False)
+
+    def _set_texture_format(self, texture, use_srgb):
+        """ Sets the format of a texture from its component count """
+        formats = [None, Texture.F_luminance, Texture.F_luminance_alpha, Texture.F_rgb, Texture.F_rgba]
+        texture.format = formats[texture.num_components]
+
+        if use_srgb:
+            if texture.num_components == 3:
+                texture.format = Texture.F_srgb
+            elif texture.num_components == 4:
+                texture.format = Texture.F_srgb_alpha
+            else:
+                self.log_instance.warning("Cannot set srgb on less than 3 channel texture:", texture.name)
+
+    def create_stage_node_from_texture_slot(self, texture_slot, sort=0, use_srgb=False, atlas_texture=None):
+        """ Creates a panda texture object from a blender texture object. If an
+        atlas texture is given, it is used instead of the image of the slot """
 
         # Check if the slot is not empty and a texture is assigned
         if not texture_slot or not texture_slot.texture or texture_slot.texture.type == "NONE":
             return None
 
         cache_key = texture_slot.name + "-sort:" + str(sort)
+        if atlas_texture:
+            cache_key += "-atlas:" + atlas_texture.name
 
         # Check if the texture slot was already processed, and if so, return the
         # cached result
@@ -237,11 +506,17 @@ class TextureWriter(object):
             # Extract the image
             image = texture.image
 
-            try:
-                stage_node.texture = self._create_texture_from_image(image)
-            except Exception as msg:
-                self.log_instance.error("Could not extract image:", msg)
-                return None
+            # Normal maps get renormalized when baking their mipmaps
+            is_normal_map = self.is_normal_map_slot(texture_slot)
+
+            if atlas_texture:
+                stage_node.texture = atlas_texture
+            else:
+                try:
+                    stage_node.texture = self._create_texture_from_image(image, use_srgb, is_normal_map)
+                except Exception as msg:
+                    self.log_instance.error("Could not extract image:", msg)
+                    return None
             stage_node.texture.default_sampler = stage_node.sampler
 
         elif texture.type in ["BLEND", "CLOUDS", "DISTORTED_NOISE", "ENVIRONMENT_MAP",
@@ -253,16 +528,5 @@ class TextureWriter(object):
         else:
             raise ExportException("Unsupported texture type for texture '" + texture.name + "': " + texture.type)
 
-        formats = [None, Texture.F_luminance, Texture.F_luminance_alpha, Texture.F_rgb, Texture.F_rgba]
-        stage_node.texture.format = formats[stage_node.texture.num_components]
-
-        if use_srgb:
-            if stage_node.texture.num_components == 3:
-                stage_node.texture.format = Texture.F_srgb
-            elif stage_node.texture.num_components == 4:
-                stage_node.texture.format = Texture.F_srgb_alpha
-            else:
-                self.log_instance.warning("Cannot set srgb on less than 3 channel texture:", stage_node.texture.name)
-
         self.textures_cache[cache_key] = stage_node
         return stage_node
@@ -0,0 +1,197 @@
+import numpy
+
+from GeomBuffers import GeomBuffers
+
+
+class MeshSnapshot(object):
+
+    """ Copies all mesh data required to pack the geoms into plain numpy
+    arrays, using the bulk foreach_get accessors instead of walking the
+    polygons and loops in python. The mesh has to be triangulated already """
+
+    def __init__(self, mesh, uv_layer=None):
+        self.name = mesh.name
+
+        num_vertices = len(mesh.vertices)
+        num_loops = len(mesh.loops)
+        num_polygons = len(mesh.polygons)
+
+        self.vertex_coords = numpy.empty(num_vertices * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("co", self.vertex_coords)
+        self.vertex_coords.shape = (num_vertices, 3)
+
+        self.vertex_normals = numpy.empty(num_vertices * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("normal", self.vertex_normals)
+        self.vertex_normals.shape = (num_vertices, 3)
+
+        self.loop_vertices = numpy.empty(num_loops, dtype=numpy.int32)
+        mesh.loops.foreach_get("vertex_index", self.loop_vertices)
+
+        self.polygon_loop_starts = numpy.empty(num_polygons, dtype=numpy.int32)
+        mesh.polygons.foreach_get("loop_start", self.polygon_loop_starts)
+
+        self.polygon_normals = numpy.empty(num_polygons * 3, dtype=numpy.float32)
+        mesh.polygons.foreach_get("normal", self.polygon_normals)
+        self.polygon_normals.shape = (num_polygons, 3)
+
+        self.polygon_centers = numpy.empty(num_polygons * 3, dtype=numpy.float32)
+        mesh.polygons.foreach_get("center", self.polygon_centers)
+        self.polygon_centers.shape = (num_polygons, 3)
+
+        self.polygon_materials = numpy.empty(num_polygons, dtype=numpy.int32)
+        mesh.polygons.foreach_get("material_index", self.polygon_materials)
+
+        self.polygon_smooth = numpy.empty(num_polygons, dtype=bool)
+        mesh.polygons.foreach_get("use_smooth", self.polygon_smooth)
+
+        if uv_layer is not None:
+            self.loop_uvs = numpy.empty(num_loops * 2, dtype=numpy.float32)
+            uv_layer.foreach_get("uv", self.loop_uvs)
+            self.loop_uvs.shape = (num_loops, 2)
+        else:
+            self.loop_uvs = None
+
+    def group_polygons_by_material(self, num_slots=40):
+        """ Returns the polygon indices of the mesh, grouped by their material
+        index. The polygons keep their original order within each group """
+        return [numpy.flatnonzero(self.polygon_materials == index) for index in range(num_slots)]
+
+    def triangle_centers(self, polygon_indices):
+        """ Returns the center of each of the given triangles """
+        return self.polygon_centers[polygon_indices]
+
+
+def pack_triangles(snapshot, polygon_indices, use_32_bit_indices=False, reuse_vertices=True):
+    """ Packs the given triangles of a MeshSnapshot into GeomBuffers. This
+    produces exactly the same buffers as MeshPacker.pack_polygons, but
+    processes all vertices at once with array operations. If reuse_vertices
+    is False, a new vertex is written for every triangle corner """
+
+    have_texcoords = snapshot.loop_uvs is not None
+    buffers = GeomBuffers(snapshot.name, have_texcoords, use_32_bit_indices)
+
+    polygon_indices = numpy.asarray(polygon_indices, dtype=numpy.int64)
+    num_triangles = len(polygon_indices)
+    num_corners = num_triangles * 3
+
+    buffers.num_triangles = num_triangles
+    if num_corners == 0:
+        return buffers
+
+    # Flatten the triangles to a list of corners, in the order the python
+    # engine visits them
+    corner_loops = (snapshot.polygon_loop_starts[polygon_indices][:, None] +
+                    numpy.arange(3)).reshape(-1)
+    corner_vertices = snapshot.loop_vertices[corner_loops]
+    corner_polygons = numpy.repeat(polygon_indices, 3)
+    corner_smooth = snapshot.polygon_smooth[corner_polygons]
+
+    if have_texcoords:
+        corner_uvs = snapshot.loop_uvs[corner_loops]
+        corner_keys = corner_uvs[:, 0].astype(numpy.float64) * 10000.0 + corner_uvs[:, 1]
+
+    # Sort the corners by their mesh vertex. The sort is stable, so within
+    # each vertex the corners stay in visiting order, and the reuse decision
+    # only depends on the previous corners of the same group.
+    order = numpy.argsort(corner_vertices, kind="stable")
+    sorted_vertices = corner_vertices[order]
+    sorted_smooth = corner_smooth[order]
+
+    is_first = numpy.empty(num_corners, dtype=bool)
+    is_first[0] = True
+    is_first[1:] = sorted_vertices[1:] != sorted_vertices[:-1]
+
+    # A vertex gets written when the polygon is flat shaded, or the vertex
+    # was not written yet
+    emit = ~sorted_smooth | is_first
+    num_duplicated = 0
+
+    if not reuse_vertices:
+        emit[:] = True
+
+    elif have_texcoords:
+        emit, num_duplicated = _resolve_uv_duplicates(
+            emit, is_first, sorted_smooth, corner_keys[order])
+
+    # Every corner references the last written copy of its vertex
+    positions = numpy.arange(num_corners)
+    last_emitted = numpy.maximum.accumulate(numpy.where(emit, positions, 0))
+
+    corner_emit = numpy.empty(num_corners, dtype=bool)
+    corner_emit[order] = emit
+    emitted_corners = numpy.flatnonzero(corner_emit)
+    num_vertices = len(emitted_corners)
+
+    new_indices = numpy.cumsum(corner_emit) - 1
+    corner_indices = numpy.empty(num_corners, dtype=numpy.int64)
+    corner_indices[order] = new_indices[order[last_emitted]]
+
+    # Build the interleaved vertex data of all written vertices
+    emitted_vertices = corner_vertices[emitted_corners]
+    vertex_data = numpy.empty((num_vertices, buffers.vertex_stride), dtype=numpy.float32)
+    vertex_data[:, 0:3] = snapshot.vertex_coords[emitted_vertices]
+    vertex_data[:, 3:6] = numpy.where(
+        corner_smooth[emitted_corners][:, None],
+        snapshot.vertex_normals[emitted_vertices],
+        snapshot.polygon_normals[corner_polygons[emitted_corners]])
+
+    if have_texcoords:
+        vertex_data[:, 6:8] = corner_uvs[emitted_corners]
+
+    index_type = numpy.uint32 if use_32_bit_indices else numpy.uint16
+
+    buffers.vertex_buffer.frombytes(vertex_data.tobytes())
+    buffers.index_buffer.frombytes(corner_indices.astype(index_type).tobytes())
+    buffers.source_indices.frombytes(emitted_vertices.astype(numpy.uint32).tobytes())
+    buffers.num_vertices = num_vertices
+    buffers.num_duplicated = num_duplicated
+
+    return buffers
+
+
+def _resolve_uv_duplicates(emit, is_first, smooth, keys):
+    """ Determines which smooth corners have to be duplicated because their
+    texcoord does not match the last written copy of the vertex. Expects the
+    corners to be sorted by vertex. Returns the new emit mask and the amount
+    of duplicated vertices """
+
+    # The uv key of the last written copy only changes when a corner gets
+    # written, so this is inherently sequential. Guess the result by comparing
+    # against the previous corner, and verify it afterwards. The verified mask
+    # is the only one satisfying the per-corner rule, so it matches the
+    # python engine exactly.
+    reusable = smooth & ~is_first
+    guess = numpy.zeros(len(emit), dtype=bool)
+    guess[1:] = numpy.abs(keys[1:] - keys[:-1]) > 0.0001
+    candidate = emit | (reusable & guess)
+
+    positions = numpy.arange(len(emit))
+    last_emitted = numpy.maximum.accumulate(numpy.where(candidate, positions, 0))
+    previous = numpy.empty(len(emit), dtype=numpy.int64)
+    previous[0] = 0
+    previous[1:] = last_emitted[:-1]
+    mismatch = numpy.abs(keys[previous] - keys) > 0.0001
+
+    if not numpy.array_equal(candidate[reusable], mismatch[reusable]):
+        candidate = _resolve_uv_duplicates_sequential(emit, reusable, keys)
+
+    num_duplicated = int(numpy.count_nonzero(candidate & reusable))
+    return candidate, num_duplicated
+
+
+def _resolve_uv_duplicates_sequential(emit, reusable, keys):
+    """ Fallback for _resolve_uv_duplicates, in case the vectorized guess did
+    not hold. This only happens for texcoords which differ by roughly the
+    tolerance, so it is rarely needed """
+    result = emit.tolist()
+    reusable = reusable.tolist()
+    keys = keys.tolist()
+    last_key = 0.0
+
+    for i, key in enumerate(keys):
+        if reusable[i] and abs(last_key - key) > 0.0001:
+            result[i] = True
+        if result[i]:
+            last_key = key
+
+    return numpy.array(result, dtype=bool)
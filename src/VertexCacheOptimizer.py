@@ -0,0 +1,183 @@
+import numpy
+from array import array
+
+
+# Size of the simulated post-transform vertex cache
+CACHE_SIZE = 32
+
+# Tuning values of the scoring function, see Tom Forsyth's
+# "Linear-Speed Vertex Cache Optimisation"
+CACHE_DECAY_POWER = 1.5
+LAST_TRI_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+# The triangle reordering runs in python, so larger geoms skip it and only
+# get their vertices renumbered, which is cheap
+MAX_REORDER_TRIANGLES = 2 ** 16
+
+
+def _make_cache_scores():
+    """ Precomputes the score of a vertex for each position in the cache """
+    scores = []
+    for position in range(CACHE_SIZE):
+        if position < 3:
+            # The vertices of the last triangle get a fixed score, to avoid
+            # preferring them too much over the rest of the cache
+            scores.append(LAST_TRI_SCORE)
+        else:
+            scaler = 1.0 / (CACHE_SIZE - 3)
+            scores.append((1.0 - (position - 3) * scaler) ** CACHE_DECAY_POWER)
+    return scores
+
+
+CACHE_SCORES = _make_cache_scores()
+
+
+def _vertex_score(cache_position, remaining_valence):
+    """ Computes the score of a vertex, based on its position in the cache and
+    the amount of triangles still using it """
+    if remaining_valence == 0:
+        return -1.0
+
+    score = 0.0
+    if cache_position >= 0:
+        score = CACHE_SCORES[cache_position]
+
+    # Boost vertices with only a few triangles left, so they get finished
+    # instead of leaving single triangles behind
+    score += VALENCE_BOOST_SCALE * remaining_valence ** -VALENCE_BOOST_POWER
+    return score
+
+
+def compute_acmr(indices, cache_size=CACHE_SIZE):
+    """ Computes the average cache miss ratio, the amount of transformed
+    vertices per triangle, for a FIFO post-transform cache of the given size """
+    num_triangles = len(indices) // 3
+    if num_triangles == 0:
+        return 0.0
+
+    cache = [-1] * cache_size
+    in_cache = set()
+    head = 0
+    misses = 0
+
+    for index in indices:
+        if index in in_cache:
+            continue
+        misses += 1
+        in_cache.discard(cache[head])
+        cache[head] = index
+        in_cache.add(index)
+        head = (head + 1) % cache_size
+
+    return misses / num_triangles
+
+
+def reorder_triangles(indices, num_vertices):
+    """ Reorders the triangles of an index list for post-transform vertex cache
+    locality and returns the new index list """
+    num_triangles = len(indices) // 3
+
+    # Find the triangles which use each vertex
+    vertex_triangles = [[] for i in range(num_vertices)]
+    for i, index in enumerate(indices):
+        vertex_triangles[index].append(i // 3)
+
+    vertex_scores = [_vertex_score(-1, len(tris)) for tris in vertex_triangles]
+    triangle_added = [False] * num_triangles
+
+    result = []
+    cache = []
+    next_unadded = 0
+    best_triangle = -1
+
+    for step in range(num_triangles):
+
+        # Without a candidate from the cache, continue with the next triangle
+        # which was not added yet
+        if best_triangle < 0:
+            while triangle_added[next_unadded]:
+                next_unadded += 1
+            best_triangle = next_unadded
+
+        triangle_added[best_triangle] = True
+        triangle_vertices = indices[best_triangle * 3:best_triangle * 3 + 3]
+        result.extend(triangle_vertices)
+
+        # The triangle is no longer pending on its vertices
+        for vertex in triangle_vertices:
+            vertex_triangles[vertex].remove(best_triangle)
+
+        # Move the vertices of the triangle to the front of the cache
+        front = [v for i, v in enumerate(triangle_vertices) if v not in triangle_vertices[:i]]
+        cache = front + [v for v in cache if v not in front]
+        evicted = cache[CACHE_SIZE:]
+        cache = cache[:CACHE_SIZE]
+
+        for vertex in evicted:
+            vertex_scores[vertex] = _vertex_score(-1, len(vertex_triangles[vertex]))
+
+        for position, vertex in enumerate(cache):
+            vertex_scores[vertex] = _vertex_score(position, len(vertex_triangles[vertex]))
+
+        # Update the scores of all triangles touched by the changed vertices,
+        # and pick the best one as next candidate
+        best_triangle = -1
+        best_score = -1.0
+        for vertex in cache + evicted:
+            for triangle in vertex_triangles[vertex]:
+                offset = triangle * 3
+                score = (vertex_scores[indices[offset]] + vertex_scores[indices[offset + 1]] +
+                         vertex_scores[indices[offset + 2]])
+                if score > best_score:
+                    best_score = score
+                    best_triangle = triangle
+
+    return result
+
+
+def optimize_vertex_cache(buffers, max_triangles=MAX_REORDER_TRIANGLES):
+    """ Reorders the triangles of the given GeomBuffers for vertex cache
+    locality, and then renumbers the vertices in the order they are first
+    used, to improve the vertex fetch locality. Geoms with more than
+    max_triangles triangles keep their triangle order. The buffers are
+    modified in place. Returns the ACMR before and after the optimization.
+    Renumbering the vertices does not change the ACMR, so both are the same
+    if the triangles were not reordered """
+
+    indices = buffers.index_buffer.tolist()
+    acmr_before = acmr_after = compute_acmr(indices)
+
+    if buffers.num_triangles <= max_triangles:
+        indices = reorder_triangles(indices, buffers.num_vertices)
+        acmr_after = compute_acmr(indices)
+
+    # Renumber the vertices in the order of their first use
+    indices = numpy.array(indices, dtype=numpy.int64)
+    unique_vertices, first_use = numpy.unique(indices, return_index=True)
+    used_vertices = unique_vertices[numpy.argsort(first_use, kind="stable")]
+
+    remap = numpy.zeros(buffers.num_vertices, dtype=numpy.int64)
+    remap[used_vertices] = numpy.arange(len(used_vertices))
+
+    vertices = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32)
+    vertices = vertices.reshape(buffers.num_vertices, buffers.vertex_stride)
+    sources = numpy.frombuffer(buffers.source_indices, dtype=numpy.uint32)
+
+    index_type = numpy.uint32 if buffers.use_32_bit_indices else numpy.uint16
+    new_index_buffer = array(buffers.index_buffer.typecode)
+    new_index_buffer.frombytes(remap[indices].astype(index_type).tobytes())
+
+    new_vertex_buffer = array('f')
+    new_vertex_buffer.frombytes(vertices[used_vertices].tobytes())
+
+    new_source_indices = array('I')
+    new_source_indices.frombytes(sources[used_vertices].tobytes())
+
+    buffers.index_buffer = new_index_buffer
+    buffers.vertex_buffer = new_vertex_buffer
+    buffers.source_indices = new_source_indices
+    buffers.num_vertices = len(used_vertices)
+
+    return acmr_before, acmr_after
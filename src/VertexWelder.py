@@ -0,0 +1,120 @@
+import numpy
+from array import array
+
+
+def weld_vertices(buffers, epsilon=0.0):
+    """ Merges all vertices of the given GeomBuffers which were created from
+    the same mesh vertex and have the same normal and texcoord. With an
+    epsilon, vertices whose normals and texcoords differ by at most epsilon
+    in every component get merged as well, also through chains of such
+    vertices, and the first vertex of each merged set is kept. An epsilon of
+    0 only merges exactly equal vertices. The transform blend is derived
+    from the mesh vertex, so it is covered by the source index.
+
+    The buffers are modified in place. The vertices keep the order of their
+    first occurrence. Returns the amount of vertices which were merged away """
+
+    num_vertices = buffers.num_vertices
+    if num_vertices == 0:
+        return 0
+
+    vertices = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32)
+    vertices = vertices.reshape(num_vertices, buffers.vertex_stride)
+    sources = numpy.frombuffer(buffers.source_indices, dtype=numpy.uint32)
+
+    # Build the weld key: (source index, normal, texcoord). The position is
+    # always the same for a given source index, so it does not need to be part
+    # of the key.
+    attributes = vertices[:, 3:]
+    if epsilon > 0.0:
+        # Snapping to a grid would separate close values on both sides of a
+        # cell border, so the vertices are compared pairwise instead
+        keys = _group_close_vertices(sources, attributes, epsilon)
+    else:
+        # Compare the values instead of the bit patterns: adding zero turns
+        # -0.0 into 0.0, and all nans get the same payload
+        normalized = numpy.where(numpy.isnan(attributes), numpy.float32("nan"), attributes + numpy.float32(0.0))
+        quantized = numpy.ascontiguousarray(normalized, dtype=numpy.float32).view(numpy.int32).astype(numpy.int64)
+        keys = numpy.column_stack((sources.astype(numpy.int64), quantized))
+
+    # Sort the keys to find the unique vertices
+    _, first, inverse = numpy.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # Number the unique vertices in the order of their first occurrence
+    order = numpy.argsort(first, kind="stable")
+    new_indices = numpy.empty(len(first), dtype=numpy.int64)
+    new_indices[order] = numpy.arange(len(first))
+    remap = new_indices[inverse]
+
+    kept = first[order]
+    num_welded = num_vertices - len(kept)
+
+    indices = numpy.frombuffer(buffers.index_buffer, dtype=_index_dtype(buffers))
+    new_index_buffer = array(buffers.index_buffer.typecode)
+    new_index_buffer.frombytes(remap[indices].astype(_index_dtype(buffers)).tobytes())
+
+    new_vertex_buffer = array('f')
+    new_vertex_buffer.frombytes(vertices[kept].tobytes())
+
+    new_source_indices = array('I')
+    new_source_indices.frombytes(sources[kept].tobytes())
+
+    buffers.vertex_buffer = new_vertex_buffer
+    buffers.index_buffer = new_index_buffer
+    buffers.source_indices = new_source_indices
+    buffers.num_vertices = len(kept)
+
+    # Every vertex which shares its mesh vertex with a previous one is a
+    # duplicate, caused by differing normals or texcoords
+    buffers.num_duplicated = len(kept) - len(numpy.unique(sources[kept]))
+
+    return num_welded
+
+
+def _group_close_vertices(sources, attributes, epsilon):
+    """ Returns a group label for each vertex. Vertices with the same source
+    index whose attributes differ by at most epsilon get the same label, also
+    through chains of such vertices """
+    num_vertices = len(sources)
+
+    # Sort the vertices by their source, and compare each one to the
+    # following vertices of the same source. The loop runs once per vertex
+    # of the largest source, on fewer vertices each time
+    order = numpy.argsort(sources, kind="stable")
+    sorted_sources = sources[order]
+    starts = numpy.flatnonzero(numpy.concatenate(([True], sorted_sources[1:] != sorted_sources[:-1])))
+    sizes = numpy.diff(numpy.append(starts, num_vertices))
+    remaining = numpy.repeat(starts + sizes, sizes) - numpy.arange(num_vertices) - 1
+
+    by_remaining = numpy.argsort(-remaining, kind="stable")
+    negated_remaining = -remaining[by_remaining]
+    sorted_attributes = attributes[order].astype(numpy.float64)
+
+    first, second = [], []
+    for offset in range(1, int(sizes.max())):
+        rows = by_remaining[:numpy.searchsorted(negated_remaining, -offset, side="right")]
+        close = (numpy.abs(sorted_attributes[rows + offset] - sorted_attributes[rows]) <= epsilon).all(axis=1)
+        first.append(order[rows[close]])
+        second.append(order[rows[close] + offset])
+
+    # Propagate the lowest vertex index through the connected vertices
+    labels = numpy.arange(num_vertices)
+    if first:
+        first, second = numpy.concatenate(first), numpy.concatenate(second)
+        while True:
+            lowest = numpy.minimum(labels[first], labels[second])
+            new_labels = labels.copy()
+            numpy.minimum.at(new_labels, first, lowest)
+            numpy.minimum.at(new_labels, second, lowest)
+            new_labels = new_labels[new_labels]
+            if numpy.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+
+    return labels
+
+
+def _index_dtype(buffers):
+    """ Returns the numpy type matching the index buffer """
+    return numpy.uint32 if buffers.use_32_bit_indices else numpy.uint16
@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+# The modules import each other by their plain names, the same way blender
+# loads them, so make the source directory importable
+source_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if source_dir not in sys.path:
+    sys.path.insert(0, source_dir)
+
+
+class AddonDirectories(object):
+
+    """ The add-on and its source folder are packages whose __init__ imports
+    bpy, so they get collected as plain directories. Otherwise pytest would
+    import them to set up the tests inside """
+
+    def pytest_collect_directory(self, path, parent):
+        if (path / "__init__.py").is_file():
+            return pytest.Dir.from_parent(parent, path=path)
+
+
+def pytest_configure(config):
+    config.pluginmanager.register(AddonDirectories(), "addon_directories")
@@ -0,0 +1,69 @@
+import random
+import numpy
+
+
+class Vector(tuple):
+
+    """ Minimal stand-in for mathutils.Vector """
+
+    def to_2d(self):
+        return Vector(self[:2])
+
+
+class Item(object):
+
+    """ Generic mesh element, with its attributes passed as keywords """
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class Collection(list):
+
+    """ Stand-in for a bpy collection, supporting the foreach_get accessor """
+
+    def foreach_get(self, name, target):
+        values = []
+        for item in self:
+            value = getattr(item, name)
+            if isinstance(value, (tuple, list)):
+                values.extend(value)
+            else:
+                values.append(value)
+        target[:] = numpy.array(values, dtype=target.dtype)
+
+
+def _random_vector(rng, size=3):
+    """ Returns a random vector, rounded to single precision like blender """
+    return Vector(float(numpy.float32(rng.random())) for i in range(size))
+
+
+def make_triangle_mesh(num_vertices=60, num_triangles=150, num_materials=3, uv_grid=3,
+                       smooth_ratio=0.8, seed=0):
+    """ Builds a random triangulated mesh with a uv layer, which behaves like
+    the blender mesh data for both geometry engines. Uvs are snapped to a
+    coarse grid, so vertices get shared by several corners with equal and
+    with different texcoords. Returns the mesh and its uv layer """
+    rng = random.Random(seed)
+
+    vertices = Collection(Item(co=_random_vector(rng), normal=_random_vector(rng))
+                          for i in range(num_vertices))
+    polygons, loops, uvs = Collection(), Collection(), Collection()
+
+    for i in range(num_triangles):
+        loop_start = len(loops)
+        indices = rng.sample(range(num_vertices), 3)
+        normal = _random_vector(rng)
+        polygons.append(Item(vertices=indices, loop_start=loop_start,
+                             loop_indices=[loop_start + k for k in range(3)],
+                             normal=normal, center=normal,
+                             material_index=rng.randrange(num_materials),
+                             use_smooth=rng.random() < smooth_ratio))
+
+        for vertex_index in indices:
+            loops.append(Item(vertex_index=vertex_index))
+            uv = (rng.randrange(uv_grid) / uv_grid, rng.randrange(uv_grid) / uv_grid)
+            uvs.append(Item(uv=Vector(float(numpy.float32(value)) for value in uv)))
+
+    mesh = Item(name="Mesh", vertices=vertices, loops=loops, polygons=polygons)
+    return mesh, uvs
@@ -0,0 +1,141 @@
+import numpy
+import pytest
+
+from mesh_fixtures import Collection, Item
+from KeyframeReducer import CHANNEL_DEFAULTS
+from AnimationBaker import (sample_fcurve, quaternions_to_matrices, decompose_matrices,
+                            matrices_to_euler_yxz, bake_sampled_channels, bake_action)
+
+
+def rotation(axis, angle):
+    """ Returns the matrix of a rotation around the x, y or z axis """
+    i, j = ((1, 2), (2, 0), (0, 1))[axis]
+    matrix = numpy.eye(3)
+    matrix[i, i] = matrix[j, j] = numpy.cos(angle)
+    matrix[i, j], matrix[j, i] = -numpy.sin(angle), numpy.sin(angle)
+    return matrix
+
+
+def euler_yxz_to_matrix(x, y, z):
+    """ Composes a rotation with the YXZ euler order, like blender """
+    return rotation(2, z).dot(rotation(0, x)).dot(rotation(1, y))
+
+
+def random_quaternions(count, seed=0):
+    quaternions = numpy.random.RandomState(seed).normal(size=(4, count))
+    return quaternions / numpy.linalg.norm(quaternions, axis=0)
+
+
+def make_fcurve(keyframes, interpolation="LINEAR", evaluate=None):
+    points = Collection(Item(co=(frame, value), handle_left=(frame - 1.0, value),
+                             handle_right=(frame + 1.0, value), interpolation=interpolation)
+                        for frame, value in keyframes)
+    return Item(keyframe_points=points, modifiers=[], extrapolation="CONSTANT", evaluate=evaluate)
+
+
+def test_quaternions_to_matrices():
+    angle = 0.7
+    w, z = numpy.array([numpy.cos(angle / 2)]), numpy.array([numpy.sin(angle / 2)])
+    zero = numpy.zeros(1)
+    numpy.testing.assert_allclose(quaternions_to_matrices(w, zero, zero, z)[0], rotation(2, angle), atol=1e-12)
+
+    matrices = quaternions_to_matrices(*random_quaternions(50))
+    identity = numpy.broadcast_to(numpy.eye(3), matrices.shape)
+    numpy.testing.assert_allclose(numpy.einsum("nji,njk->nik", matrices, matrices), identity, atol=1e-12)
+    numpy.testing.assert_allclose(numpy.linalg.det(matrices), 1.0)
+
+
+@pytest.mark.parametrize("sign", ((1, 1, 1), (-1, 1, 1), (1, -1, -1), (-1, -1, -1)))
+def test_decompose_compose_round_trip(sign):
+    rotations = quaternions_to_matrices(*random_quaternions(50, seed=1))
+    scales = numpy.random.RandomState(2).uniform(0.2, 3.0, (50, 3)) * sign
+    translations = numpy.random.RandomState(3).normal(size=(50, 3))
+
+    loc, normalized, decomposed_scales = decompose_matrices(rotations * scales[:, numpy.newaxis, :], translations)
+
+    assert loc is translations
+    numpy.testing.assert_allclose(numpy.linalg.det(normalized), 1.0)
+    numpy.testing.assert_allclose(normalized * decomposed_scales[:, numpy.newaxis, :],
+                                  rotations * scales[:, numpy.newaxis, :], atol=1e-12)
+
+    # An even amount of negative axes is a rotation, so only odd ones flip
+    if numpy.prod(sign) > 0:
+        numpy.testing.assert_allclose(decomposed_scales, numpy.abs(scales))
+
+
+def test_euler_round_trip():
+    angles = numpy.random.RandomState(4).uniform(-1.5, 1.5, (3, 100))
+    matrices = numpy.array([euler_yxz_to_matrix(*column) for column in angles.T])
+
+    numpy.testing.assert_allclose(matrices_to_euler_yxz(matrices), angles, atol=1e-9)
+
+    # Converting arbitrary rotations back and forth gives the same matrix
+    rotations = quaternions_to_matrices(*random_quaternions(100, seed=5))
+    x, y, z = matrices_to_euler_yxz(rotations)
+    composed = numpy.array([euler_yxz_to_matrix(*column) for column in zip(x, y, z)])
+    numpy.testing.assert_allclose(composed, rotations, atol=1e-9)
+
+
+def test_euler_gimbal_lock():
+    matrices = numpy.array([euler_yxz_to_matrix(numpy.pi / 2, 0.3, 0.4),
+                            euler_yxz_to_matrix(-numpy.pi / 2, -0.2, 0.1)])
+    x, y, z = matrices_to_euler_yxz(matrices)
+
+    assert (z == 0.0).all()
+    composed = numpy.array([euler_yxz_to_matrix(*column) for column in zip(x, y, z)])
+    numpy.testing.assert_allclose(composed, matrices, atol=1e-6)
+
+
+def test_bake_identity_gives_default_channels():
+    samples = numpy.zeros((10, 5))
+    samples[3] = samples[7:] = 1.0
+    channels = bake_sampled_channels(numpy.eye(4), samples)
+
+    assert channels.shape == (9, 5) and channels.dtype == numpy.float32
+    numpy.testing.assert_array_equal(channels, numpy.array(CHANNEL_DEFAULTS)[:, numpy.newaxis].repeat(5, 1))
+
+
+def test_bake_applies_the_bone_matrix():
+    bone_matrix = numpy.eye(4)
+    bone_matrix[:3, :3] = rotation(2, numpy.pi / 2)
+    bone_matrix[:3, 3] = (1.0, 2.0, 3.0)
+
+    samples = numpy.zeros((10, 1))
+    samples[0] = 1.0
+    samples[3] = 1.0
+    samples[7:] = 2.0
+    channels = bake_sampled_channels(bone_matrix, samples)[:, 0]
+
+    numpy.testing.assert_allclose(channels[:3], 2.0, rtol=1e-6)
+    numpy.testing.assert_allclose(channels[3:6], (90.0, 0.0, 0.0), atol=1e-4)
+    numpy.testing.assert_allclose(channels[6:], (1.0, 3.0, 3.0), atol=1e-6)
+
+
+def test_sample_fcurve():
+    numpy.testing.assert_array_equal(sample_fcurve(2.5, 3), (2.5, 2.5, 2.5))
+
+    curve = make_fcurve(((0.0, 0.0), (4.0, 2.0)))
+    numpy.testing.assert_allclose(sample_fcurve(curve, 6), (0.0, 0.5, 1.0, 1.5, 2.0, 2.0))
+    numpy.testing.assert_allclose(sample_fcurve(curve, 3, frame_step=2.0), (0.0, 1.0, 2.0))
+
+    curve = make_fcurve(((0.0, 0.0), (2.0, 1.0)), interpolation="CONSTANT")
+    numpy.testing.assert_allclose(sample_fcurve(curve, 4), (0.0, 0.0, 1.0, 1.0))
+
+    # Bezier curves are evaluated by blender
+    curve = make_fcurve(((0.0, 0.0), (2.0, 1.0)), interpolation="BEZIER", evaluate=lambda frame: frame * 10.0)
+    numpy.testing.assert_allclose(sample_fcurve(curve, 3), (0.0, 10.0, 20.0))
+
+
+def test_bake_action():
+    samples = numpy.zeros((10, 8))
+    samples[3] = samples[7:] = 1.0
+    moving = samples.copy()
+    moving[0] = numpy.linspace(0.0, 1.0, 8)
+
+    baked, original_bytes, written_bytes = bake_action(
+        {"Still": numpy.eye(4), "Moving": numpy.eye(4)}, {"Still": samples, "Moving": moving},
+        16, (0.0, 0.0, 0.0), False)
+
+    assert all(len(values) == 0 for values in baked["Still"])
+    assert [len(values) for values in baked["Moving"]] == [0, 0, 0, 0, 0, 0, 8, 0, 0]
+    assert (original_bytes, written_bytes) == (16 * 4, 8 * 4)
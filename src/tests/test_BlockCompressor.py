@@ -0,0 +1,120 @@
+import numpy
+import pytest
+
+from BlockCompressor import split_blocks, compress_bc1, compress_bc3, compress_bc5
+
+
+def unpack_indices(values, bits):
+    """ Returns the 16 palette indices of each block, first pixel first """
+    shifts = numpy.arange(16, dtype=numpy.uint64) * bits
+    return ((values[:, numpy.newaxis] >> shifts) & numpy.uint64((1 << bits) - 1)).astype(numpy.int64)
+
+
+def decode_color_blocks(encoded):
+    """ Reference BC1 decoder for (num_blocks, 8) blocks, following the
+    specification, including the three color mode """
+    color0 = encoded[:, 0:2].copy().view("<u2")[:, 0].astype(numpy.int64)
+    color1 = encoded[:, 2:4].copy().view("<u2")[:, 0].astype(numpy.int64)
+    indices = unpack_indices(encoded[:, 4:8].copy().view("<u4")[:, 0].astype(numpy.uint64), 2)
+
+    def expand(values):
+        return numpy.stack(((values >> 11) / 31.0, ((values >> 5) & 63) / 63.0, (values & 31) / 31.0), axis=1)
+
+    c0, c1 = expand(color0), expand(color1)
+    four_colors = (color0 > color1)[:, numpy.newaxis]
+    palette = numpy.stack((c0, c1,
+                           numpy.where(four_colors, (2.0 * c0 + c1) / 3.0, (c0 + c1) / 2.0),
+                           numpy.where(four_colors, (c0 + 2.0 * c1) / 3.0, 0.0)), axis=1)
+    return numpy.take_along_axis(palette, indices[:, :, numpy.newaxis], axis=1)
+
+
+def decode_alpha_blocks(encoded):
+    """ Reference decoder for the (num_blocks, 8) single channel blocks """
+    value0, value1 = encoded[:, 0].astype(numpy.float64), encoded[:, 1].astype(numpy.float64)
+    bits = numpy.zeros((len(encoded), 8), dtype=numpy.uint8)
+    bits[:, :6] = encoded[:, 2:8]
+    indices = unpack_indices(bits.view("<u8")[:, 0], 3)
+
+    eight_values = (value0 > value1)[:, numpy.newaxis]
+    weights = numpy.arange(1, 7, dtype=numpy.float64)
+    interpolated = numpy.where(eight_values, (value0[:, None] * (7 - weights) + value1[:, None] * weights) / 7.0,
+                               (value0[:, None] * (5 - weights) + value1[:, None] * weights) / 5.0)
+    interpolated[:, 4:] = numpy.where(eight_values, interpolated[:, 4:], (0.0, 255.0))
+    palette = numpy.concatenate((value0[:, None], value1[:, None], interpolated), axis=1)
+    return numpy.take_along_axis(palette, indices, axis=1) / 255.0
+
+
+def make_gradient(height, width, channels=3):
+    y, x = numpy.mgrid[0:height, 0:width] / numpy.array((height - 1, width - 1))[:, None, None]
+    planes = [x, y, (x + y) * 0.5, 1.0 - x * y]
+    return numpy.stack(planes[:channels], axis=2).astype(numpy.float32)
+
+
+def test_split_blocks():
+    pixels = numpy.arange(6 * 5, dtype=numpy.float32).reshape(6, 5, 1)
+    blocks = split_blocks(pixels)
+
+    assert blocks.shape == (4, 16, 1)
+    numpy.testing.assert_array_equal(blocks[0, :4, 0], pixels[0, :4, 0])
+    numpy.testing.assert_array_equal(blocks[1, :4, 0], (4, 4, 4, 4))
+    numpy.testing.assert_array_equal(blocks[2, 8:12, 0], pixels[5, :4, 0])
+    numpy.testing.assert_array_equal(blocks[2, 12:16, 0], pixels[5, :4, 0])
+
+
+def test_bc1_round_trip_error():
+    pixels = make_gradient(64, 48)
+    encoded = numpy.frombuffer(compress_bc1(pixels), dtype=numpy.uint8).reshape(-1, 8)
+    assert len(encoded) == 16 * 12
+
+    error = numpy.abs(decode_color_blocks(encoded) - split_blocks(pixels))
+    assert error.max() < 0.08
+    assert error.mean() < 0.02
+
+
+def test_bc1_uses_four_color_mode():
+    rng = numpy.random.RandomState(0)
+    pixels = rng.rand(32, 32, 3).astype(numpy.float32)
+
+    # Constant blocks get equal end points, and only use the first index
+    pixels[:4, :4] = (0.2, 0.6, 0.4)
+    encoded = numpy.frombuffer(compress_bc1(pixels), dtype=numpy.uint8).reshape(-1, 8)
+    color0, color1 = encoded[:, 0:2].copy().view("<u2"), encoded[:, 2:4].copy().view("<u2")
+
+    assert (color0 >= color1).all()
+    assert (encoded[color0[:, 0] == color1[:, 0], 4:8] == 0).all()
+    error = numpy.abs(decode_color_blocks(encoded[:1]) - (0.2, 0.6, 0.4))
+    assert error.max() <= 0.5 / 31.0 + 1e-6
+
+    # Random colors compress badly, but still better than using the mean
+    blocks = split_blocks(pixels)
+    error = ((decode_color_blocks(encoded) - blocks) ** 2).sum(axis=2).mean()
+    assert error < ((blocks - blocks.mean(axis=1, keepdims=True)) ** 2).sum(axis=2).mean()
+
+
+def test_bc3_round_trip_error():
+    pixels = make_gradient(32, 32, channels=4)
+    encoded = numpy.frombuffer(compress_bc3(pixels), dtype=numpy.uint8).reshape(-1, 16)
+    blocks = split_blocks(pixels)
+
+    alpha_error = numpy.abs(decode_alpha_blocks(encoded[:, :8]) - blocks[:, :, 3])
+    assert alpha_error.max() < 0.02
+    color_error = numpy.abs(decode_color_blocks(encoded[:, 8:]) - blocks[:, :, :3])
+    assert color_error.max() < 0.08
+
+
+@pytest.mark.parametrize("value", (0.0, 0.5, 1.0))
+def test_alpha_blocks_of_constant_values(value):
+    pixels = numpy.full((8, 8, 4), value, dtype=numpy.float32)
+    encoded = numpy.frombuffer(compress_bc3(pixels), dtype=numpy.uint8).reshape(-1, 16)
+    numpy.testing.assert_allclose(decode_alpha_blocks(encoded[:, :8]), value, atol=0.5 / 255.0)
+
+
+def test_bc5_round_trip_error():
+    pixels = make_gradient(16, 40)
+    encoded = numpy.frombuffer(compress_bc5(pixels), dtype=numpy.uint8).reshape(-1, 16)
+    blocks = split_blocks(pixels)
+
+    assert len(encoded) == 4 * 10
+    for channel, offset in ((0, 0), (1, 8)):
+        error = numpy.abs(decode_alpha_blocks(encoded[:, offset:offset + 8]) - blocks[:, :, channel])
+        assert error.max() < 0.01
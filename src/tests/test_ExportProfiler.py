@@ -0,0 +1,111 @@
+import json
+import pytest
+
+from ExportProfiler import ExportProfiler
+
+
+class Log(object):
+
+    """ Stand-in for the export log, collecting the info messages """
+
+    def __init__(self):
+        self.messages = []
+
+    def info(self, *args):
+        self.messages.append(" ".join(str(arg) for arg in args))
+
+
+@pytest.fixture
+def profiler():
+    profiler = ExportProfiler()
+    profiler.start()
+    yield profiler
+    profiler.stop()
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = ExportProfiler()
+    with profiler.phase("packing"):
+        pass
+    profiler.add_record("vertex_cache", 1.0)
+    assert profiler.records == {}
+
+
+def test_phases_are_aggregated(profiler):
+    with profiler.object("Cube"):
+        for i in range(3):
+            with profiler.phase("packing"):
+                pass
+        profiler.add_record("vertex_cache", 0.5, 100, 300)
+        profiler.add_record("vertex_cache", 0.25, -50, 200)
+    with profiler.object("Sphere"):
+        profiler.add_record("vertex_cache", 1.0, 10, 400)
+
+    assert profiler.records[("packing", "Cube")][0] == 3
+    assert profiler.records[("vertex_cache", "Cube")] == [2, 0.75, 50, 300]
+
+    # Net allocations are summed up, peaks are the highest single peak
+    totals = profiler.get_phase_totals()
+    assert totals["vertex_cache"] == [3, 1.75, 60, 400]
+    assert totals["packing"][0] == 3
+
+
+def test_peak_memory_of_temporary_allocations(profiler):
+    with profiler.phase("outer"):
+        with profiler.phase("temporary"):
+            data = bytearray(4 * 1024 * 1024)
+            del data
+        kept = bytearray(1024 * 1024)
+
+    # The temporary buffer is freed again, so it only shows up in the peak,
+    # also in the peak of the enclosing phase
+    calls, duration, net_allocated, peak_allocated = profiler.records[("temporary", None)]
+    assert net_allocated < 64 * 1024
+    assert peak_allocated >= 4 * 1024 * 1024
+
+    calls, duration, net_allocated, peak_allocated = profiler.records[("outer", None)]
+    assert 1024 * 1024 <= net_allocated < 2 * 1024 * 1024
+    assert peak_allocated >= 4 * 1024 * 1024
+    del kept
+
+
+def test_write_json(profiler, tmpdir):
+    with profiler.object("Cube"):
+        profiler.add_record("packing", 2.0, 10, 20)
+        profiler.add_record("export", 3.0, 30, 40)
+    with profiler.object("Sphere"):
+        profiler.add_record("packing", 1.0, 5, 50)
+    profiler.stop()
+
+    path = str(tmpdir.join("profile.json"))
+    profiler.write_json(path)
+    with open(path, "r") as handle:
+        data = json.load(handle)
+
+    assert data["total_seconds"] >= 0.0
+    assert data["phases"] == [
+        {"phase": "export", "calls": 1, "seconds": 3.0, "net_allocated_bytes": 30, "peak_allocated_bytes": 40},
+        {"phase": "packing", "calls": 2, "seconds": 3.0, "net_allocated_bytes": 15, "peak_allocated_bytes": 50},
+    ]
+
+    # Entries are sorted by their duration, slowest first
+    assert [(entry["phase"], entry["object"]) for entry in data["entries"]] == [
+        ("export", "Cube"), ("packing", "Cube"), ("packing", "Sphere")]
+
+
+def test_report(profiler):
+    for index in range(4):
+        with profiler.object("Object" + str(index)):
+            profiler.add_record("phase" + str(index), float(index), 1000, 2000)
+
+    log = Log()
+    profiler.report(log, count=2)
+
+    assert log.messages[0] == "Slowest export phases:"
+    assert log.messages[1].split()[:2] == ["phase3", "3.0000"]
+    assert log.messages[2].split()[0] == "phase2"
+    assert "1,000 bytes net" in log.messages[1] and "2,000 bytes peak" in log.messages[1]
+
+    assert log.messages[3] == "Slowest objects:"
+    assert log.messages[4].split()[:2] == ["phase3", "Object3"]
+    assert len(log.messages) == 6
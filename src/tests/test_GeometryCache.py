@@ -0,0 +1,70 @@
+import os
+import numpy
+
+from mesh_fixtures import Item
+from GeometryCache import GeometryCache
+
+
+SNAPSHOT_ARRAYS = ("vertex_coords", "vertex_normals", "loop_vertices", "polygon_loop_starts",
+                   "polygon_normals", "polygon_centers", "polygon_materials", "polygon_smooth")
+
+
+def make_snapshot(seed=0):
+    rng = numpy.random.RandomState(seed)
+    snapshot = Item(**{name: rng.rand(4, 3).astype(numpy.float32) for name in SNAPSHOT_ARRAYS})
+    snapshot.loop_uvs = None
+    return snapshot
+
+
+def make_object(material_name="Material"):
+    return Item(modifiers=[Item(name="Subsurf", type="SUBSURF", show_viewport=True)],
+                material_slots=[Item(material=Item(name=material_name)), Item(material=None)])
+
+
+def test_key_depends_on_the_inputs(tmpdir):
+    cache = GeometryCache(str(tmpdir), 1024)
+    snapshot, obj, options = make_snapshot(), make_object(), Item(weld_vertices=False)
+    key = cache.make_key(snapshot, {}, obj, options)
+
+    assert cache.make_key(make_snapshot(), {}, make_object(), Item(weld_vertices=False)) == key
+    assert cache.make_key(make_snapshot(1), {}, obj, options) != key
+    assert cache.make_key(snapshot, {0: ((1, 0.5), )}, obj, options) != key
+    assert cache.make_key(snapshot, {}, make_object("Other"), options) != key
+    assert cache.make_key(snapshot, {}, obj, Item(weld_vertices=True)) != key
+
+    snapshot.loop_uvs = numpy.zeros((4, 2), dtype=numpy.float32)
+    assert cache.make_key(snapshot, {}, obj, options) != key
+
+
+def test_store_and_load(tmpdir):
+    cache = GeometryCache(str(tmpdir.join("cache")), 1024)
+    assert cache.load("missing") is None
+
+    cache.store("entry", ([(0, "buffers")], "report"))
+    assert cache.load("entry") == ([(0, "buffers")], "report")
+    assert (cache.num_hits, cache.num_misses) == (1, 1)
+
+    # Broken entries count as misses
+    tmpdir.join("cache", "broken" + GeometryCache.FILE_EXTENSION).write_binary(b"\x80")
+    assert cache.load("broken") is None
+    assert cache.num_misses == 2
+
+
+def test_trim_removes_least_recently_used(tmpdir):
+    cache = GeometryCache(str(tmpdir), 0)
+    for age, key in enumerate(("recent", "old", "oldest")):
+        cache.store(key, b"x" * 100)
+        path = os.path.join(str(tmpdir), key + GeometryCache.FILE_EXTENSION)
+        os.utime(path, (1000000 - age * 1000, 1000000 - age * 1000))
+    entry_size = os.path.getsize(path)
+
+    # Loading marks the entry as used, so it is kept over the others
+    cache.load("oldest")
+    cache.max_bytes = entry_size * 2
+
+    assert cache.trim() == 1
+    assert cache.load("old") is None
+    assert cache.load("recent") is not None and cache.load("oldest") is not None
+
+    cache.max_bytes = 0
+    assert cache.trim() == 2
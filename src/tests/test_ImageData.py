@@ -0,0 +1,91 @@
+import numpy
+import pytest
+
+from mesh_fixtures import Item
+import ImageData
+from ImageData import read_image_pixels, convert_to_ram_image
+
+
+class Pixels(list):
+
+    """ Stand-in for the pixels of a blender image with foreach_get """
+
+    def foreach_get(self, target):
+        target[:] = self
+
+
+def make_pixels(height, width, channels, seed=0):
+    return numpy.random.RandomState(seed).rand(height, width, channels).astype(numpy.float32)
+
+
+@pytest.mark.parametrize("pixel_type", (list, Pixels))
+def test_read_image_pixels(pixel_type):
+    expected = make_pixels(3, 5, 4)
+    image = Item(size=(5, 3), channels=4, pixels=pixel_type(expected.ravel().tolist()))
+    numpy.testing.assert_array_equal(read_image_pixels(image), expected)
+
+
+class SlicedPixels(list):
+
+    """ Stand-in for the pixels of an older blender version without
+    foreach_get, recording the length of each slice read """
+
+    def __init__(self, values):
+        list.__init__(self, values)
+        self.slice_lengths = []
+
+    def __getitem__(self, index):
+        values = list.__getitem__(self, index)
+        self.slice_lengths.append(len(values))
+        return tuple(values)
+
+
+def test_read_image_pixels_in_slices(monkeypatch):
+    expected = make_pixels(11, 5, 4)
+    image = Item(size=(5, 11), channels=4, pixels=SlicedPixels(expected.ravel().tolist()))
+    monkeypatch.setattr(ImageData, "READ_CHUNK_ROWS", 3)
+
+    numpy.testing.assert_array_equal(read_image_pixels(image), expected)
+    assert image.pixels.slice_lengths == [60, 60, 60, 40]
+
+
+@pytest.mark.parametrize("num_components, order", ((1, [0]), (2, [0, 3]), (3, [2, 1, 0]), (4, [2, 1, 0, 3])))
+def test_convert_to_ram_image(num_components, order):
+    pixels = make_pixels(6, 4, 4)
+    ram_image = convert_to_ram_image(pixels, num_components)
+
+    assert isinstance(ram_image, bytearray)
+    converted = numpy.frombuffer(ram_image, dtype=numpy.uint8).reshape(6, 4, num_components)
+    numpy.testing.assert_array_equal(converted, numpy.round(pixels[:, :, order] * 255.0))
+
+
+def test_convert_fills_missing_channels():
+    pixels = make_pixels(2, 2, 1)
+    converted = numpy.frombuffer(convert_to_ram_image(pixels, 4), dtype=numpy.uint8).reshape(2, 2, 4)
+    numpy.testing.assert_array_equal(converted, numpy.round(pixels.repeat(4, axis=2) * 255.0))
+
+
+def test_convert_in_chunks(monkeypatch):
+    pixels = make_pixels(37, 3, 4) * 1.4 - 0.2
+    expected = convert_to_ram_image(pixels, 4)
+
+    # Converting the rows in chunks gives the same result, and values out of
+    # range get clamped
+    monkeypatch.setattr(ImageData, "CONVERT_CHUNK_ROWS", 5)
+    assert convert_to_ram_image(pixels, 4) == expected
+    converted = numpy.frombuffer(expected, dtype=numpy.uint8)
+    assert converted.min() == 0 and converted.max() == 255
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, ImageData.HASH_CHUNK_SIZE))
+def test_packed_and_file_hashes_match(tmpdir, chunk_size):
+    # Packed images and image files with the same content must get the same
+    # hash, so they share a texture
+    data = bytes(range(256)) * 5
+    path = tmpdir.join("image.png")
+    path.write_binary(data)
+
+    content_hash = ImageData.hash_file(str(path), chunk_size)
+    assert content_hash == ImageData.hash_bytes(data, chunk_size)
+    assert content_hash == ImageData.hash_bytes(bytearray(data))
+    assert content_hash != ImageData.hash_bytes(data[:-1])
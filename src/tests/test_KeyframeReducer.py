@@ -0,0 +1,57 @@
+import numpy
+import pytest
+
+from KeyframeReducer import reduce_channel, reduce_channels, get_channels_size, CHANNEL_DEFAULTS
+
+
+def test_default_channels_are_dropped():
+    assert len(reduce_channel(numpy.zeros(10, dtype=numpy.float32), 0.0)) == 0
+    assert len(reduce_channel(numpy.ones(10, dtype=numpy.float32), 1.0)) == 0
+    assert len(reduce_channel(numpy.array([0.0, 0.001, -0.001]), 0.0, tolerance=0.001)) == 0
+    assert len(reduce_channel(numpy.array([0.0, 0.003]), 0.0, tolerance=0.001)) == 2
+
+
+def test_constant_channels_keep_one_value():
+    values = numpy.full(10, 2.0, dtype=numpy.float32)
+    reduced = reduce_channel(values, 0.0)
+    assert reduced.tolist() == [2.0] and reduced.dtype == numpy.float32
+
+    # Nearly constant channels use the center of their range
+    reduced = reduce_channel(numpy.array([2.0, 2.002, 2.001]), 0.0, tolerance=0.001)
+    assert reduced.tolist() == pytest.approx([2.001])
+
+
+@pytest.mark.parametrize("tolerance", (0.01, 0.1, 1.0))
+def test_reduced_values_stay_within_tolerance(tolerance):
+    values = numpy.random.RandomState(0).uniform(-5.0, 5.0, 50)
+
+    for quantize in (False, True):
+        reduced = reduce_channel(values, 0.0, tolerance, quantize)
+        assert len(reduced) == len(values)
+        assert numpy.abs(reduced - values).max() <= tolerance * 0.5 + 1e-12
+
+    # Quantizing snaps the values to a grid of the tolerance
+    quantized = reduce_channel(values, 0.0, tolerance, quantize=True)
+    numpy.testing.assert_allclose(quantized / tolerance, numpy.round(quantized / tolerance), atol=1e-9)
+
+
+def test_lossless_reduction_keeps_animated_values():
+    values = numpy.linspace(0.0, 1.0, 20)
+    assert reduce_channel(values, 0.0) is values
+    assert len(reduce_channel(values[:0], 0.0)) == 0
+
+
+def test_reduce_channels_and_size():
+    channels = numpy.array(CHANNEL_DEFAULTS, dtype=numpy.float32)[:, numpy.newaxis]
+    channels = channels.repeat(30, axis=1)
+    channels[3] = numpy.linspace(0.0, 90.0, 30)
+    channels[6] = 5.0
+    channels[0] = 1.0 + numpy.linspace(0.0, 0.01, 30)
+
+    reduced = reduce_channels(channels, position_tolerance=0.1, angle_tolerance=0.5, scale_tolerance=0.02)
+
+    assert [len(values) for values in reduced] == [0, 0, 0, 30, 0, 0, 1, 0, 0]
+    assert get_channels_size(reduced) == 31 * 4
+
+    # At half the frame rate, animated channels take up half the space
+    assert get_channels_size(reduced, num_frames=15) == 16 * 4
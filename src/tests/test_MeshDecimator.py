@@ -0,0 +1,124 @@
+import numpy
+import pytest
+
+pytest.importorskip("pybamwriter.panda_types")
+
+from mesh_fixtures import Item
+from GeomBuffers import GeomBuffers
+from MeshDecimator import decimate_buffers, find_shared_positions
+from MeshPacker import PackReport, generate_lod_levels
+
+
+def make_grid_buffers(size, height=None, offset=0.0):
+    """ Returns a smooth shaded size x size quad grid in the xy plane, moved
+    by offset along x. The height function displaces the vertices along z """
+    coords = numpy.linspace(0.0, 1.0, size + 1)
+    x, y = numpy.meshgrid(coords, coords)
+    x = x + offset
+    z = numpy.zeros_like(x) if height is None else height(x, y)
+
+    vertices = numpy.zeros((len(coords) ** 2, 6), dtype=numpy.float32)
+    vertices[:, 0], vertices[:, 1], vertices[:, 2] = x.ravel(), y.ravel(), z.ravel()
+    dz_dy, dz_dx = numpy.gradient(z, coords, coords)
+    normals = numpy.stack((-dz_dx.ravel(), -dz_dy.ravel(), numpy.ones(x.size)), axis=1)
+    vertices[:, 3:6] = normals / numpy.linalg.norm(normals, axis=1)[:, numpy.newaxis]
+
+    triangles = []
+    for row in range(size):
+        for column in range(size):
+            a = row * (size + 1) + column
+            b, c, d = a + 1, a + size + 1, a + size + 2
+            triangles.extend((a, b, d, a, d, c))
+
+    buffers = GeomBuffers("Grid")
+    buffers.vertex_buffer.frombytes(vertices.tobytes())
+    buffers.index_buffer.extend(triangles)
+    buffers.source_indices.extend(range(len(vertices)))
+    buffers.num_vertices = len(vertices)
+    buffers.num_triangles = len(triangles) // 3
+    return buffers
+
+
+def get_positions(buffers):
+    return numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32).reshape(-1, buffers.vertex_stride)[:, :3]
+
+
+def get_triangle_normals(buffers):
+    vertices = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32).reshape(-1, buffers.vertex_stride)
+    corners = vertices[numpy.array(buffers.index_buffer, dtype=numpy.int64).reshape(-1, 3), :3]
+    return numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+
+@pytest.mark.parametrize("ratio", (0.5, 0.25))
+def test_decimate_plane(ratio):
+    buffers = make_grid_buffers(16)
+    decimated = decimate_buffers(buffers, ratio)
+
+    assert 0 < decimated.num_triangles <= buffers.num_triangles * ratio
+    assert len(decimated.index_buffer) == decimated.num_triangles * 3
+    assert max(decimated.index_buffer) < decimated.num_vertices == len(decimated.source_indices)
+
+    # No triangle gets flipped or degenerate, and the boundary is kept, so
+    # the triangles still cover the whole plane
+    normals = get_triangle_normals(decimated)
+    assert (normals[:, 2] > 1e-9).all()
+    assert normals[:, 2].sum() * 0.5 == pytest.approx(1.0)
+
+
+def test_decimated_vertices_are_original_vertices():
+    buffers = make_grid_buffers(12, lambda x, y: 0.1 * numpy.sin(x * 6.0) * numpy.cos(y * 4.0))
+    decimated = decimate_buffers(buffers, 0.5)
+
+    original = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32).reshape(-1, 6)
+    kept = numpy.frombuffer(decimated.vertex_buffer, dtype=numpy.float32).reshape(-1, 6)
+    sources = numpy.array(decimated.source_indices, dtype=numpy.int64)
+
+    numpy.testing.assert_array_equal(kept, original[sources])
+    assert (numpy.diff(sources) > 0).all()
+    assert (get_triangle_normals(decimated)[:, 2] > 0.0).all()
+
+
+def test_ratio_one_keeps_everything():
+    buffers = make_grid_buffers(4)
+    decimated = decimate_buffers(buffers, 1.0)
+
+    assert decimated.index_buffer == buffers.index_buffer
+    assert decimated.vertex_buffer == buffers.vertex_buffer
+    assert decimated.num_triangles == buffers.num_triangles
+
+
+def test_large_geoms_are_not_decimated():
+    buffers = make_grid_buffers(4)
+    decimated = decimate_buffers(buffers, 0.5, max_triangles=buffers.num_triangles - 1)
+    assert decimated.index_buffer == buffers.index_buffer
+    assert decimated.num_triangles == buffers.num_triangles
+
+
+def test_locked_positions_are_kept():
+    buffers = make_grid_buffers(10, lambda x, y: 0.2 * numpy.sin(x * 5.0) * numpy.cos(y * 3.0))
+    positions = get_positions(buffers)
+    locked = positions[positions[:, 0] == 0.0]
+
+    decimated = decimate_buffers(buffers, 0.25, locked)
+    assert decimated.num_triangles < buffers.num_triangles
+    kept = get_positions(decimated)
+    numpy.testing.assert_array_equal(numpy.unique(kept[kept[:, 0] == 0.0], axis=0), numpy.unique(locked, axis=0))
+
+
+def test_split_geoms_keep_matching_borders():
+    # Two halves of a split geom share the column at x = 1. Each half gets
+    # decimated on its own, but the border must stay the same in both, so
+    # the LOD levels do not crack
+    height = lambda x, y: 0.2 * numpy.sin(x * 4.0) * numpy.cos(y * 3.0)
+    packed_geoms = [(0, make_grid_buffers(10, height)), (0, make_grid_buffers(10, height, offset=1.0))]
+    border = find_shared_positions([buffers for index, buffers in packed_geoms])
+    assert len(border) == 11 and (border[:, 0] == 1.0).all()
+
+    report = PackReport()
+    generate_lod_levels(packed_geoms, Item(lod_ratios=(0.5, 0.25)), report)
+
+    for level_geoms in report.lod_levels:
+        assert sum(buffers.num_triangles for index, buffers in level_geoms) < 400
+        for index, buffers in level_geoms:
+            positions = get_positions(buffers)
+            numpy.testing.assert_array_equal(numpy.unique(positions[positions[:, 0] == 1.0], axis=0), border)
@@ -0,0 +1,87 @@
+import numpy
+import pytest
+
+pytest.importorskip("pybamwriter.panda_types")
+
+from mesh_fixtures import Item, make_triangle_mesh
+from MeshPacker import PackOptions, PackReport, pack_material_group, pack_snapshot, split_triangles
+from VectorizedGeometry import MeshSnapshot
+
+
+def make_options(**overrides):
+    settings = dict(weld_vertices=False, weld_epsilon=0.0, split_large_geoms=True,
+                    optimize_vertex_cache=False, generate_lods=False, lod_reduction=0.5, lod_count=2)
+    settings.update(overrides)
+    return PackOptions(Item(**settings))
+
+
+class FakeBuffers(object):
+
+    """ Stands in for the GeomBuffers of a selection, which uses a vertex per
+    triangle corner """
+
+    def __init__(self, selection, use_32_bit_indices):
+        self.selection = selection
+        self.num_vertices = len(selection) * 3
+        self.use_32_bit_indices = use_32_bit_indices
+        self.bounds = None
+
+    def narrow_indices(self):
+        self.use_32_bit_indices = False
+
+    def compute_bounds(self):
+        self.bounds = True
+
+
+def test_split_triangles():
+    rng = numpy.random.RandomState(0)
+    centers = rng.rand(101, 3) * (1.0, 10.0, 1.0)
+    selection = numpy.arange(0, 101)
+
+    first, second = split_triangles(centers, selection)
+
+    assert len(first) == 50 and len(second) == 51
+    assert sorted(numpy.concatenate((first, second)).tolist()) == selection.tolist()
+    assert (numpy.diff(first) > 0).all() and (numpy.diff(second) > 0).all()
+
+    # The split happens along the longest axis, which is y
+    assert centers[first, 1].max() <= centers[second, 1].min()
+
+
+def test_large_groups_get_split():
+    centers = numpy.random.RandomState(1).rand(50000, 3)
+    report = PackReport()
+    packed = pack_material_group("Geom", centers, FakeBuffers, make_options(), report)
+
+    assert report.num_splits == 3
+    assert all(not buffers.use_32_bit_indices and buffers.bounds for buffers in packed)
+    selections = numpy.concatenate([buffers.selection for buffers in packed])
+    assert sorted(selections.tolist()) == list(range(len(centers)))
+
+
+def test_large_groups_without_splitting():
+    centers = numpy.zeros((30000, 3))
+    report = PackReport()
+    packed = pack_material_group("Geom", centers, FakeBuffers, make_options(split_large_geoms=False), report)
+
+    assert len(packed) == 1 and packed[0].use_32_bit_indices
+    assert report.num_splits == 0 and len(report.warnings) == 1
+
+
+def test_pack_snapshot():
+    mesh, uvs = make_triangle_mesh(num_materials=2, seed=6)
+    snapshot = MeshSnapshot(mesh, uvs)
+    packed_geoms, report = pack_snapshot(snapshot, 3, make_options(generate_lods=True))
+
+    # The third material slot is unused, so it gets no geom
+    assert [index for index, buffers in packed_geoms] == [0, 1]
+    assert sum(buffers.num_triangles for index, buffers in packed_geoms) == len(mesh.polygons)
+    assert all(buffers.bounds is not None for index, buffers in packed_geoms)
+
+    assert len(report.lod_levels) == 2
+    previous = packed_geoms
+    for level_geoms in report.lod_levels:
+        for (index, buffers), (previous_index, previous_buffers) in zip(level_geoms, previous):
+            assert index == previous_index
+            assert buffers.num_triangles < previous_buffers.num_triangles
+        previous = level_geoms
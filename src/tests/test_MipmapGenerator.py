@@ -0,0 +1,74 @@
+import numpy
+import pytest
+
+from MipmapGenerator import srgb_to_linear, linear_to_srgb, get_mipmap_count, downsample, generate_mipmaps
+
+
+def test_srgb_round_trip():
+    values = numpy.linspace(0.0, 1.0, 101)
+    numpy.testing.assert_allclose(linear_to_srgb(srgb_to_linear(values)), values, atol=1e-9)
+    assert srgb_to_linear(numpy.array([0.5]))[0] == pytest.approx(0.214, abs=1e-3)
+
+
+@pytest.mark.parametrize("size, count", (((1, 1), 1), ((2, 2), 2), ((256, 256), 9), ((512, 64), 10),
+                                         ((5, 3), 3)))
+def test_get_mipmap_count(size, count):
+    assert get_mipmap_count(*size) == count
+
+
+def test_level_sizes():
+    levels = generate_mipmaps(numpy.zeros((32, 128, 4)))
+    assert [level.shape[:2] for level in levels] == [(32, 128), (16, 64), (8, 32), (4, 16), (2, 8), (1, 4),
+                                                     (1, 2), (1, 1)]
+    assert all(level.dtype == numpy.float32 for level in levels)
+
+    levels = generate_mipmaps(numpy.zeros((7, 5, 3)))
+    assert [level.shape[:2] for level in levels] == [(7, 5), (3, 2), (1, 1)]
+
+
+def test_downsample_averages_blocks():
+    pixels = numpy.arange(16, dtype=numpy.float32).reshape(4, 4, 1)
+    numpy.testing.assert_allclose(downsample(pixels)[:, :, 0], ((2.5, 4.5), (10.5, 12.5)))
+
+    # Single rows and columns are only filtered along the other axis
+    row = numpy.arange(4, dtype=numpy.float32).reshape(1, 4, 1)
+    numpy.testing.assert_allclose(downsample(row)[:, :, 0], ((0.5, 2.5), ))
+
+
+@pytest.mark.parametrize("use_srgb", (False, True))
+def test_constant_images_stay_constant(use_srgb):
+    pixels = numpy.empty((16, 8, 4), dtype=numpy.float32)
+    pixels[:] = (0.2, 0.5, 0.9, 0.3)
+
+    for level in generate_mipmaps(pixels, use_srgb=use_srgb):
+        numpy.testing.assert_allclose(level, numpy.broadcast_to(pixels[0, 0], level.shape), atol=1e-5)
+
+
+def test_srgb_colors_are_averaged_in_linear_space():
+    pixels = numpy.zeros((2, 2, 4), dtype=numpy.float32)
+    pixels[0, :] = 1.0
+
+    linear = generate_mipmaps(pixels)[1][0, 0]
+    srgb = generate_mipmaps(pixels, use_srgb=True)[1][0, 0]
+
+    assert linear[:3] == pytest.approx(0.5)
+    assert srgb[:3] == pytest.approx([float(linear_to_srgb(numpy.array(0.5)))] * 3, abs=1e-6)
+
+    # Alpha is never srgb encoded
+    assert srgb[3] == pytest.approx(0.5)
+
+
+def test_normal_maps_are_renormalized():
+    rng = numpy.random.RandomState(0)
+    normals = rng.normal(size=(16, 16, 3))
+    normals[:, :, 2] = numpy.abs(normals[:, :, 2]) + 0.5
+    normals /= numpy.linalg.norm(normals, axis=2)[:, :, numpy.newaxis]
+
+    levels = generate_mipmaps(normals * 0.5 + 0.5, is_normal_map=True)
+    for level in levels[1:]:
+        lengths = numpy.linalg.norm(level * 2.0 - 1.0, axis=2)
+        numpy.testing.assert_allclose(lengths, 1.0, atol=1e-5)
+
+    # Without renormalizing, averaging shortens the normals
+    plain = generate_mipmaps(normals * 0.5 + 0.5)[-1]
+    assert numpy.linalg.norm(plain * 2.0 - 1.0, axis=2).max() < 0.99
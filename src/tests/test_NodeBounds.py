@@ -0,0 +1,86 @@
+import numpy
+import pytest
+
+pytest.importorskip("pybamwriter.panda_types")
+
+from NodeBounds import get_vertex_bounds, transform_bounds, merge_bounds, format_bounds_tags, parse_bounds_tags
+
+
+def make_sphere_points(count=2000, seed=0):
+    points = numpy.random.RandomState(seed).normal(size=(count, 3))
+    return points / numpy.linalg.norm(points, axis=1)[:, numpy.newaxis]
+
+
+def assert_encloses(bounds, points):
+    box_min, box_max, radius = bounds
+    center = (numpy.array(box_min) + box_max) * 0.5
+    assert (points >= numpy.array(box_min) - 1e-9).all() and (points <= numpy.array(box_max) + 1e-9).all()
+    assert numpy.linalg.norm(points - center, axis=1).max() <= radius + 1e-9
+
+
+def test_get_vertex_bounds():
+    assert get_vertex_bounds(numpy.zeros((0, 3))) is None
+
+    box_min, box_max, radius = get_vertex_bounds([(0, 0, 0), (2, 0, 0), (1, 4, -1)])
+    assert box_min == (0, 0, -1) and box_max == (2, 4, 0)
+    assert radius == pytest.approx(numpy.linalg.norm((1, 2, 0.5)))
+
+
+def test_transform_bounds():
+    matrix = numpy.diag((2.0, 3.0, 1.0, 1.0))
+    matrix[:3, 3] = (1.0, 0.0, -1.0)
+    box_min, box_max, radius = transform_bounds(((-1, -1, -1), (1, 1, 1), 1.0), matrix)
+
+    assert box_min == (-1, -3, -2) and box_max == (3, 3, 0)
+    assert radius == pytest.approx(3.0)
+
+
+def test_transform_bounds_of_sheared_matrices():
+    # The unit sphere gets stretched by the spectral norm of the matrix, which
+    # is larger than its longest column
+    matrix = numpy.identity(4)
+    matrix[0, 1] = 3.0
+    bounds = transform_bounds(((-1, -1, -1), (1, 1, 1), 1.0), matrix)
+
+    assert bounds[0] == (-4, -1, -1) and bounds[1] == (4, 1, 1)
+    assert bounds[2] == pytest.approx(3.3028, abs=1e-4)
+    assert_encloses(bounds, make_sphere_points().dot(matrix[:3, :3].T))
+
+
+def test_transform_bounds_by_several_matrices():
+    points = make_sphere_points() * 0.5 + (1.0, 0.0, 0.0)
+    bounds = get_vertex_bounds(points)
+
+    rng = numpy.random.RandomState(1)
+    matrices = numpy.tile(numpy.identity(4), (5, 1, 1))
+    matrices[:, :3, :3] = rng.normal(size=(5, 3, 3))
+    matrices[:, :3, 3] = rng.normal(size=(5, 3)) * 4.0
+
+    transformed = numpy.concatenate([points.dot(matrix[:3, :3].T) + matrix[:3, 3] for matrix in matrices])
+    assert_encloses(transform_bounds(bounds, matrices), transformed)
+
+
+def test_merge_bounds():
+    first = ((0, 0, 0), (2, 2, 2), 1.0)
+    second = ((4, 0, 0), (6, 2, 2), 1.2)
+    box_min, box_max, radius = merge_bounds([first, second])
+
+    assert box_min == (0, 0, 0) and box_max == (6, 2, 2)
+    assert radius == pytest.approx(3.2)
+
+    # The radius is limited to the sphere enclosing the merged box
+    box_min, box_max, radius = merge_bounds([((0, 0, 0), (1, 1, 1), 10.0)])
+    assert radius == pytest.approx(numpy.sqrt(3.0) * 0.5)
+
+
+def test_bounds_tags_round_trip():
+    bounds = ((-1.5, 0.0, 2.25), (3.0, 1.0 / 3.0, 4.0), 2.875)
+    tags = format_bounds_tags(bounds)
+
+    assert tags["bounds_box"] == "-1.5 0 2.25 3 0.333333333 4"
+    assert tags["bounds_sphere"] == "0.75 0.166666667 3.125 2.875"
+
+    box_min, box_max, radius = parse_bounds_tags(tags)
+    numpy.testing.assert_allclose(box_min + box_max, bounds[0] + bounds[1], rtol=1e-8)
+    assert radius == bounds[2]
+    assert parse_bounds_tags({"bounds_box": tags["bounds_box"]}) is None
@@ -0,0 +1,92 @@
+import math
+import base64
+import struct
+import numpy
+
+from mesh_fixtures import Item, Collection
+from ParticleInstancer import compute_particle_matrices, pack_instance_transforms
+
+
+def multiply(a, b):
+    """ Multiplies two 4x4 matrices given as nested lists, like the * operator
+    of mathutils.Matrix """
+    return [[sum(a[row][k] * b[k][column] for k in range(4)) for column in range(4)] for row in range(4)]
+
+
+def translation(vector):
+    """ Reference of mathutils.Matrix.Translation """
+    return [[1.0, 0.0, 0.0, vector[0]], [0.0, 1.0, 0.0, vector[1]], [0.0, 0.0, 1.0, vector[2]],
+            [0.0, 0.0, 0.0, 1.0]]
+
+
+def scale(factor):
+    """ Reference of mathutils.Matrix.Scale(factor, 4) """
+    return [[factor if row == column and row < 3 else float(row == column) for column in range(4)]
+            for row in range(4)]
+
+
+def rotation(axis, angle):
+    """ Reference of mathutils.Matrix.Rotation(angle, 4, axis), using the
+    formula of Rodrigues instead of quaternions """
+    x, y, z = axis
+    c, s, t = math.cos(angle), math.sin(angle), 1.0 - math.cos(angle)
+    return [[t * x * x + c, t * x * y - s * z, t * x * z + s * y, 0.0],
+            [t * x * y + s * z, t * y * y + c, t * y * z - s * x, 0.0],
+            [t * x * z - s * y, t * y * z + s * x, t * z * z + c, 0.0],
+            [0.0, 0.0, 0.0, 1.0]]
+
+
+def make_particles(count, seed=0):
+    """ Returns particles with random transforms, and the axis and angle of
+    their rotations """
+    rng = numpy.random.RandomState(seed)
+    particles, rotations = Collection(), []
+    for i in range(count):
+        axis = rng.normal(size=3)
+        axis /= numpy.linalg.norm(axis)
+        angle = rng.uniform(-math.pi, math.pi)
+        quaternion = [math.cos(angle * 0.5)] + list(axis * math.sin(angle * 0.5))
+        particles.append(Item(location=tuple(rng.uniform(-10.0, 10.0, size=3)), rotation=tuple(quaternion),
+                              size=float(rng.uniform(0.1, 3.0))))
+        rotations.append((tuple(axis), angle))
+    return particles, rotations
+
+
+def test_particle_matrices_match_mathutils():
+    particles, rotations = make_particles(20)
+    particle_transform = multiply(translation((1.0, -2.0, 0.5)), rotation((0.0, 0.0, 1.0), 0.7))
+    particle_transform = multiply(particle_transform, scale(2.0))
+
+    matrices = compute_particle_matrices(particles, particle_transform)
+    assert matrices.shape == (20, 4, 4)
+
+    # particle_transform * location * rotation * scale, with the particle
+    # data rounded to single precision like blender stores it
+    for matrix, particle, (axis, angle) in zip(matrices, particles, rotations):
+        location = numpy.float32(particle.location).tolist()
+        size = float(numpy.float32(particle.size))
+        expected = multiply(particle_transform, multiply(translation(location),
+                                                         multiply(rotation(axis, angle), scale(size))))
+        numpy.testing.assert_allclose(matrix, expected, atol=1e-5)
+
+
+def test_no_particles():
+    matrices = compute_particle_matrices(Collection(), numpy.identity(4))
+    assert matrices.shape == (0, 4, 4)
+    assert pack_instance_transforms(matrices) == ""
+
+
+def test_packed_layout():
+    particles, rotations = make_particles(3, seed=1)
+    matrices = compute_particle_matrices(particles, numpy.identity(4))
+    data = base64.b64decode(pack_instance_transforms(matrices))
+
+    # Each instance is stored as 4 rows of 3 little endian floats. The rows
+    # of the Panda3D matrix are the columns of the blender matrix, so the
+    # last row is the translation
+    assert len(data) == 3 * 4 * 3 * 4
+    for index, matrix in enumerate(matrices):
+        values = struct.unpack("<12f", data[index * 48:(index + 1) * 48])
+        for row in range(4):
+            numpy.testing.assert_allclose(values[row * 3:row * 3 + 3], matrix[:3, row], rtol=1e-6, atol=1e-6)
+        numpy.testing.assert_allclose(values[9:], numpy.float32(particles[index].location), rtol=1e-6)
@@ -0,0 +1,89 @@
+import numpy
+
+from mesh_fixtures import Item
+from SkeletonIndex import SkeletonIndex
+
+
+class Matrix(object):
+
+    """ Minimal stand-in for mathutils.Matrix, using the 2.7x operators """
+
+    def __init__(self, values):
+        self.values = numpy.array(values, dtype=numpy.float64)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+    def __mul__(self, other):
+        return Matrix(self.values.dot(other.values))
+
+    def inverted(self):
+        return Matrix(numpy.linalg.inv(self.values))
+
+
+def make_bone(name, parent, translation, angle):
+    matrix = numpy.eye(4)
+    matrix[:2, :2] = ((numpy.cos(angle), -numpy.sin(angle)), (numpy.sin(angle), numpy.cos(angle)))
+    matrix[:3, 3] = translation
+    bone = Item(name=name, parent=parent, children=[], matrix_local=Matrix(matrix))
+    if parent is not None:
+        parent.children.append(bone)
+    return bone
+
+
+def make_armature():
+    root = make_bone("Root", None, (0.0, 0.0, 1.0), 0.3)
+    arm = make_bone('Arm "L"', root, (1.0, 0.0, 1.0), 0.8)
+    hand = make_bone("Hand\\L", arm, (2.0, 0.5, 1.0), -0.2)
+    other = make_bone("Other", None, (0.0, 3.0, 0.0), 0.0)
+    return Item(bones=[root, arm, hand, other])
+
+
+def test_bind_matrices_are_parent_relative():
+    armature = make_armature()
+    index = SkeletonIndex(armature)
+
+    assert [bone.name for bone in index.root_bones] == ["Root", "Other"]
+    for bone in armature.bones:
+        # Applying the rest matrix of the parent gives the rest matrix of the bone
+        bind_matrix = index.bind_arrays[bone.name]
+        if bone.parent is not None:
+            bind_matrix = bone.parent.matrix_local.values.dot(bind_matrix)
+        numpy.testing.assert_allclose(bind_matrix, bone.matrix_local.values, atol=1e-12)
+        numpy.testing.assert_allclose(numpy.array(index.inverse_net_transforms[bone.name]),
+                                      numpy.linalg.inv(bone.matrix_local.values), atol=1e-12)
+
+
+def test_get_fcurves():
+    index = SkeletonIndex(make_armature())
+    curves = [Item(data_path='pose.bones["Root"].location', array_index=2),
+              Item(data_path='pose.bones["Arm \\"L\\""].rotation_quaternion', array_index=0),
+              Item(data_path='pose.bones["Hand\\\\L"].scale', array_index=1),
+              Item(data_path='pose.bones["Missing"].location', array_index=0),
+              Item(data_path='pose.bones["Root"].constraints["IK"].influence', array_index=0),
+              Item(data_path="location", array_index=0)]
+    action = Item(name="Walk", fcurves=curves)
+
+    fcurves = index.get_fcurves(action)
+    assert fcurves == {("Root", "location", 2): curves[0],
+                       ('Arm "L"', "rotation_quaternion", 0): curves[1],
+                       ("Hand\\L", "scale", 1): curves[2]}
+
+    # The fcurves are looked up only once per action
+    action.fcurves = []
+    assert index.get_fcurves(action) is fcurves
+
+
+def test_get_bone_curves():
+    armature = make_armature()
+    index = SkeletonIndex(armature)
+    pose_bones = {bone.name: Item(location=(1.0, 2.0, 3.0), rotation_quaternion=(1.0, 0.0, 0.0, 0.0),
+                                  scale=(1.0, 1.0, 1.0)) for bone in armature.bones}
+    rest_values = index.get_rest_values(Item(bones=pose_bones))
+
+    curve = Item(data_path='pose.bones["Root"].location', array_index=1)
+    fcurves = index.get_fcurves(Item(name="Action", fcurves=[curve]))
+
+    assert index.get_bone_curves(fcurves, "Root", rest_values) == \
+        [1.0, curve, 3.0, 1.0, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0]
+    assert index.get_bone_curves(fcurves, "Other", rest_values) == rest_values["Other"]
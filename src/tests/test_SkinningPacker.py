@@ -0,0 +1,83 @@
+import numpy
+import pytest
+
+from SkinningPacker import limit_influences, pack_vertex_influences, interleave_skinning_columns, find_unique_blends
+
+
+def test_limit_influences():
+    influences = ((3, 0.1), (1, 0.4), (2, 0.3), (0, 0.2))
+
+    limited = limit_influences(influences, 2)
+    assert [group for group, weight in limited] == [1, 2]
+    assert [weight for group, weight in limited] == pytest.approx([4.0 / 7.0, 3.0 / 7.0])
+
+    assert sum(weight for group, weight in limit_influences(influences, 4)) == pytest.approx(1.0)
+    assert limit_influences((), 4) == ()
+    assert limit_influences(((0, 0.0), ), 4) == ()
+
+    # Equal weights are ordered by their group, so the result is deterministic
+    assert [group for group, weight in limit_influences(((5, 0.5), (2, 0.5), (7, 0.5)), 2)] == [2, 5]
+
+
+def test_pack_vertex_influences():
+    vertex_groups = [((4, 1.0), ),
+                     ((4, 0.25), (7, 0.75)),
+                     ((1, 0.1), (4, 0.2), (7, 0.3), (9, 0.4)),
+                     ()]
+    source_indices = [1, 0, 1, 2, 3, 2]
+
+    groups, indices, weights, num_limited = pack_vertex_influences(vertex_groups, source_indices, 3)
+
+    # Only the used groups get a transform, in the order of their first use
+    assert groups == [4, 7, 9]
+    assert num_limited == 1
+    assert indices.shape == weights.shape == (6, 3)
+    assert weights.dtype == numpy.float32
+
+    numpy.testing.assert_allclose(weights.sum(axis=1), (1.0, 1.0, 1.0, 1.0, 0.0, 1.0), rtol=1e-6)
+    numpy.testing.assert_array_equal(indices[0], indices[2])
+    numpy.testing.assert_array_equal(weights[3], weights[5])
+
+    # Each vertex references the groups of its source vertex, strongest first
+    for row, source_index in enumerate(source_indices):
+        expected = limit_influences(vertex_groups[source_index], 3)
+        used = [(groups[index], weight) for index, weight in zip(indices[row], weights[row]) if weight > 0.0]
+        assert [group for group, weight in used] == [group for group, weight in expected]
+        assert [weight for group, weight in used] == pytest.approx([weight for group, weight in expected])
+
+
+def test_interleave_skinning_columns():
+    indices = numpy.array([[0, 1], [2, 0]], dtype=numpy.uint16)
+    weights = numpy.array([[0.75, 0.25], [1.0, 0.0]], dtype=numpy.float32)
+
+    data, index_size = interleave_skinning_columns(indices, weights)
+    assert index_size == 1
+    assert len(data) == 2 * (2 * 4 + 2)
+
+    rows = numpy.frombuffer(data, dtype=[("weight", "<f4", (2, )), ("index", "<u1", (2, ))])
+    numpy.testing.assert_array_equal(rows["weight"], weights)
+    numpy.testing.assert_array_equal(rows["index"], indices)
+
+    # More than 256 transforms need two bytes per index
+    data, index_size = interleave_skinning_columns(indices * 200, weights)
+    assert index_size == 2
+    rows = numpy.frombuffer(data, dtype=[("weight", "<f4", (2, )), ("index", "<u2", (2, ))])
+    numpy.testing.assert_array_equal(rows["index"], indices * 200)
+
+
+def test_find_unique_blends():
+    vertex_groups = [((1, 0.5), (0, 0.5)),
+                     ((0, 0.5), (1, 0.5)),
+                     ((0, 0.5 + 1e-7), (1, 0.5 - 1e-7)),
+                     ((0, 0.6), (1, 0.4)),
+                     ()]
+    source_indices = [0, 1, 2, 3, 0, 4, 3]
+
+    unique_influences, rows = find_unique_blends(vertex_groups, source_indices)
+
+    # Influences in another order, or equal within the weight steps, share a blend
+    assert unique_influences == [[(0, 0.5), (1, 0.5)], [(0, 0.6), (1, 0.4)], []]
+    assert rows == [0, 0, 0, 1, 0, 2, 1]
+
+    unique_influences, rows = find_unique_blends(vertex_groups, source_indices, weight_steps=1e9)
+    assert len(unique_influences) == 4 and rows == [0, 0, 1, 2, 0, 3, 2]
@@ -0,0 +1,88 @@
+import numpy
+import pytest
+
+pytest.importorskip("pybamwriter.panda_types")
+
+from mesh_fixtures import Item
+from GeomBuffers import GeomBuffers
+from StaticBatcher import StaticBatcher, transform_buffers, merge_buffers, MAX_BATCH_VERTICES
+
+
+def make_triangle(name="Triangle", offset=0.0):
+    buffers = GeomBuffers(name)
+    vertices = numpy.array([(offset, 0, 0, 0, 0, 1), (offset + 1, 0, 0, 0, 0, 1), (offset, 1, 0, 1, 0, 0)],
+                           dtype=numpy.float32)
+    buffers.vertex_buffer.frombytes(vertices.tobytes())
+    buffers.index_buffer.extend((0, 1, 2))
+    buffers.num_vertices = 3
+    buffers.num_triangles = 1
+    return buffers
+
+
+def get_vertices(buffers):
+    return numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32).reshape(-1, buffers.vertex_stride)
+
+
+def test_transform_buffers():
+    matrix = numpy.diag((2.0, 4.0, 1.0, 1.0))
+    matrix[:3, 3] = (1.0, 2.0, 3.0)
+    buffers = make_triangle()
+    transform_buffers(buffers, matrix)
+
+    vertices = get_vertices(buffers)
+    numpy.testing.assert_allclose(vertices[:, :3], ((1, 2, 3), (3, 2, 3), (1, 6, 3)))
+
+    # Normals stay normalized under non uniform scales
+    numpy.testing.assert_allclose(vertices[:, 3:6], ((0, 0, 1), (0, 0, 1), (1, 0, 0)))
+    assert list(buffers.index_buffer) == [0, 1, 2]
+
+
+def test_transform_buffers_normals_stay_perpendicular():
+    shear = numpy.eye(4)
+    shear[0, 1] = 1.5
+    buffers = make_triangle()
+    edges_before = get_vertices(buffers)[1:, :3] - get_vertices(buffers)[0, :3]
+    transform_buffers(buffers, shear)
+
+    vertices = get_vertices(buffers)
+    edges = vertices[1:, :3] - vertices[0, :3]
+    numpy.testing.assert_allclose(numpy.linalg.norm(vertices[:, 3:6], axis=1), 1.0, rtol=1e-6)
+    numpy.testing.assert_allclose(edges.dot(vertices[0, 3:6]), 0.0, atol=1e-6)
+    assert not numpy.allclose(edges, edges_before)
+
+
+def test_mirroring_flips_the_winding():
+    buffers = make_triangle()
+    transform_buffers(buffers, numpy.diag((-1.0, 1.0, 1.0, 1.0)))
+    assert list(buffers.index_buffer) == [0, 2, 1]
+    numpy.testing.assert_allclose(get_vertices(buffers)[0, 3:6], (0, 0, 1))
+
+
+def test_merge_buffers():
+    parts = [make_triangle(offset=float(i)) for i in range(3)]
+    merged = merge_buffers("Merged", parts)
+
+    assert merged.num_vertices == 9 and merged.num_triangles == 3
+    assert list(merged.index_buffer) == [0, 1, 2, 3, 4, 5, 6, 7, 8]
+    assert not merged.use_32_bit_indices
+    assert merged.bounds is not None
+    numpy.testing.assert_array_equal(get_vertices(merged), numpy.concatenate([get_vertices(part) for part in parts]))
+
+
+def test_split_chunks():
+    batcher = StaticBatcher(None, 10.0)
+    sizes = [40000, 20000, 10000, 70000, 5000]
+    parts = [Item(num_vertices=size) for size in sizes]
+
+    # Buffers which are too large on their own still get a chunk
+    chunks = [[part.num_vertices for part in chunk] for chunk in batcher._split_chunks(parts)]
+    assert chunks == [[40000, 20000], [10000], [70000], [5000]]
+    assert all(sum(chunk) <= MAX_BATCH_VERTICES for chunk in chunks if len(chunk) > 1)
+
+
+def test_get_cell():
+    batcher = StaticBatcher(None, 10.0)
+    matrix = numpy.eye(4)
+    matrix[:3, 3] = (25.0, -5.0, 0.0)
+    obj = Item(matrix_world=matrix, bound_box=[(-1, -1, -1), (1, 1, 1)])
+    assert batcher.get_cell(obj) == (2, -1, 0)
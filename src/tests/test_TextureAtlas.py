@@ -0,0 +1,103 @@
+import random
+import numpy
+import pytest
+
+from TextureAtlas import pack_rectangles, pad_image, remap_texcoords, REGION_ALIGNMENT
+
+
+def random_sizes(count, seed, max_size=128):
+    rng = random.Random(seed)
+    return [(rng.randrange(1, max_size // REGION_ALIGNMENT + 1) * REGION_ALIGNMENT,
+             rng.randrange(1, max_size // REGION_ALIGNMENT + 1) * REGION_ALIGNMENT) for i in range(count)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_packed_rectangles_do_not_overlap(seed):
+    sizes = random_sizes(120, seed)
+    placements, atlas_sizes = pack_rectangles(sizes, 512)
+
+    assert len(placements) == len(sizes)
+    for atlas, (atlas_width, atlas_height) in enumerate(atlas_sizes):
+        coverage = numpy.zeros((atlas_height, atlas_width), dtype=numpy.int32)
+        for (width, height), (index, x, y) in zip(sizes, placements):
+            if index == atlas:
+                # Every rectangle lies within its atlas, so this never clips
+                assert x + width <= atlas_width and y + height <= atlas_height
+                coverage[y:y + height, x:x + width] += 1
+        assert coverage.max() == 1
+
+
+def test_atlas_sizes_are_powers_of_two():
+    sizes = random_sizes(60, seed=7, max_size=200)
+    placements, atlas_sizes = pack_rectangles(sizes, 256)
+
+    assert len(atlas_sizes) > 1
+    for width, height in atlas_sizes:
+        assert width & (width - 1) == 0 and height & (height - 1) == 0
+        assert width <= 256 and height <= 256
+
+    # Aligned rectangles keep aligned positions
+    assert all(x % REGION_ALIGNMENT == 0 and y % REGION_ALIGNMENT == 0 for atlas, x, y in placements)
+
+
+def test_small_sets_shrink_the_atlas():
+    placements, atlas_sizes = pack_rectangles([(64, 32), (32, 32), (16, 8)], 1024)
+    assert atlas_sizes == [(128, 32)]
+    assert placements == [(0, 0, 0), (0, 64, 0), (0, 96, 0)]
+
+
+def test_oversized_rectangles_are_rejected():
+    with pytest.raises(ValueError):
+        pack_rectangles([(32, 32), (300, 16)], 256)
+
+
+@pytest.mark.parametrize("channels", (1, 2, 3, 4))
+def test_pad_image(channels):
+    pixels = numpy.random.RandomState(0).rand(3, 5, channels).astype(numpy.float32)
+    padded = pad_image(pixels, 2, 12, 8)
+
+    assert padded.shape == (8, 12, 4)
+    inner = padded[2:5, 2:7]
+    if channels >= 3:
+        numpy.testing.assert_array_equal(inner[:, :, :3], pixels[:, :, :3])
+    else:
+        numpy.testing.assert_array_equal(inner[:, :, :3], pixels[:, :, :1].repeat(3, axis=2))
+    numpy.testing.assert_array_equal(inner[:, :, 3], pixels[:, :, 3] if channels == 4 else
+                                     pixels[:, :, 1] if channels == 2 else 1.0)
+
+    # The border pixels get repeated into the padding
+    numpy.testing.assert_array_equal(padded[:2, 2:7], inner[:1].repeat(2, axis=0))
+    numpy.testing.assert_array_equal(padded[5:, 7:], numpy.broadcast_to(inner[-1, -1], (3, 5, 4)))
+
+
+def make_buffers(texcoords):
+    pytest.importorskip("pybamwriter.panda_types")
+    from GeomBuffers import GeomBuffers
+
+    buffers = GeomBuffers("Geom", have_texcoords=True)
+    vertices = numpy.zeros((len(texcoords), 8), dtype=numpy.float32)
+    vertices[:, :3] = numpy.arange(len(texcoords))[:, numpy.newaxis]
+    vertices[:, 6:8] = texcoords
+    buffers.vertex_buffer.frombytes(vertices.tobytes())
+    buffers.num_vertices = len(texcoords)
+    return buffers
+
+
+def get_vertices(buffers):
+    return numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32).reshape(-1, 8)
+
+
+def test_remap_texcoords():
+    buffers = make_buffers([(0.0, 0.0), (1.0, 0.5), (1.0005, -0.0005)])
+    assert remap_texcoords(buffers, (0.25, 0.5), (0.5, 0.25))
+
+    vertices = get_vertices(buffers)
+    numpy.testing.assert_allclose(vertices[:, 6:8], ((0.25, 0.5), (0.75, 0.625), (0.75, 0.5)))
+    numpy.testing.assert_array_equal(vertices[:, :3], numpy.arange(3)[:, numpy.newaxis].repeat(3, axis=1))
+
+
+def test_repeating_texcoords_are_not_remapped():
+    buffers = make_buffers([(0.0, 0.0), (2.0, 0.5)])
+    vertex_buffer = buffers.vertex_buffer
+    assert not remap_texcoords(buffers, (0.25, 0.5), (0.5, 0.25))
+    assert buffers.vertex_buffer is vertex_buffer
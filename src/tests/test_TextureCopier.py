@@ -0,0 +1,153 @@
+import os
+import json
+import pytest
+
+from ExportException import ExportException
+from TextureCopier import FileHashIndex, TextureCopier
+
+
+def write_file(path, content, mtime=None):
+    with open(path, "wb") as handle:
+        handle.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def run_copier(index, copies, use_hardlinks=False):
+    copier = TextureCopier(index, use_hardlinks)
+    for source, dest in copies:
+        copier.copy(source, dest)
+    copier.finish()
+    return copier
+
+
+def test_index_hashes_files_once(tmpdir):
+    path = write_file(str(tmpdir.join("a.png")), b"pixels")
+    index = FileHashIndex(str(tmpdir.join("index.json")))
+
+    assert index.lookup(path) is None
+    content_hash = index.get_hash(path)
+    assert index.get_hash(path) == content_hash
+    assert index.num_hashed == 1
+    assert index.lookup(str(tmpdir.join("missing.png"))) is None
+
+
+def test_index_detects_changed_files(tmpdir):
+    path = write_file(str(tmpdir.join("a.png")), b"pixels", mtime=1000000)
+    index = FileHashIndex(str(tmpdir.join("index.json")))
+    content_hash = index.get_hash(path)
+
+    write_file(path, b"other", mtime=1000000)
+    assert index.lookup(path) is None
+    assert index.get_hash(path) != content_hash
+
+    os.utime(path, (2000000, 2000000))
+    assert index.lookup(path) is None
+
+
+def test_index_persists(tmpdir):
+    index_path = str(tmpdir.join("sub", "index.json"))
+    kept = write_file(str(tmpdir.join("a.png")), b"a")
+    deleted = write_file(str(tmpdir.join("b.png")), b"b")
+
+    index = FileHashIndex(index_path)
+    content_hash = index.get_hash(kept)
+    index.get_hash(deleted)
+    os.remove(deleted)
+    index.save()
+
+    # Entries of deleted files are dropped when saving
+    loaded = FileHashIndex(index_path)
+    assert loaded.lookup(kept) == content_hash
+    assert len(loaded.entries) == 1
+
+    # Indices of another version or broken files are ignored
+    with open(index_path, "w") as handle:
+        json.dump({"version": FileHashIndex.INDEX_VERSION + 1, "entries": loaded.entries}, handle)
+    assert FileHashIndex(index_path).entries == {}
+    write_file(index_path, b"{broken")
+    assert FileHashIndex(index_path).entries == {}
+
+
+def test_index_merges_concurrent_saves(tmpdir):
+    index_path = str(tmpdir.join("index.json"))
+    first_path = write_file(str(tmpdir.join("a.png")), b"a")
+    second_path = write_file(str(tmpdir.join("b.png")), b"b")
+
+    # Two exports load the index at the same time, each hashing other files
+    first, second = FileHashIndex(index_path), FileHashIndex(index_path)
+    first_hash = first.get_hash(first_path)
+    second_hash = second.get_hash(second_path)
+    first.save()
+    second.save()
+
+    loaded = FileHashIndex(index_path)
+    assert loaded.lookup(first_path) == first_hash
+    assert loaded.lookup(second_path) == second_hash
+    assert sorted(os.listdir(str(tmpdir))) == ["a.png", "b.png", "index.json"]
+
+
+@pytest.mark.parametrize("use_hardlinks", (False, True))
+def test_copier_skips_unchanged_destinations(tmpdir, use_hardlinks):
+    source = write_file(str(tmpdir.join("source.png")), b"pixels" * 1000)
+    dest = str(tmpdir.join("dest.png"))
+    index = FileHashIndex(str(tmpdir.join("index.json")))
+
+    copier = run_copier(index, [(source, dest), (source, dest)], use_hardlinks)
+    assert (copier.num_copied + copier.num_linked, copier.num_skipped) == (1, 0)
+    if not use_hardlinks:
+        assert copier.num_copied_bytes == 6000
+    with open(dest, "rb") as handle:
+        assert handle.read() == b"pixels" * 1000
+
+    copier = run_copier(index, [(source, dest)], use_hardlinks)
+    assert (copier.num_copied, copier.num_linked, copier.num_skipped) == (0, 0, 1)
+    assert not [name for name in os.listdir(str(tmpdir)) if name.endswith(".tmp")]
+
+
+def test_copies_use_unique_temporary_files(tmpdir):
+    source = write_file(str(tmpdir.join("source.png")), b"new")
+    dest = str(tmpdir.join("dest.png"))
+
+    # A leftover temporary file of another export is neither used nor removed
+    other = write_file(dest + ".tmp", b"other")
+    run_copier(FileHashIndex(str(tmpdir.join("index.json"))), [(source, dest)])
+    with open(dest, "rb") as handle:
+        assert handle.read() == b"new"
+    with open(other, "rb") as handle:
+        assert handle.read() == b"other"
+
+
+def test_copier_replaces_changed_destinations(tmpdir):
+    source = write_file(str(tmpdir.join("source.png")), b"new")
+    dest = write_file(str(tmpdir.join("dest.png")), b"old")
+    index = FileHashIndex(str(tmpdir.join("index.json")))
+
+    copier = run_copier(index, [(source, dest)])
+    assert copier.num_copied == 1
+    with open(dest, "rb") as handle:
+        assert handle.read() == b"new"
+
+
+def test_copier_reports_errors(tmpdir):
+    index = FileHashIndex(str(tmpdir.join("index.json")))
+    with pytest.raises(ExportException):
+        run_copier(index, [(str(tmpdir.join("missing.png")), str(tmpdir.join("dest.png")))])
+
+
+def test_shared_index_skips_hashing_copies(tmpdir):
+    source = write_file(str(tmpdir.join("source.png")), b"pixels")
+    dest = str(tmpdir.join("dest.png"))
+    index_path = str(tmpdir.join("index.json"))
+
+    index = FileHashIndex(index_path)
+    run_copier(index, [(source, dest)])
+    index.save()
+
+    # The copy is indexed with the hash of its source, so a later export
+    # neither hashes the source nor the copy again
+    index = FileHashIndex(index_path)
+    assert index.lookup(dest) == index.lookup(source) is not None
+    copier = run_copier(index, [(source, dest)])
+    assert copier.num_skipped == 1 and index.num_hashed == 0
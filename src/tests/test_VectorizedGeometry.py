@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("pybamwriter.panda_types")
+
+from mesh_fixtures import make_triangle_mesh, Collection
+from MeshPacker import pack_polygons
+from VectorizedGeometry import MeshSnapshot, pack_triangles
+
+
+BUFFER_ATTRIBUTES = ("vertex_buffer", "index_buffer", "source_indices",
+                     "num_vertices", "num_triangles", "num_duplicated")
+
+
+def assert_same_buffers(expected, actual):
+    for attribute in BUFFER_ATTRIBUTES:
+        assert getattr(actual, attribute) == getattr(expected, attribute), attribute
+
+
+def pack_both(mesh, uvs, reuse_vertices=True):
+    """ Packs each material group of the mesh with both engines """
+    snapshot = MeshSnapshot(mesh, uvs)
+    for material_index, polygon_indices in enumerate(snapshot.group_polygons_by_material(3)):
+        polygons = [poly for poly in mesh.polygons if poly.material_index == material_index]
+        expected = pack_polygons(mesh, polygons, uvs, reuse_vertices=reuse_vertices)
+        actual = pack_triangles(snapshot, polygon_indices, reuse_vertices=reuse_vertices)
+        yield expected, actual
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("use_uvs", (True, False))
+@pytest.mark.parametrize("reuse_vertices", (True, False))
+def test_engines_produce_identical_buffers(seed, use_uvs, reuse_vertices):
+    mesh, uvs = make_triangle_mesh(uv_grid=2 + seed % 3, seed=seed)
+    for expected, actual in pack_both(mesh, uvs if use_uvs else None, reuse_vertices):
+        assert_same_buffers(expected, actual)
+
+
+@pytest.mark.parametrize("smooth_ratio", (0.0, 1.0))
+def test_engines_agree_on_flat_and_smooth_meshes(smooth_ratio):
+    mesh, uvs = make_triangle_mesh(smooth_ratio=smooth_ratio, seed=3)
+    for expected, actual in pack_both(mesh, uvs):
+        assert_same_buffers(expected, actual)
+        if smooth_ratio == 0.0:
+            assert actual.num_vertices == actual.num_triangles * 3
+
+
+def test_uv_seams_duplicate_vertices():
+    # A single uv grid cell means all corners share their texcoords, more
+    # cells force duplicates along the seams
+    mesh, uvs = make_triangle_mesh(uv_grid=1, smooth_ratio=1.0, seed=5)
+    for expected, actual in pack_both(mesh, uvs):
+        assert actual.num_duplicated == 0
+
+    mesh, uvs = make_triangle_mesh(uv_grid=4, smooth_ratio=1.0, seed=5)
+    assert sum(actual.num_duplicated for expected, actual in pack_both(mesh, uvs)) > 0
+
+
+def test_empty_group():
+    mesh, uvs = make_triangle_mesh(seed=1)
+    snapshot = MeshSnapshot(mesh, uvs)
+    expected = pack_polygons(mesh, Collection(), uvs)
+    actual = pack_triangles(snapshot, [])
+    assert_same_buffers(expected, actual)
+    assert actual.num_vertices == 0
@@ -0,0 +1,101 @@
+import random
+import numpy
+import pytest
+
+from VertexCacheOptimizer import compute_acmr, reorder_triangles, optimize_vertex_cache
+
+
+def make_grid_indices(size, seed=0):
+    """ Returns the triangles of a size x size quad grid, in random order """
+    triangles = []
+    for y in range(size):
+        for x in range(size):
+            a, b = y * (size + 1) + x, y * (size + 1) + x + 1
+            c, d = a + size + 1, b + size + 1
+            triangles.extend([(a, b, d), (a, d, c)])
+    random.Random(seed).shuffle(triangles)
+    return [index for triangle in triangles for index in triangle], (size + 1) ** 2
+
+
+def split_triangles(indices):
+    return sorted(tuple(indices[i:i + 3]) for i in range(0, len(indices), 3))
+
+
+def test_compute_acmr():
+    assert compute_acmr([]) == 0.0
+    assert compute_acmr([0, 1, 2]) == 3.0
+    assert compute_acmr([0, 1, 2, 2, 1, 3]) == 2.0
+
+    # With a cache of 3 vertices, vertex 0 is evicted before it is used again
+    indices = [0, 1, 2, 2, 1, 3, 0, 1, 2]
+    assert compute_acmr(indices, cache_size=3) == 7 / 3
+    assert compute_acmr(indices, cache_size=4) == 4 / 3
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_reorder_keeps_triangles(seed):
+    indices, num_vertices = make_grid_indices(12, seed)
+    result = reorder_triangles(indices, num_vertices)
+
+    # Every triangle is kept exactly once, with its winding order
+    assert split_triangles(result) == split_triangles(indices)
+
+
+def test_reorder_improves_acmr():
+    indices, num_vertices = make_grid_indices(24)
+    result = reorder_triangles(indices, num_vertices)
+
+    assert compute_acmr(result) < 0.8
+    assert compute_acmr(result) < compute_acmr(indices) * 0.5
+
+
+def make_grid_buffers(size):
+    pytest.importorskip("pybamwriter.panda_types")
+    from GeomBuffers import GeomBuffers
+
+    indices, num_vertices = make_grid_indices(size)
+    buffers = GeomBuffers("Grid")
+    vertices = numpy.zeros((num_vertices, buffers.vertex_stride), dtype=numpy.float32)
+    vertices[:, 0] = numpy.arange(num_vertices)
+    buffers.vertex_buffer.frombytes(vertices.tobytes())
+    buffers.index_buffer.extend(indices)
+    buffers.source_indices.extend(range(num_vertices))
+    buffers.num_vertices = num_vertices
+    buffers.num_triangles = len(indices) // 3
+    return buffers
+
+
+def get_corner_sources(buffers):
+    """ Returns the triangles as tuples of their source vertices """
+    return split_triangles([buffers.source_indices[index] for index in buffers.index_buffer])
+
+
+def test_optimize_vertex_cache():
+    buffers = make_grid_buffers(10)
+    expected = get_corner_sources(buffers)
+
+    acmr_before, acmr_after = optimize_vertex_cache(buffers)
+
+    assert acmr_after < acmr_before
+    assert get_corner_sources(buffers) == expected
+
+    # The vertices are numbered in the order of their first use, and their
+    # positions moved along
+    first_use = list(dict.fromkeys(buffers.index_buffer))
+    assert first_use == list(range(buffers.num_vertices))
+    positions = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32)[::buffers.vertex_stride]
+    assert positions.tolist() == list(buffers.source_indices)
+
+
+def test_optimize_vertex_cache_skips_large_geoms():
+    buffers = make_grid_buffers(10)
+    expected = [buffers.source_indices[index] for index in buffers.index_buffer]
+    acmr = compute_acmr(buffers.index_buffer)
+
+    # The ACMR is still reported, it does not change by renumbering
+    assert optimize_vertex_cache(buffers, max_triangles=buffers.num_triangles - 1) == (acmr, acmr)
+    assert compute_acmr(buffers.index_buffer) == acmr
+
+    # Only the vertices get renumbered, the triangle order is kept
+    assert [buffers.source_indices[index] for index in buffers.index_buffer] == expected
+    assert list(dict.fromkeys(buffers.index_buffer)) == list(range(buffers.num_vertices))
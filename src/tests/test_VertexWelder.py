@@ -0,0 +1,100 @@
+import numpy
+import pytest
+
+pytest.importorskip("pybamwriter.panda_types")
+
+from mesh_fixtures import make_triangle_mesh
+from GeomBuffers import GeomBuffers
+from VectorizedGeometry import MeshSnapshot, pack_triangles
+from VertexWelder import weld_vertices
+
+
+def corner_attributes(buffers):
+    """ Returns the vertex data of every triangle corner """
+    vertices = numpy.frombuffer(buffers.vertex_buffer, dtype=numpy.float32)
+    vertices = vertices.reshape(buffers.num_vertices, buffers.vertex_stride)
+    return vertices[numpy.array(buffers.index_buffer, dtype=numpy.int64)]
+
+
+def make_buffers(vertices, sources, indices):
+    buffers = GeomBuffers("Geom", have_texcoords=False)
+    buffers.vertex_buffer.extend(numpy.asarray(vertices, dtype=numpy.float32).reshape(-1).tolist())
+    buffers.source_indices.extend(sources)
+    buffers.index_buffer.extend(indices)
+    buffers.num_vertices = len(sources)
+    buffers.num_triangles = len(indices) // 3
+    return buffers
+
+
+def pack_unshared(seed, use_uvs=True):
+    mesh, uvs = make_triangle_mesh(seed=seed)
+    snapshot = MeshSnapshot(mesh, uvs if use_uvs else None)
+    return pack_triangles(snapshot, range(len(mesh.polygons)), reuse_vertices=False)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_weld_preserves_triangles(seed):
+    buffers = pack_unshared(seed)
+    expected = corner_attributes(buffers)
+
+    num_welded = weld_vertices(buffers)
+
+    assert num_welded > 0
+    assert buffers.num_vertices == len(buffers.source_indices)
+    assert len(buffers.vertex_buffer) == buffers.num_vertices * buffers.vertex_stride
+    numpy.testing.assert_array_equal(corner_attributes(buffers), expected)
+
+
+@pytest.mark.parametrize("epsilon", (0.0, 1e-4))
+def test_weld_is_idempotent(epsilon):
+    buffers = pack_unshared(seed=2)
+    weld_vertices(buffers, epsilon)
+    vertex_buffer, index_buffer = buffers.vertex_buffer[:], buffers.index_buffer[:]
+
+    assert weld_vertices(buffers, epsilon) == 0
+    assert buffers.vertex_buffer == vertex_buffer
+    assert buffers.index_buffer == index_buffer
+
+
+def test_weld_matches_shared_packing():
+    # On smooth meshes without texcoords, welding the unshared corners gives
+    # the same vertex count as reusing the vertices while packing
+    mesh, uvs = make_triangle_mesh(smooth_ratio=1.0, seed=4)
+    snapshot = MeshSnapshot(mesh)
+    shared = pack_triangles(snapshot, range(len(mesh.polygons)))
+    unshared = pack_triangles(snapshot, range(len(mesh.polygons)), reuse_vertices=False)
+
+    weld_vertices(unshared)
+    assert unshared.num_vertices == shared.num_vertices
+    assert unshared.num_duplicated == shared.num_duplicated
+
+
+def test_weld_merges_signed_zeros():
+    buffers = make_buffers([(1, 2, 3, 0.0, 0.0, 1.0), (1, 2, 3, -0.0, 0.0, 1.0),
+                            (4, 5, 6, 0.0, 1.0, 0.0)], [0, 0, 1], [0, 1, 2])
+    assert weld_vertices(buffers) == 1
+    assert list(buffers.index_buffer) == [0, 0, 1]
+
+
+def test_weld_epsilon():
+    vertices = [(0, 0, 0, 0.0, 0.0, 1.0), (0, 0, 0, 0.0, 0.00001, 1.0), (0, 0, 0, 0.0, 0.5, 1.0)]
+    assert weld_vertices(make_buffers(vertices, [0, 0, 0], [0, 1, 2])) == 0
+    assert weld_vertices(make_buffers(vertices, [0, 0, 0], [0, 1, 2]), epsilon=1e-3) == 1
+
+    # Vertices of different mesh vertices are never merged
+    assert weld_vertices(make_buffers(vertices, [0, 1, 2], [0, 1, 2]), epsilon=1.0) == 0
+
+
+def test_weld_epsilon_across_grid_cells():
+    # Both values are within epsilon, but would snap to different cells of an
+    # epsilon sized grid
+    vertices = [(0, 0, 0, 0.0, 0.0049, 1.0), (0, 0, 0, 0.0, 0.0051, 1.0), (0, 0, 0, 0.0, 0.0162, 1.0)]
+    buffers = make_buffers(vertices, [0, 0, 0], [0, 1, 2])
+    assert weld_vertices(buffers, epsilon=0.01) == 1
+    assert list(buffers.index_buffer) == [0, 0, 1]
+
+    # Vertices closer than epsilon to a merged vertex join it
+    vertices.append((0, 0, 0, 0.0, 0.0125, 1.0))
+    buffers = make_buffers(vertices, [0, 0, 0, 0], [0, 1, 2, 3, 3, 3])
+    assert weld_vertices(buffers, epsilon=0.01) == 3
+    assert buffers.num_vertices == 1